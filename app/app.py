@@ -7,22 +7,45 @@ from flask import Flask
 from flask_caching import Cache
 
 from config import config, PAGE_TITLE
-from models.database import init_db
+from models.database import init_db, release_db_connection
 from utils.helpers import ReverseProxied
+from utils.metrics import lti_operation_seconds, lti_operation_errors, register_request_metrics, timed
+from services.cache_backends import get_cache_type
 from services.docker_service import cleanup_all_containers, cleanup_expired_instances, start_master_juice_shop, stop_master_juice_shop
+from services.pool_service import start_pool_refiller
+from services.container_state import start_container_state_watcher
+from services.solve_poller import start_solve_poller
+from services.readiness import start_readiness_prober
+from services.grade_outbox import start_grade_sender
+from services.lti_credentials import CachingServiceConnector, get_platform_public_key
 from routes import all_blueprints
 from pylti1p3.contrib.flask import FlaskMessageLaunch
 
 app = Flask('Thesis', template_folder='templates', static_folder='static')
 app.wsgi_app = ReverseProxied(app.wsgi_app)
 app.config.from_mapping(config)
+app.config['CACHE_TYPE'] = get_cache_type(app.config)
 
 # Store cache as an app attribute so it can be easily accessed
 cache = Cache(app)
 app.cache = cache  # Make it accessible directly
 
 # Initialize database with explicit db_path
-init_db(app.config['DB_PATH'])
+db_init_result = init_db(app.config['DB_PATH'])
+for version, description in db_init_result['applied']:
+    app.logger.info(f"Applied database migration {version}: {description}")
+for query_name, plan_step in db_init_result['plan_regressions']:
+    app.logger.warning(f"Query {query_name} is not served by an index: {plan_step}")
+
+# Return each request's pooled database connection when its app context ends
+app.teardown_appcontext(release_db_connection)
+
+# Time every request for /metrics
+register_request_metrics(app)
+
+# Juice Shop is deliberately XSS-able; on the tool's origin its scripts could read the tool's pages
+if app.config['PROXY_ENABLED'] and not app.config['PROXY_BASE_URL']:
+    app.logger.warning("PROXY_ENABLED without PROXY_BASE_URL serves instances on the tool's own origin; set a separate origin")
 
 # Define the ExtendedFlaskMessageLaunch class
 class ExtendedFlaskMessageLaunch(FlaskMessageLaunch):
@@ -40,6 +63,21 @@ class ExtendedFlaskMessageLaunch(FlaskMessageLaunch):
         if iss == "http://imsglobal.org" and deep_link_launch:
             return self
         return super().validate_nonce()
+    
+    def validate(self):
+        """Validate the launch, timing it for /metrics"""
+        with timed(lti_operation_seconds, lti_operation_errors, 'validate_launch'):
+            return super().validate()
+    
+    def get_public_key(self):
+        """Look up the platform key in the cached key set; a configured static key set is used as is"""
+        if self._registration.get_key_set():
+            return super().get_public_key()
+        return get_platform_public_key(self._registration, self._jwt.get('header', {}))
+    
+    def get_service_connector(self):
+        """Share access tokens and the parsed private key between launches"""
+        return CachingServiceConnector(self._registration)
 
 # Register blueprints
 for blueprint in all_blueprints:
@@ -65,8 +103,8 @@ def start_cleanup_thread():
             except Exception as e:
                 app.logger.error(f"Error in cleanup thread: {str(e)}")
             
-            # Sleep for 1 hour
-            time.sleep(3600)
+            # Idle instances are suspended on the next check, so check often
+            time.sleep(app.config['CLEANUP_INTERVAL'])
     
     cleanup_thread = threading.Thread(target=cleanup_thread_func, daemon=True)
     cleanup_thread.start()
@@ -87,6 +125,9 @@ if __name__ == '__main__':
     # Start the cleanup thread
     cleanup_thread = start_cleanup_thread()
     
+    # Keep the container state table current from Docker events
+    container_state_threads = start_container_state_watcher(app)
+    
     # Start the master Juice Shop container
     with app.app_context():
         start_result = start_master_juice_shop()
@@ -95,4 +136,16 @@ if __name__ == '__main__':
         else:
             app.logger.error(f"Failed to start master Juice Shop container: {start_result.get('message', 'Unknown error')}")
     
+    # Resume readiness probes of containers a previous run left starting
+    readiness_prober_thread = start_readiness_prober(app)
+    
+    # Start pre-warming containers for instant instance creation
+    pool_refiller_thread = start_pool_refiller(app)
+    
+    # Detect solves on all running instances, whether or not a tab is open
+    solve_poller_thread = start_solve_poller(app)
+    
+    # Send scores left in the grade outbox and any queued from now on
+    grade_sender_thread = start_grade_sender(app)
+    
     app.run(host='0.0.0.0', port=9001)
\ No newline at end of file
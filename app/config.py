@@ -1,12 +1,16 @@
 import os
-from tempfile import mkdtemp
+from tempfile import mkdtemp, gettempdir
 
 # Configuration
 config = {
     "DEBUG": True,
     "ENV": "development",
-    "CACHE_TYPE": "simple",
+    "CACHE_BACKEND": "memory",        # Cache for LTI launches, nonces and the challenge catalog: "memory" (one process), "redis", "sqlite" or "shm" (shared memory, one host)
     "CACHE_DEFAULT_TIMEOUT": 600,
+    "CACHE_THRESHOLD": 10000,         # Entries the memory, sqlite and shm caches keep before evicting (Redis evicts by its own maxmemory-policy)
+    "CACHE_REDIS_URL": "redis://localhost:6379/0", # Redis-protocol server for the "redis" cache
+    "CACHE_SQLITE_PATH": os.path.join(gettempdir(), "securelabs_cache.db"), # Cache file for the "sqlite" cache
+    "CACHE_SHM_PATH": "/dev/shm/securelabs_cache.db", # Cache file on a tmpfs for the "shm" cache
     "SECRET_KEY": "replace-me",
     "SESSION_TYPE": "filesystem",
     "SESSION_FILE_DIR": mkdtemp(),
@@ -17,10 +21,98 @@ config = {
     "DEBUG_TB_INTERCEPT_REDIRECTS": False,
     "PORT_RANGE_START": 3001,         # Start of port range for Juice Shop instances
     "PORT_RANGE_END": 3999,           # End of port range for Juice Shop instances
-    "DOCKER_NETWORK": "juice_shop_network", # Docker network name
+    "PORT_CHECK_HOST": True,          # Skip ports that another process on the host is already listening on
+    "PORT_RESERVATION_TIMEOUT": 600,  # Seconds a reserved port may go without an active instance before it is reclaimed
+    "DOCKER_NETWORK": "juice_shop_network", # Docker network proxied containers join
+    "PROXY_ENABLED": False,           # Serve instances at /instance/<token>/ through the app instead of publishing a host port each
+    "PROXY_BASE_URL": "",             # Separate public origin proxied instances are served from, e.g. "https://instances.lti.example.com"; empty serves them on the tool's origin
+    "PROXY_ROUTE_TTL": 10,            # Seconds a proxy route is served from memory before it is looked up again
+    "PROXY_POOL_CONNECTIONS": 200,    # Instances whose keep-alive upstream connections are kept open
+    "PROXY_POOL_MAXSIZE": 8,          # Keep-alive upstream connections kept per instance
+    "PROXY_CONNECT_TIMEOUT": 3,       # Seconds to connect to an instance
+    "PROXY_READ_TIMEOUT": 60,         # Seconds to wait for an instance to send response data
+    "PROXY_CHUNK_SIZE": 65536,        # Bytes per chunk when streaming responses back
+    "DOCKER_BACKEND": "engine",       # Container backend: "engine" (Docker Engine API), "cli" (docker CLI) or "fake" (in-process, no daemon)
+    "DOCKER_SOCKET": "/var/run/docker.sock", # Unix socket of the Docker Engine API
+    "DOCKER_API_POOL_SIZE": 8,        # Persistent connections kept open to the Docker Engine API
+    "DOCKER_STOP_TIMEOUT": 10,        # Seconds a container gets to exit after SIGTERM before it is killed
+    # Docker hosts to spread instances across, e.g. {"name": "node1", "docker_host": "tcp://10.0.0.11:2375",
+    # "host_ip": "10.0.0.11", "backend": "engine", "memory_mb": 0, "cpus": 0, "local": False}.
+    # Empty runs everything on this host. The master Juice Shop runs on the first node, which should be local.
+    "DOCKER_NODES": [],
+    "PLACEMENT_POLICY": "least-loaded", # Node for new containers: "least-loaded" (spread evenly) or "bin-packing" (fill nodes in turn)
+    "CLEANUP_STOP_WORKERS": 8,        # Batches of containers stopped at the same time during bulk cleanup
+    "CLEANUP_STOP_BATCH_SIZE": 25,    # Containers stopped per docker call during bulk cleanup
+    "CONTAINER_MEMORY_MB": 512,       # Memory limit of each Juice Shop container; 0 for no limit
+    "CONTAINER_CPUS": 1.0,            # CPU limit of each Juice Shop container; 0 for no limit
+    "CONTAINER_PIDS_LIMIT": 256,      # Process limit of each Juice Shop container; 0 for no limit
+    "ADMISSION_ENABLED": True,        # Refuse new containers once their limits would overcommit the host
+    "ADMISSION_HOST_MEMORY_MB": 0,    # Memory containers may use in total; 0 detects it from cgroups and /proc
+    "ADMISSION_HOST_CPUS": 0,         # CPUs containers may use in total; 0 detects it from cgroups and the CPU count
+    "ADMISSION_RESERVED_MEMORY_MB": 1024, # Memory kept free for the app, Docker and the OS
+    "ADMISSION_MEMORY_OVERCOMMIT": 1.0, # Committed container memory allowed per MB of host memory
+    "ADMISSION_CPU_OVERCOMMIT": 8.0,  # Committed container CPUs allowed per host CPU; Juice Shop is mostly idle
+    "ADMISSION_WAIT_SECONDS": 60,     # How long a create waits for a free slot before reporting capacity full
+    "ADMISSION_RETRY_INTERVAL": 2,    # Seconds between capacity checks while a create waits
+    "CONTAINER_STATE_MAX_AGE": 5,     # Seconds a bulk container state snapshot is trusted without a Docker events stream
     "HOST_IP": "172.22.183.134",      # Host IP to access Juice Shop instances (change to your server's public IP)
     "DB_PATH": "juice_shop_instances.db",  # Database file path
-    "INSTANCE_EXPIRY_DAYS": 7         # Number of days before an instance expires
+    "DB_POOL_SIZE": 16,               # Idle SQLite connections kept open for reuse
+    "DB_BUSY_TIMEOUT_MS": 5000,       # How long a writer waits for a lock before failing
+    "DB_CACHE_SIZE_KB": 8192,         # SQLite page cache per connection
+    "DB_STATEMENT_CACHE_SIZE": 128,   # Prepared statements cached per connection
+    "INSTANCE_EXPIRY_DAYS": 7,        # Number of days before an instance expires
+    "INSTANCE_IDLE_MINUTES": 30,      # Minutes without activity before an instance is paused; 0 never pauses
+    "INSTANCE_SUSPENDED_EXPIRY_HOURS": 24, # Hours a paused instance is kept before it expires
+    "ACTIVITY_WRITE_INTERVAL": 30,    # Seconds between last_accessed writes for the same instance
+    "CLEANUP_INTERVAL": 60,           # Seconds between idle and expiry checks
+    "INSTANCE_ARCHIVE_DAYS": 30,      # Days after which stopped or expired instances move to the history table
+    "CHALLENGE_CATALOG_TTL": 300,     # Seconds the master challenge catalog is served without revalidating
+    "CHALLENGE_CATALOG_STALE_TTL": 3600, # Seconds a stale catalog may still be served while it is revalidated
+    "CHALLENGE_POLL_TTL": 4,          # Seconds a student's last instance challenge poll is reused (below the frontend polling interval)
+    "SOLVE_POLLER_ENABLED": True,     # Poll all running instances for solves in the background
+    "SOLVE_POLL_WORKERS": 8,          # Concurrent instance polls
+    "SOLVE_POLL_ACTIVE_INTERVAL": 5,  # Seconds between polls of recently used instances
+    "SOLVE_POLL_IDLE_INTERVAL": 60,   # Seconds between polls of idle instances
+    "SOLVE_POLL_ACTIVE_WINDOW": 300,  # Seconds since last access an instance still counts as active
+    "SOLVE_POLL_JITTER": 0.2,         # Random +/- fraction applied to each poll interval
+    "STATUS_WATCH_INTERVAL": 5,       # Seconds between server-side status checks for open status streams
+    "STATUS_STREAM_HEARTBEAT": 15,    # Seconds between keepalive comments on an idle status stream
+    "GRADE_SENDER_ENABLED": True,     # Send queued scores to the LMS from a background thread
+    "GRADE_SENDER_WORKERS": 4,        # Scores sent to the LMS at the same time
+    "GRADE_SENDER_INTERVAL": 5,       # Seconds between checks for scores due for a retry
+    "GRADE_SEND_BATCH_SIZE": 20,      # Scores sent inline per status check when no sender thread runs
+    "GRADE_RETRY_INITIAL_DELAY": 5,   # Seconds before retrying a failed score submission, doubled after each failure
+    "GRADE_RETRY_MAX_DELAY": 600,     # Maximum seconds between retries of a score submission
+    "GRADE_MAX_ATTEMPTS": 10,         # Failed submissions after which a score is marked failed
+    "LTI_TOKEN_REFRESH_MARGIN": 60,   # Seconds before expiry a cached LTI service access token is replaced
+    "LTI_JWKS_TTL": 3600,             # Seconds a platform key set is cached
+    "LTI_JWKS_REFETCH_INTERVAL": 60,  # Minimum seconds between key set fetches caused by unknown key IDs
+    "LTI_JWKS_TIMEOUT": 10,           # HTTP timeout for fetching a platform key set
+    "JWKS_MAX_AGE": 3600,             # Seconds platforms may cache the tool's /jwks/ response
+    "LAUNCH_CONTEXT_CACHE_SIZE": 1024, # Launches whose claims are kept in memory
+    "LAUNCH_CONTEXT_TTL": 3600,       # Seconds cached launch claims are trusted before the launch is restored again
+    "HTTP_CONNECT_TIMEOUT": 3,        # Seconds to connect to a Juice Shop instance
+    "HTTP_READ_TIMEOUT": 10,          # Seconds to wait for a Juice Shop instance to respond
+    "HTTP_RETRIES": 2,                # Retries for failed idempotent requests to instances
+    "HTTP_RETRY_BACKOFF": 0.3,        # Backoff factor between retries (0.3s, 0.6s, ...)
+    "HTTP_POOL_MAXSIZE": 4,           # Keep-alive connections per instance
+    "HTTP_SESSION_IDLE_TIMEOUT": 900, # Seconds before an unused instance session is closed
+    "PROVISION_WORKERS": 4,           # Instance create/restart jobs that run at the same time
+    "PROVISION_JOB_TTL": 600,         # Seconds a finished job can still be looked up
+    "PROVISION_JOB_STALE_AFTER": 900, # Seconds an unfinished job may go without progress before it is failed
+    "READINESS_INITIAL_DELAY": 0.5,   # Seconds before the second readiness probe, doubled after each failure
+    "READINESS_MAX_DELAY": 5,         # Maximum seconds between readiness probes
+    "READINESS_TIMEOUT": 180,         # Seconds a container may take to answer before it is marked failed
+    "READINESS_PROBE_TIMEOUT": 2,     # HTTP timeout of a single readiness probe
+    "POOL_ENABLED": True,             # Keep pre-started Juice Shop containers ready to hand out
+    "POOL_TARGET_SIZE": 5,            # Number of idle containers the pool is refilled to
+    "POOL_LOW_WATER": 2,              # Refill the pool once it drops to this many containers
+    "POOL_MAX_SIZE": 20,              # Upper bound on idle containers, even during bursts
+    "POOL_REFILL_INTERVAL": 30,       # Seconds between periodic pool checks
+    "METRICS_ENABLED": True,          # Serve request, Docker, SQLite, upstream HTTP and LTI metrics at /metrics for Prometheus
+    "OPERATOR_TOKEN": None,           # Bearer token for the operator routes (capacity, cache stats, metrics); None disables it
+    "OPERATOR_ALLOWED_IPS": []        # Client addresses or networks (e.g. "10.0.0.0/8") allowed on the operator routes without the token
 }
 
 PAGE_TITLE = 'Security Challenges'
@@ -1,4 +1,4 @@
 # Import models here for easier access from other modules
-from models.database import get_db_connection, init_db
-from models.instance import get_user_instance, find_available_port, save_instance, update_instance_status
-from models.challenge import get_assigned_challenges, save_assigned_challenges, save_solved_challenge, get_user_solved_challenges
\ No newline at end of file
+from models.database import get_db_connection, release_db_connection, init_db
+from models.instance import get_user_instance, find_available_port, save_instance, update_instance_status, update_instance_statuses
+from models.challenge import get_assigned_challenges, save_assigned_challenges, save_solved_challenge, save_solved_challenges, get_user_solved_challenges
\ No newline at end of file
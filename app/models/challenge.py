@@ -17,6 +17,31 @@ def get_assigned_challenges(assignment_id):
     
     return challenges
 
+def bump_progress_version(c, user_id, assignment_id):
+    """
+    Bump the progress version of a user on an assignment; an empty user_id versions the
+    assignment's challenge set. Runs in the caller's transaction.
+    """
+    c.execute("""
+        INSERT INTO progress_versions (user_id, assignment_id, version)
+        VALUES (?, ?, 1)
+        ON CONFLICT(user_id, assignment_id) DO UPDATE SET version=version + 1
+    """, (user_id, assignment_id or ''))
+
+def get_progress_version(user_id, assignment_id):
+    """Get (challenge set version, user progress version) of a user on an assignment"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        SELECT user_id, version FROM progress_versions
+        WHERE user_id IN ('', ?) AND assignment_id=?
+    """, (user_id, assignment_id or ''))
+    versions = {row['user_id']: row['version'] for row in c.fetchall()}
+    conn.close()
+    
+    return versions.get('', 0), versions.get(user_id, 0)
+
 def save_assigned_challenges(assignment_id, challenges):
     """Save challenges assigned to an assignment"""
     conn = get_db_connection()
@@ -39,6 +64,9 @@ def save_assigned_challenges(assignment_id, challenges):
             challenge.get('difficulty', 0)
         ))
     
+    # Every student's progress on the assignment changes with its challenge set
+    bump_progress_version(c, '', assignment_id)
+    
     conn.commit()
     conn.close()
     
@@ -58,15 +86,55 @@ def save_solved_challenge(user_id, challenge_id, assignment_id=None):
             VALUES (?, ?, ?, ?)
         """, (user_id, challenge_id, assignment_id, datetime.now().isoformat()))
         
-        conn.commit()
         success = c.rowcount > 0  # Check if a row was inserted
+        if success:
+            bump_progress_version(c, user_id, assignment_id)
+        conn.commit()
     except Exception as e:
         current_app.logger.error(f"Error saving solved challenge: {str(e)}")
+        conn.rollback()
         success = False
     
     conn.close()
     return success
 
+def save_solved_challenges(solves):
+    """
+    Save many (user_id, challenge_id, assignment_id) solves in one transaction.
+    Returns how many were new, or None if the write failed.
+    """
+    from flask import current_app
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    solved_at = datetime.now().isoformat()
+    
+    try:
+        saved_count = 0
+        progressed = set()
+        for user_id, challenge_id, assignment_id in solves:
+            c.execute("""
+                INSERT OR IGNORE INTO solved_challenges 
+                (user_id, challenge_id, assignment_id, solved_at)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, challenge_id, assignment_id, solved_at))
+            if c.rowcount > 0:
+                saved_count += 1
+                progressed.add((user_id, assignment_id))
+        
+        # Only solves that were new change a student's progress
+        for user_id, assignment_id in progressed:
+            bump_progress_version(c, user_id, assignment_id)
+        
+        conn.commit()
+    except Exception as e:
+        current_app.logger.error(f"Error saving solved challenges: {str(e)}")
+        conn.rollback()
+        saved_count = None
+    
+    conn.close()
+    return saved_count
+
 def get_user_solved_challenges(user_id, assignment_id=None):
     """Get list of challenge IDs solved by a user"""
     conn = get_db_connection()
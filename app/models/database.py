@@ -1,57 +1,150 @@
 import sqlite3
+import queue
+import threading
+import time
 from datetime import datetime
-from flask import current_app
+from flask import current_app, g
 import os
+from utils.metrics import sqlite_query_seconds
 
-def get_db_connection():
-    """Get a connection to the SQLite database"""
-    conn = sqlite3.connect(current_app.config['DB_PATH'])
+# Idle connections for each database path, reused across requests and threads
+connection_pools = {}
+pools_lock = threading.Lock()
+
+# Statement types timed under their own label; anything else is timed as OTHER
+TIMED_STATEMENTS = frozenset(['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH', 'PRAGMA', 'BEGIN', 'CREATE'])
+
+def statement_type(sql):
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else ''
+    return verb if verb in TIMED_STATEMENTS else 'OTHER'
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each statement takes"""
+    # try/finally rather than a context manager, as this runs for every statement
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return sqlite3.Cursor.execute(self, sql, parameters)
+        finally:
+            sqlite_query_seconds.observe(time.perf_counter() - started, statement_type(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, seq_of_parameters)
+        finally:
+            sqlite_query_seconds.observe(time.perf_counter() - started, statement_type(sql))
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection owned by the pool rather than by the code using it"""
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3's own shortcuts open a plain cursor, so they go through a timed one instead
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with sqlite_query_seconds.time('COMMIT'):
+            super().commit()
+
+    def close(self):
+        # Model functions close their connection when they are done with it, but the
+        # connection stays leased to the current app context until it is torn down
+        pass
+
+    def close_for_real(self):
+        sqlite3.Connection.close(self)
+
+def get_connection_pool(db_path):
+    """Get the pool of idle connections for a database file"""
+    with pools_lock:
+        if db_path not in connection_pools:
+            connection_pools[db_path] = queue.LifoQueue(maxsize=current_app.config['DB_POOL_SIZE'])
+        return connection_pools[db_path]
+
+def open_db_connection(db_path):
+    """Open a new pooled connection with the tuned pragmas applied"""
+    config = current_app.config
+    conn = sqlite3.connect(db_path,
+                           factory=PooledConnection,
+                           timeout=config['DB_BUSY_TIMEOUT_MS'] / 1000,
+                           check_same_thread=False,  # Connections move between threads through the pool
+                           cached_statements=config['DB_STATEMENT_CACHE_SIZE'])
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(config['DB_BUSY_TIMEOUT_MS'])}")
+    # WAL only needs fsync at checkpoints, so NORMAL is still safe against corruption
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{int(config['DB_CACHE_SIZE_KB'])}")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
 
+def get_db_connection():
+    """
+    Get a connection to the SQLite database.
+    The first call in an app context leases a connection from the pool; later calls in the
+    same request or background task reuse it, and it is returned when the context ends.
+    """
+    conn = g.get('db_connection')
+    if conn is not None:
+        return conn
+
+    db_path = current_app.config['DB_PATH']
+    try:
+        conn = get_connection_pool(db_path).get_nowait()
+    except queue.Empty:
+        conn = open_db_connection(db_path)
+
+    g.db_connection = conn
+    return conn
+
+def release_db_connection(exception=None):
+    """Return the app context's connection to the pool (registered as an app context teardown)"""
+    conn = g.pop('db_connection', None)
+    if conn is None:
+        return
+
+    try:
+        # Never hand a half-finished transaction to the next user
+        if conn.in_transaction:
+            conn.rollback()
+        get_connection_pool(current_app.config['DB_PATH']).put_nowait(conn)
+    except queue.Full:
+        conn.close_for_real()
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Discarding broken database connection: {str(e)}")
+        conn.close_for_real()
+
+def rollback_open_transaction(conn, operation):
+    """
+    Roll back a transaction left open on the connection before an operation that starts its own.
+    Committing it instead would make whatever half-finished work it holds permanent.
+    """
+    if conn.in_transaction:
+        current_app.logger.warning(f"Rolling back an open transaction before {operation}")
+        conn.rollback()
+
 def init_db(db_path):
-    """Initialize the SQLite database for tracking Juice Shop instances"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+    """
+    Initialize the SQLite database for tracking Juice Shop instances.
+    Returns the migrations that were applied and any hot query that no longer uses an index.
+    """
+    from models.migrations import run_migrations, check_query_plans
+    
+    # Autocommit mode, so migrations control their own transactions
+    conn = sqlite3.connect(db_path, isolation_level=None)
     
-    # Create instances table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS instances (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        container_id TEXT,
-        port INTEGER,
-        status TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        assignment_id TEXT
-    )
-    ''')
+    # WAL lets readers proceed while the cleanup thread and pollers write.
+    # The journal mode is stored in the database file, so this only needs to happen once.
+    conn.execute("PRAGMA journal_mode = WAL")
     
-    # Create solved challenges table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS solved_challenges (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        challenge_id INTEGER NOT NULL,
-        solved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        assignment_id TEXT,
-        UNIQUE(user_id, challenge_id, assignment_id)
-    )
-    ''')
+    applied = run_migrations(conn)
+    plan_regressions = check_query_plans(conn)
     
-    # Create assignment challenges table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS assignment_challenges (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        assignment_id TEXT NOT NULL,
-        challenge_id INTEGER NOT NULL,
-        challenge_name TEXT NOT NULL,
-        challenge_description TEXT,
-        challenge_difficulty INTEGER,
-        UNIQUE(assignment_id, challenge_id)
-    )
-    ''')
+    conn.close()
     
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    return {'applied': applied, 'plan_regressions': plan_regressions}
\ No newline at end of file
@@ -0,0 +1,99 @@
+import json
+from datetime import datetime
+from flask import current_app
+from models.database import get_db_connection
+
+def queue_grade(launch_id, user_id, lineitem, issuer, client_id, ags_endpoint, score_given, score_maximum):
+    """
+    Queue a score for sending to the LMS unless the same score is already queued or sent.
+    Returns True if the score was queued. A newer score replaces one still waiting to be sent.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    now = datetime.now().isoformat()
+    
+    try:
+        c.execute("""
+            SELECT id, score_given, score_maximum FROM grade_outbox
+            WHERE launch_id=? AND user_id=? AND lineitem=?
+        """, (launch_id, user_id, lineitem))
+        row = c.fetchone()
+        
+        if row and row['score_given'] == score_given and row['score_maximum'] == score_maximum:
+            conn.close()
+            return False
+        
+        # A changed score is due right away and starts its retries from scratch
+        c.execute("""
+            INSERT INTO grade_outbox
+            (launch_id, user_id, lineitem, issuer, client_id, ags_endpoint, score_given, score_maximum,
+             status, attempts, next_attempt_at, last_error, queued_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending', 0, ?, NULL, ?)
+            ON CONFLICT(launch_id, user_id, lineitem) DO UPDATE SET
+                issuer=excluded.issuer, client_id=excluded.client_id, ags_endpoint=excluded.ags_endpoint,
+                score_given=excluded.score_given, score_maximum=excluded.score_maximum,
+                status='pending', attempts=0, next_attempt_at=excluded.next_attempt_at,
+                last_error=NULL, queued_at=excluded.queued_at
+        """, (launch_id, user_id, lineitem, issuer, client_id, json.dumps(ags_endpoint),
+              score_given, score_maximum, now, now))
+        
+        conn.commit()
+        queued = True
+    except Exception as e:
+        current_app.logger.error(f"Error queueing grade: {str(e)}")
+        conn.rollback()
+        queued = False
+    
+    conn.close()
+    return queued
+
+def get_due_grades(limit):
+    """Get pending grades whose next attempt is due, oldest first"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        SELECT * FROM grade_outbox
+        WHERE status='pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at LIMIT ?
+    """, (datetime.now().isoformat(), limit))
+    
+    grades = [dict(row) for row in c.fetchall()]
+    conn.close()
+    
+    for grade in grades:
+        grade['ags_endpoint'] = json.loads(grade['ags_endpoint'])
+    return grades
+
+def mark_grade_sent(grade_id, score_given, score_maximum):
+    """
+    Record that a score reached the LMS. If a newer score was queued while it was
+    being sent, the row stays pending so the newer score goes out next.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        UPDATE grade_outbox SET
+            status = CASE WHEN score_given=? AND score_maximum=? THEN 'sent' ELSE status END,
+            sent_score_given=?, sent_score_maximum=?, sent_at=?
+        WHERE id=?
+    """, (score_given, score_maximum, score_given, score_maximum, datetime.now().isoformat(), grade_id))
+    
+    conn.commit()
+    conn.close()
+
+def mark_grade_failed(grade_id, score_given, score_maximum, error, next_attempt_at, give_up=False):
+    """Record a failed send and when to retry it, unless a newer score replaced it meanwhile"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        UPDATE grade_outbox SET
+            status=?, attempts=attempts + 1, last_error=?, next_attempt_at=?
+        WHERE id=? AND score_given=? AND score_maximum=?
+    """, ('failed' if give_up else 'pending', error, next_attempt_at.isoformat(),
+          grade_id, score_given, score_maximum))
+    
+    conn.commit()
+    conn.close()
\ No newline at end of file
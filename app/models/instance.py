@@ -1,38 +1,68 @@
 from datetime import datetime, timedelta
-import random
 from flask import current_app
-from models.database import get_db_connection
+from models.database import get_db_connection, rollback_open_transaction
 
 def get_user_instance(user_id):
-    """Get user's Juice Shop instance"""
+    """
+    Get user's Juice Shop instance, resuming it if it was suspended while idle.
+    An instance that is still starting is reported with exists False and no URL until it is ready.
+    """
     from flask import current_app
-    from services.docker_service import is_container_running
+    from services.container_state import is_container_running_cached
+    from services.activity import record_activity
+    from services.proxy import instance_base_url, instance_public_url
     
     conn = get_db_connection()
     c = conn.cursor()
     
-    c.execute("SELECT * FROM instances WHERE user_id=? AND status='running'", (user_id,))
+    c.execute("SELECT * FROM instances WHERE user_id=? AND status IN ('running', 'starting', 'suspended')", (user_id,))
     instance = c.fetchone()
     
-    if instance:
+    if instance and instance['status'] == 'suspended':
+        from services.docker_service import unpause_docker_container
+        
+        # Only a resumed container counts as running again; if it is gone, the running check below cleans up
+        if unpause_docker_container(instance['container_id'], instance['node']):
+            current_app.logger.info(f"Resumed suspended instance {instance['id']}")
+            c.execute("UPDATE instances SET status='running' WHERE id=?", (instance['id'],))
+            conn.commit()
+            instance = dict(instance)
+            instance['status'] = 'running'
+        else:
+            current_app.logger.warning(f"Could not resume suspended instance {instance['id']}")
+            if is_container_running_cached(instance['container_id'], instance['node']):
+                # Still paused, so it stays suspended and the next access tries again
+                conn.close()
+                return {'exists': False, 'reason': 'Instance could not be resumed'}
+    
+    if instance and instance['status'] == 'starting' and is_container_running_cached(instance['container_id'], instance['node']):
+        instance_dict = dict(instance)
+        instance_dict['exists'] = False
+        instance_dict['reason'] = 'Instance is starting'
+    elif instance:
         # Check if container is actually running in Docker
         container_id = instance['container_id']
-        container_running = is_container_running(container_id)
+        container_running = is_container_running_cached(container_id, instance['node'])
         
         if container_running:
             # Update last accessed time
-            c.execute("UPDATE instances SET last_accessed=? WHERE id=?", 
-                    (datetime.now().isoformat(), instance['id']))
-            conn.commit()
+            record_activity(instance['id'])
             
             instance_dict = dict(instance)
-            instance_dict['url'] = f"http://{current_app.config['HOST_IP']}:{instance['port']}"
+            instance_dict['url'] = instance_public_url(instance)
             instance_dict['exists'] = True
         else:
             # Container not running, update status in database
             c.execute("UPDATE instances SET status=? WHERE id=?", ('stopped', instance['id']))
             conn.commit()
             
+            from services.port_allocator import release_port
+            from services.http_client import evict_http_session
+            from services.challenge_service import forget_challenge_poll
+            release_port(instance['port'], instance['node'])
+            evict_http_session(instance_base_url(instance))
+            forget_challenge_poll(user_id)
+            
             current_app.logger.warning(f"Instance {instance['id']} marked as running but container not found")
             instance_dict = {'exists': False, 'reason': 'Container not running'}
     else:
@@ -41,37 +71,106 @@ def get_user_instance(user_id):
     conn.close()
     return instance_dict
 
-def find_available_port():
-    """Find an available port in the configured range"""
-    from flask import current_app
+def find_available_port(node=None):
+    """Reserve an available port in a node's configured range"""
+    from services.port_allocator import allocate_port
+    
+    return allocate_port(node)
+
+def get_reserved_ports(node):
+    """Get the set of ports reserved on a node by any process"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("SELECT port FROM port_reservations WHERE node=?", (node,))
+    ports = {row[0] for row in c.fetchall()}
+    conn.close()
+    
+    return ports
+
+def count_reserved_ports(node, start, end):
+    """Count the ports of a node's range that are reserved"""
+    conn = get_db_connection()
+    c = conn.cursor()
     
+    c.execute("SELECT COUNT(*) FROM port_reservations WHERE node=? AND port BETWEEN ? AND ?", (node, start, end))
+    count = c.fetchone()[0]
+    conn.close()
+    
+    return count
+
+def reserve_port(node, port):
+    """Reserve a port on a node, returning False if it is already reserved, e.g. by another worker process"""
     conn = get_db_connection()
     c = conn.cursor()
     
-    # Get all ports currently in use
-    c.execute("SELECT port FROM instances WHERE status='running'")
-    used_ports = [row[0] for row in c.fetchall()]
+    c.execute("INSERT OR IGNORE INTO port_reservations (node, port, reserved_at) VALUES (?, ?, ?)",
+              (node, port, datetime.now().isoformat()))
+    reserved = c.rowcount == 1
+    conn.commit()
     conn.close()
     
-    # Find available port
-    port_range = list(range(current_app.config['PORT_RANGE_START'], current_app.config['PORT_RANGE_END'] + 1))
-    available_ports = [p for p in port_range if p not in used_ports]
+    return reserved
+
+def delete_port_reservation(node, port, default_node):
+    """Drop a port's reservation unless an active instance still holds the port"""
+    from services.port_allocator import ACTIVE_STATUSES
     
-    if not available_ports:
-        raise Exception("No available ports in the specified range")
+    conn = get_db_connection()
+    c = conn.cursor()
     
-    # Randomize port selection for better distribution
-    return random.choice(available_ports)
+    c.execute(f"""
+        DELETE FROM port_reservations WHERE node=? AND port=? AND NOT EXISTS (
+            SELECT 1 FROM instances WHERE port=? AND COALESCE(node, ?)=?
+            AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))})
+        )
+    """, (node, port, port, default_node, node) + ACTIVE_STATUSES)
+    conn.commit()
+    conn.close()
 
-def save_instance(user_id, container_id, port, status, assignment_id=None):
-    """Save instance info to database"""
+def sync_port_reservations(default_node, stale_before):
+    """
+    Reserve the ports of all active instances and drop reservations older than stale_before
+    that no active instance took up, e.g. those of a process that died while starting a container.
+    Rows without a node belong to default_node.
+    """
+    from services.port_allocator import ACTIVE_STATUSES
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    statuses = ', '.join('?' * len(ACTIVE_STATUSES))
+    
+    rollback_open_transaction(conn, "syncing port reservations")
+    # Take the write lock up front so no other process reserves ports halfway through
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute(f"""
+            INSERT OR IGNORE INTO port_reservations (node, port, reserved_at)
+            SELECT COALESCE(node, ?), port, ? FROM instances
+            WHERE status IN ({statuses}) AND port IS NOT NULL
+        """, (default_node, datetime.now().isoformat()) + ACTIVE_STATUSES)
+        c.execute(f"""
+            DELETE FROM port_reservations WHERE reserved_at < ? AND NOT EXISTS (
+                SELECT 1 FROM instances WHERE instances.port=port_reservations.port
+                AND COALESCE(instances.node, ?)=port_reservations.node AND status IN ({statuses})
+            )
+        """, (stale_before.isoformat(), default_node) + ACTIVE_STATUSES)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    conn.close()
+
+def save_instance(user_id, container_id, port, status, assignment_id=None, node=None, proxy_token=None, upstream=None):
+    """Save instance info to database; proxied instances have a proxy token and upstream instead of a host port"""
     conn = get_db_connection()
     c = conn.cursor()
     
     c.execute("""
-        INSERT INTO instances (user_id, container_id, port, status, assignment_id, created_at, last_accessed)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, container_id, port, status, assignment_id, 
+        INSERT INTO instances (user_id, container_id, port, status, assignment_id, node, proxy_token, upstream, created_at, last_accessed)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (user_id, container_id, port, status, assignment_id, node, proxy_token, upstream,
           datetime.now().isoformat(), datetime.now().isoformat()))
     
     conn.commit()
@@ -80,17 +179,211 @@ def save_instance(user_id, container_id, port, status, assignment_id=None):
     
     return instance_id
 
+def claim_pooled_instance(user_id, assignment_id=None):
+    """Atomically assign the oldest pooled instance to a user"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    # BEGIN would fail inside a transaction left open by earlier work on this connection
+    rollback_open_transaction(conn, "claiming a pooled instance")
+    # Take the write lock up front so two claims can never pick the same row
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        # Prefer containers that already answered a readiness probe
+        c.execute("SELECT * FROM instances WHERE status='pooled' ORDER BY ready_at IS NULL, id LIMIT 1")
+        instance = c.fetchone()
+        
+        if instance:
+            now = datetime.now().isoformat()
+            status = 'running' if instance['ready_at'] else 'starting'
+            c.execute("""
+                UPDATE instances SET user_id=?, assignment_id=?, status=?, created_at=?, last_accessed=?
+                WHERE id=?
+            """, (user_id, assignment_id, status, now, now, instance['id']))
+            instance = dict(instance)
+            instance['status'] = status
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    conn.close()
+    
+    return instance
+
+def count_pooled_instances():
+    """Count pre-warmed instances waiting to be claimed"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("SELECT COUNT(*) FROM instances WHERE status='pooled'")
+    count = c.fetchone()[0]
+    conn.close()
+    
+    return count
+
+def count_active_instances_by_node():
+    """Count instances whose container holds host resources, by node (None for rows without a node)"""
+    from services.port_allocator import ACTIVE_STATUSES
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute(f"""
+        SELECT node, COUNT(*) FROM instances WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))})
+        GROUP BY node
+    """, ACTIVE_STATUSES)
+    counts = {row[0]: row[1] for row in c.fetchall()}
+    conn.close()
+    
+    return counts
+
+def count_instances_by_status():
+    """Count instances whose container holds host resources, by status"""
+    from services.port_allocator import ACTIVE_STATUSES
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute(f"""
+        SELECT status, COUNT(*) FROM instances WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))})
+        GROUP BY status
+    """, ACTIVE_STATUSES)
+    counts = {row[0]: row[1] for row in c.fetchall()}
+    conn.close()
+    
+    return counts
+
+def get_running_instances():
+    """Get all instances assigned to users, for background solve polling"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        SELECT id, user_id, container_id, port, node, proxy_token, upstream, assignment_id, last_accessed FROM instances
+        WHERE status='running'
+    """)
+    instances = [dict(row) for row in c.fetchall()]
+    conn.close()
+    
+    return instances
+
+def get_unready_instances():
+    """Get instances whose container has not answered a readiness probe yet"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        SELECT id, container_id, port, node, proxy_token, upstream, created_at FROM instances
+        WHERE status='starting' OR (status='pooled' AND ready_at IS NULL)
+    """)
+    instances = [dict(row) for row in c.fetchall()]
+    conn.close()
+    
+    return instances
+
+def get_proxy_route(proxy_token):
+    """Get the running or suspended instance a proxy token routes to"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        SELECT id, user_id, node, proxy_token, upstream, status FROM instances
+        WHERE proxy_token=? AND status IN ('running', 'suspended')
+    """, (proxy_token,))
+    row = c.fetchone()
+    conn.close()
+    
+    return dict(row) if row else None
+
+def mark_instance_ready(instance_id, ready_seconds):
+    """Record that an instance answers HTTP, promoting it from starting to running"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("""
+        UPDATE instances SET ready_at=?, ready_seconds=?,
+            status=CASE WHEN status='starting' THEN 'running' ELSE status END
+        WHERE id=?
+    """, (datetime.now().isoformat(), ready_seconds, instance_id))
+    
+    conn.commit()
+    conn.close()
+
 def update_instance_status(instance_id, status):
-    """Update instance status"""
+    """Update instance status, releasing its port once the instance no longer holds it"""
+    from services.port_allocator import ACTIVE_STATUSES, release_port
+    
     conn = get_db_connection()
     c = conn.cursor()
     
+    c.execute("SELECT port, node, status FROM instances WHERE id=?", (instance_id,))
+    row = c.fetchone()
+    
     c.execute("UPDATE instances SET status=? WHERE id=?", (status, instance_id))
     conn.commit()
     conn.close()
+    
+    # An instance that had already given up its port must not release it again
+    if row and row['status'] in ACTIVE_STATUSES and status not in ACTIVE_STATUSES:
+        release_port(row['port'], row['node'])
+
+def update_instance_statuses(instance_ids, status):
+    """Update the status of several instances in one batch, releasing the ports they no longer hold"""
+    from services.port_allocator import ACTIVE_STATUSES, release_port
+    
+    if not instance_ids:
+        return
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    ports = []
+    if status not in ACTIVE_STATUSES:
+        placeholders = ', '.join('?' * len(instance_ids))
+        c.execute(f"SELECT port, node, status FROM instances WHERE id IN ({placeholders})", list(instance_ids))
+        ports = [(row['port'], row['node']) for row in c.fetchall() if row['status'] in ACTIVE_STATUSES]
+    
+    c.executemany("UPDATE instances SET status=? WHERE id=?", [(status, instance_id) for instance_id in instance_ids])
+    conn.commit()
+    conn.close()
+    
+    for port, node in ports:
+        release_port(port, node)
+
+def touch_instance(instance_id):
+    """Update an instance's last accessed time"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("UPDATE instances SET last_accessed=? WHERE id=?", (datetime.now().isoformat(), instance_id))
+    conn.commit()
+    conn.close()
+
+def get_idle_instances():
+    """Get running instances that have not been accessed for INSTANCE_IDLE_MINUTES"""
+    from flask import current_app
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    idle_date = (datetime.now() - timedelta(minutes=current_app.config['INSTANCE_IDLE_MINUTES'])).isoformat()
+    
+    c.execute("""
+        SELECT id, container_id, node FROM instances
+        WHERE status='running' AND last_accessed < ?
+    """, (idle_date,))
+    
+    idle_instances = c.fetchall()
+    conn.close()
+    
+    return [(row[0], row[1], row[2]) for row in idle_instances]
 
 def get_expired_instances():
-    """Get list of expired instances"""
+    """
+    Get list of expired instances: running ones after INSTANCE_EXPIRY_DAYS, and
+    suspended ones after the shorter INSTANCE_SUSPENDED_EXPIRY_HOURS
+    """
     from flask import current_app
     
     conn = get_db_connection()
@@ -98,13 +391,39 @@ def get_expired_instances():
     
     # Get expired instances
     expiry_date = (datetime.now() - timedelta(days=current_app.config['INSTANCE_EXPIRY_DAYS'])).isoformat()
+    suspended_expiry_date = (datetime.now() - timedelta(hours=current_app.config['INSTANCE_SUSPENDED_EXPIRY_HOURS'])).isoformat()
     
     c.execute("""
-        SELECT id, container_id FROM instances 
-        WHERE status='running' AND last_accessed < ?
-    """, (expiry_date,))
+        SELECT id, container_id, node FROM instances 
+        WHERE (status='running' AND last_accessed < ?) OR (status='suspended' AND last_accessed < ?)
+    """, (expiry_date, suspended_expiry_date))
     
     expired_instances = c.fetchall()
     conn.close()
     
-    return [(row[0], row[1]) for row in expired_instances]
\ No newline at end of file
+    return [(row[0], row[1], row[2]) for row in expired_instances]
+
+def archive_old_instances():
+    """Move long-finished instances into the history table so the hot table stays small"""
+    from flask import current_app
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    cutoff = (datetime.now() - timedelta(days=current_app.config['INSTANCE_ARCHIVE_DAYS'])).isoformat()
+    archived_statuses = ('stopped', 'expired', 'failed')
+    
+    c.execute("""
+        INSERT OR REPLACE INTO instances_history
+        (id, user_id, container_id, port, node, proxy_token, upstream, status, created_at, last_accessed, assignment_id, ready_at, ready_seconds, archived_at)
+        SELECT id, user_id, container_id, port, node, proxy_token, upstream, status, created_at, last_accessed, assignment_id, ready_at, ready_seconds, ?
+        FROM instances WHERE status IN (?, ?, ?) AND last_accessed < ?
+    """, (datetime.now().isoformat(), *archived_statuses, cutoff))
+    
+    c.execute("DELETE FROM instances WHERE status IN (?, ?, ?) AND last_accessed < ?", (*archived_statuses, cutoff))
+    archived_count = c.rowcount
+    
+    conn.commit()
+    conn.close()
+    
+    return archived_count
\ No newline at end of file
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+import time
+from models.database import get_db_connection
+
+# Job states a job never leaves
+FINISHED_STATES = ('healthy', 'failed')
+
+def job_from_row(row):
+    """Turn a provisioning_jobs row into a job dict"""
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+def insert_provisioning_job(job):
+    """Save a new job, returning False if the user already has an unfinished one, e.g. queued by another worker process"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    try:
+        c.execute("""
+            INSERT INTO provisioning_jobs (id, kind, user_id, assignment_id, state, message, result, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (job['id'], job['kind'], job['user_id'], job['assignment_id'], job['state'], job['message'],
+              json.dumps(job['result']) if job['result'] is not None else None, job['created_at'], job['updated_at']))
+        conn.commit()
+        inserted = True
+    except sqlite3.IntegrityError:
+        # The partial unique index allows one unfinished job per user
+        conn.rollback()
+        inserted = False
+    
+    conn.close()
+    
+    return inserted
+
+def get_unfinished_job(user_id):
+    """Get the user's queued or running job, or None"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute(f"""
+        SELECT * FROM provisioning_jobs
+        WHERE user_id=? AND state NOT IN ({', '.join(repr(state) for state in FINISHED_STATES)})
+    """, (user_id,))
+    row = c.fetchone()
+    conn.close()
+    
+    return job_from_row(row) if row else None
+
+def get_provisioning_job(job_id):
+    """Get a job by ID, or None if it is unknown or was pruned"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("SELECT * FROM provisioning_jobs WHERE id=?", (job_id,))
+    row = c.fetchone()
+    conn.close()
+    
+    return job_from_row(row) if row else None
+
+def start_provisioning_job(job_id, started_at):
+    """Mark a queued job as picked up by a worker, returning False if it was failed or taken meanwhile"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute("UPDATE provisioning_jobs SET updated_at=? WHERE id=? AND state='queued'", (started_at, job_id))
+    started = c.rowcount == 1
+    conn.commit()
+    conn.close()
+    
+    return started
+
+def update_provisioning_job(job_id, state, message, result, updated_at):
+    """
+    Move an unfinished job to a new state, keeping its result if none is given.
+    Returns the updated job, or None if the job is unknown or already finished, e.g. failed as stale.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute(f"""
+        UPDATE provisioning_jobs SET state=?, message=?, result=COALESCE(?, result), updated_at=?
+        WHERE id=? AND state NOT IN ({', '.join('?' * len(FINISHED_STATES))})
+    """, (state, message, json.dumps(result) if result is not None else None, updated_at, job_id) + FINISHED_STATES)
+    updated = c.rowcount == 1
+    conn.commit()
+    conn.close()
+    
+    return get_provisioning_job(job_id) if updated else None
+
+def fail_stale_jobs(user_id, stale_before, message):
+    """Fail the user's unfinished jobs not updated since stale_before, e.g. those of a worker process that died"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute(f"""
+        UPDATE provisioning_jobs SET state='failed', message=?, updated_at=?
+        WHERE user_id=? AND state NOT IN ({', '.join(repr(state) for state in FINISHED_STATES)}) AND updated_at < ?
+    """, (message, time.time(), user_id, stale_before))
+    failed = c.rowcount
+    conn.commit()
+    conn.close()
+    
+    return failed
+
+def delete_finished_jobs(finished_before):
+    """Delete jobs that finished before the given time"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    
+    c.execute(f"""
+        DELETE FROM provisioning_jobs
+        WHERE state IN ({', '.join('?' * len(FINISHED_STATES))}) AND updated_at < ?
+    """, FINISHED_STATES + (finished_before,))
+    conn.commit()
+    conn.close()
@@ -0,0 +1,223 @@
+"""
+Versioned schema migrations for the SQLite database
+
+The schema version is kept in SQLite's user_version pragma. Each migration runs
+once, in order, inside its own transaction, so upgrading an existing database
+and creating a new one go through the same steps.
+"""
+
+# (version, description, statements)
+MIGRATIONS = [
+    (1, "Create base tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS instances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            container_id TEXT,
+            port INTEGER,
+            status TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            assignment_id TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS solved_challenges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            challenge_id INTEGER NOT NULL,
+            solved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            assignment_id TEXT,
+            UNIQUE(user_id, challenge_id, assignment_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS assignment_challenges (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            assignment_id TEXT NOT NULL,
+            challenge_id INTEGER NOT NULL,
+            challenge_name TEXT NOT NULL,
+            challenge_description TEXT,
+            challenge_difficulty INTEGER,
+            UNIQUE(assignment_id, challenge_id)
+        )
+        '''
+    ]),
+    (2, "Index the hot instance and solved challenge lookups", [
+        # get_user_instance
+        "CREATE INDEX IF NOT EXISTS idx_instances_user_status ON instances(user_id, status)",
+        # find_available_port, pool claims and cleanup, covering the port column
+        "CREATE INDEX IF NOT EXISTS idx_instances_status_port ON instances(status, port)",
+        # get_expired_instances, covering id (the rowid) and container_id
+        "CREATE INDEX IF NOT EXISTS idx_instances_status_accessed ON instances(status, last_accessed, container_id)",
+        # get_user_solved_challenges, covering challenge_id
+        "CREATE INDEX IF NOT EXISTS idx_solved_user_assignment ON solved_challenges(user_id, assignment_id, challenge_id)"
+    ]),
+    (3, "Add history table for archived instances", [
+        '''
+        CREATE TABLE IF NOT EXISTS instances_history (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            container_id TEXT,
+            port INTEGER,
+            status TEXT,
+            created_at TIMESTAMP,
+            last_accessed TIMESTAMP,
+            assignment_id TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_instances_history_user ON instances_history(user_id)"
+    ]),
+    (4, "Record when instances became ready", [
+        "ALTER TABLE instances ADD COLUMN ready_at TIMESTAMP",
+        "ALTER TABLE instances ADD COLUMN ready_seconds REAL",
+        "ALTER TABLE instances_history ADD COLUMN ready_at TIMESTAMP",
+        "ALTER TABLE instances_history ADD COLUMN ready_seconds REAL"
+    ]),
+    (5, "Record the Docker node instances run on", [
+        # NULL for rows saved before nodes were recorded, which belong to the first node
+        "ALTER TABLE instances ADD COLUMN node TEXT",
+        "ALTER TABLE instances_history ADD COLUMN node TEXT"
+    ]),
+    (6, "Record the proxy route of instances served through the built-in reverse proxy", [
+        # Secret path segment of the instance's /instance/<token>/ URL
+        "ALTER TABLE instances ADD COLUMN proxy_token TEXT",
+        # host:port of the container on DOCKER_NETWORK
+        "ALTER TABLE instances ADD COLUMN upstream TEXT",
+        "ALTER TABLE instances_history ADD COLUMN proxy_token TEXT",
+        "ALTER TABLE instances_history ADD COLUMN upstream TEXT",
+        # get_proxy_route
+        "CREATE INDEX IF NOT EXISTS idx_instances_proxy_token ON instances(proxy_token)"
+    ]),
+    (7, "Add outbox for grades waiting to be sent to the LMS", [
+        '''
+        CREATE TABLE IF NOT EXISTS grade_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            launch_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            lineitem TEXT NOT NULL,
+            issuer TEXT NOT NULL,
+            client_id TEXT NOT NULL,
+            ags_endpoint TEXT NOT NULL,
+            score_given REAL NOT NULL,
+            score_maximum REAL NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP,
+            last_error TEXT,
+            queued_at TIMESTAMP,
+            sent_score_given REAL,
+            sent_score_maximum REAL,
+            sent_at TIMESTAMP,
+            UNIQUE(launch_id, user_id, lineitem)
+        )
+        ''',
+        # get_due_grades
+        "CREATE INDEX IF NOT EXISTS idx_grade_outbox_status_next ON grade_outbox(status, next_attempt_at)"
+    ]),
+    (8, "Version each student's challenge progress for conditional requests", [
+        # user_id '' versions an assignment's challenge set, shared by all its students
+        '''
+        CREATE TABLE IF NOT EXISTS progress_versions (
+            user_id TEXT NOT NULL,
+            assignment_id TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (user_id, assignment_id)
+        )
+        '''
+    ]),
+    (9, "Reserve host ports in the database so all processes share one allocation", [
+        # The primary key makes a port reservation atomic across worker processes
+        '''
+        CREATE TABLE IF NOT EXISTS port_reservations (
+            node TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            reserved_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (node, port)
+        )
+        '''
+    ]),
+    (10, "Keep provisioning jobs in the database so every worker process can report them", [
+        '''
+        CREATE TABLE IF NOT EXISTS provisioning_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            assignment_id TEXT,
+            state TEXT NOT NULL,
+            message TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        # A user has at most one unfinished job, whichever process queued it
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_provisioning_jobs_unfinished ON provisioning_jobs(user_id) WHERE state NOT IN ('healthy', 'failed')",
+        "CREATE INDEX IF NOT EXISTS idx_provisioning_jobs_state_updated ON provisioning_jobs(state, updated_at)"
+    ])
+]
+
+# Hot queries that must be served from an index, checked after migrating.
+# (name, query, parameters)
+INDEXED_QUERIES = [
+    ("get_user_instance", "SELECT * FROM instances WHERE user_id=? AND status IN ('running', 'starting', 'suspended')", ('user',)),
+    ("get_reserved_ports", "SELECT port FROM port_reservations WHERE node=?", ('local',)),
+    ("count_active_instances_by_node", "SELECT node, COUNT(*) FROM instances WHERE status IN ('running', 'starting', 'suspended', 'pooled') GROUP BY node", ()),
+    ("count_instances_by_status", "SELECT status, COUNT(*) FROM instances WHERE status IN ('running', 'starting', 'suspended', 'pooled') GROUP BY status", ()),
+    ("get_running_instances", "SELECT id, user_id, container_id, port, node, proxy_token, upstream, assignment_id, last_accessed FROM instances WHERE status='running'", ()),
+    ("claim_pooled_instance", "SELECT * FROM instances WHERE status='pooled' ORDER BY ready_at IS NULL, id LIMIT 1", ()),
+    ("get_unready_instances", "SELECT id, container_id, port, node, proxy_token, upstream, created_at FROM instances WHERE status='starting' OR (status='pooled' AND ready_at IS NULL)", ()),
+    ("get_idle_instances", "SELECT id, container_id, node FROM instances WHERE status='running' AND last_accessed < ?", ('2000-01-01',)),
+    ("get_expired_instances", "SELECT id, container_id, node FROM instances WHERE (status='running' AND last_accessed < ?) OR (status='suspended' AND last_accessed < ?)", ('2000-01-01', '2000-01-01')),
+    ("get_proxy_route", "SELECT id, user_id, node, proxy_token, upstream, status FROM instances WHERE proxy_token=? AND status IN ('running', 'suspended')", ('token',)),
+    ("get_queued_grade", "SELECT id, score_given, score_maximum FROM grade_outbox WHERE launch_id=? AND user_id=? AND lineitem=?", ('launch', 'user', 'lineitem')),
+    ("get_due_grades", "SELECT * FROM grade_outbox WHERE status='pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?", ('2000-01-01', 10)),
+    ("get_progress_version", "SELECT user_id, version FROM progress_versions WHERE user_id IN ('', ?) AND assignment_id=?", ('user', 'assignment')),
+    ("get_user_solved_challenges", "SELECT challenge_id FROM solved_challenges WHERE user_id=? AND assignment_id=?", ('user', 'assignment')),
+    ("get_assigned_challenges", "SELECT * FROM assignment_challenges WHERE assignment_id = ?", ('assignment',)),
+    ("get_provisioning_job", "SELECT * FROM provisioning_jobs WHERE id=?", ('job',)),
+    ("get_unfinished_job", "SELECT * FROM provisioning_jobs WHERE user_id=? AND state NOT IN ('healthy', 'failed')", ('user',)),
+    ("delete_finished_jobs", "SELECT id FROM provisioning_jobs WHERE state IN ('healthy', 'failed') AND updated_at < ?", (0,))
+]
+
+def get_schema_version(conn):
+    """Get the schema version recorded in the database"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(conn):
+    """Apply all pending migrations, returning the versions that were applied"""
+    applied = []
+    current_version = get_schema_version(conn)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        # Explicit transaction so a failed migration leaves no partial schema behind
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        applied.append((version, description))
+
+    return applied
+
+def check_query_plans(conn):
+    """Return (query name, plan step) for every hot query that falls back to a full table scan"""
+    regressions = []
+
+    for name, query, params in INDEXED_QUERIES:
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall():
+            detail = row[-1]
+            # "SCAN" reads the whole table or index, "SEARCH" narrows it with an index
+            if detail.startswith("SCAN "):
+                regressions.append((name, detail))
+
+    return regressions
@@ -2,6 +2,9 @@
 from .lti_routes import lti_bp
 from .instance_routes import instance_bp
 from .challenge_routes import challenge_bp
+from .stream_routes import stream_bp
+from .proxy_routes import proxy_bp
+from .metrics_routes import metrics_bp
 
 # List of all blueprints
-all_blueprints = [lti_bp, instance_bp, challenge_bp]
\ No newline at end of file
+all_blueprints = [lti_bp, instance_bp, challenge_bp, stream_bp, proxy_bp, metrics_bp]
\ No newline at end of file
@@ -1,69 +1,78 @@
-from flask import Blueprint, jsonify, current_app
-from pylti1p3.tool_config import ToolConfJsonFile
-from pylti1p3.contrib.flask import FlaskRequest
+from flask import Blueprint, Response, request, jsonify, current_app
 
-from config import get_lti_config_path
-from services.lti_service import get_launch_data_storage
-from services.challenge_service import get_user_challenges, check_challenge_completion, get_juice_shop_challenges
+from services.launch_context import launch_required
+from services.challenge_service import get_user_challenges, check_challenge_completion, get_juice_shop_challenge, get_progress_etag
+from services.solve_poller import is_solve_poller_running
+from models.instance import get_user_instance
 
 # Create blueprint
 challenge_bp = Blueprint('challenge', __name__, url_prefix='/api')
 
+def with_etag(response, etag):
+    """Mark a progress response with its version; clients revalidate it on every poll"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag):
+    return with_etag(Response(status=304), etag)
+
 @challenge_bp.route('/challenge-list/<launch_id>/<assignment_id>', methods=['GET'])
-def challenge_list(launch_id, assignment_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    
+@launch_required
+def challenge_list(launch_id, user_id, assignment_id, launch):
     try:
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
+        instance = get_user_instance(user_id)
+        etag = get_progress_etag(user_id, assignment_id, instance)
         
-        user_id = message_launch.get_launch_data().get('sub')
+        # The client already has this version of the list; without the solve poller the version
+        # misses solves the instance reports but nobody recorded yet, so the list is always read
+        if is_solve_poller_running() and request.if_none_match.contains(etag):
+            return not_modified(etag)
         
         # Get challenges for the user
-        challenges_data = get_user_challenges(user_id, assignment_id)
+        challenges_data = get_user_challenges(user_id, assignment_id, instance=instance)
         
-        return jsonify({
+        return with_etag(jsonify({
             'challenges': challenges_data['challenges'], 
             'completed': challenges_data['completed'],
             'total': challenges_data['total']
-        })
+        }), etag)
     
     except Exception as e:
         current_app.logger.error(f"Error getting challenge list: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @challenge_bp.route('/challenge-status/<launch_id>/<user_id>/<assignment_id>', methods=['GET'])
-def challenge_status(launch_id, user_id, assignment_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    
+@launch_required
+def challenge_status(launch_id, user_id, assignment_id, launch):
     try:
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
-        
-        # Verify user_id matches the one in the launch data to prevent unauthorized access
-        launch_user_id = message_launch.get_launch_data().get('sub')
+        poller_running = is_solve_poller_running()
+        etag = get_progress_etag(user_id, assignment_id, get_user_instance(user_id))
         
-        if launch_user_id != user_id:
-            return jsonify({'error': 'Unauthorized access'}), 403
+        # While the solve poller records solves, an unchanged version means there is nothing to fetch
+        if poller_running and request.if_none_match.contains(etag):
+            return not_modified(etag)
         
         # Check challenge completion
         challenges_data = check_challenge_completion(user_id, assignment_id, launch_id)
         
-        return jsonify({
+        response = jsonify({
             'challenges': challenges_data.get('challenges', []), 
             'completed': challenges_data.get('completed', 0),
             'total': challenges_data.get('total', 0)
         })
+        
+        # Failed checks are not versioned, so the next poll checks again
+        if challenges_data.get('success') is False:
+            return response
+        
+        if not poller_running:
+            # Without the poller this check is what records solves, so the version is read after it
+            etag = get_progress_etag(user_id, assignment_id, get_user_instance(user_id))
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
+        
+        return with_etag(response, etag)
     
     except Exception as e:
         current_app.logger.error(f"Error checking challenge status: {str(e)}")
@@ -73,17 +82,15 @@ def challenge_status(launch_id, user_id, assignment_id):
 def check_challenge_status(launch_id, challenge_id):
     """Check if a challenge has been solved by calling Juice Shop API"""
     try:
-        # Fetch the current status of all challenges
-        challenges = get_juice_shop_challenges()
+        # Find the specific challenge in the cached catalog
+        challenge = get_juice_shop_challenge(challenge_id)
         
-        # Find the specific challenge
-        for challenge in challenges:
-            if challenge.get('id') == challenge_id:
-                # Return the solved status
-                return jsonify({
-                    'id': challenge_id,
-                    'solved': challenge.get('solved', False)
-                })
+        if challenge:
+            # Return the solved status
+            return jsonify({
+                'id': challenge_id,
+                'solved': challenge.get('solved', False)
+            })
         
         return jsonify({'error': 'Challenge not found'}), 404
     except Exception as e:
@@ -1,37 +1,24 @@
 from flask import Blueprint, jsonify, current_app
-from pylti1p3.tool_config import ToolConfJsonFile
-from pylti1p3.contrib.flask import FlaskRequest
 from datetime import datetime
 
-from config import get_lti_config_path
-from services.lti_service import get_launch_data_storage
-from services.docker_service import create_docker_instance, restart_docker_instance, shutdown_user_instance
+from services.launch_context import launch_required
+from services.docker_service import shutdown_user_instance
+from services.provisioning import submit_provisioning_job, get_provisioning_job
+from services.capacity import get_capacity_status
+from services.operator_access import operator_required
 from models.instance import get_user_instance
 
 # Create blueprint
 instance_bp = Blueprint('instance', __name__, url_prefix='/api')
 
 @instance_bp.route('/instance-status/<launch_id>/<user_id>', methods=['GET'])
-def instance_status(launch_id, user_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
+@launch_required
+def instance_status(launch_id, user_id, assignment_id, launch):
     from services.docker_service import is_container_running
+    from services.container_state import record_container_state
     from flask import request
     
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    
     try:
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
-        
-        # Verify user_id matches the one in the launch data to prevent unauthorized access
-        launch_user_id = message_launch.get_launch_data().get('sub')
-        
-        if launch_user_id != user_id:
-            return jsonify({'error': 'Unauthorized access'}), 403
-        
         # Get the verification level from query parameters (strict or normal)
         verification = request.args.get('verification', 'normal')
         
@@ -41,8 +28,9 @@ def instance_status(launch_id, user_id):
         # If strict verification is requested and the instance exists, double-check the container
         if verification == 'strict' and instance.get('exists'):
             container_id = instance.get('container_id')
-            if not is_container_running(container_id):
+            if not is_container_running(container_id, instance.get('node')):
                 # Container is not running but database says it is - update our response
+                record_container_state(container_id, False, instance.get('node'))
                 instance['exists'] = False
                 instance['reason'] = 'Container not running'
                 current_app.logger.warning(f"Strict verification failed for container {container_id}")
@@ -60,83 +48,35 @@ def instance_status(launch_id, user_id):
         return jsonify({'error': str(e)}), 500
 
 @instance_bp.route('/create-instance/<launch_id>/<user_id>', methods=['POST'])
-def create_instance(launch_id, user_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    
+@launch_required
+def create_instance(launch_id, user_id, assignment_id, launch):
     try:
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
-        
-        # Verify user_id matches the one in the launch data to prevent unauthorized access
-        launch_user_id = message_launch.get_launch_data().get('sub')
-        
-        if launch_user_id != user_id:
-            return jsonify({'error': 'Unauthorized access'}), 403
+        # Queue the instance creation for the launch's assignment; the client follows the job
+        job, created = submit_provisioning_job('create', user_id, assignment_id)
         
-        # Get assignment ID from launch data
-        assignment_id = message_launch.get_launch_data().get('https://purl.imsglobal.org/spec/lti/claim/resource_link', {}).get('id')
-        
-        # Create Docker instance
-        result = create_docker_instance(user_id, assignment_id)
-        
-        return jsonify(result)
+        return jsonify({'success': True, 'job_id': job['id'], 'job': job, 'deduplicated': not created}), 202
     
     except Exception as e:
         current_app.logger.error(f"Error creating instance: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @instance_bp.route('/restart-instance/<launch_id>/<user_id>', methods=['POST'])
-def restart_instance(launch_id, user_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    
+@launch_required
+def restart_instance(launch_id, user_id, assignment_id, launch):
     try:
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
-        
-        # Verify user_id matches the one in the launch data to prevent unauthorized access
-        launch_user_id = message_launch.get_launch_data().get('sub')
-        
-        if launch_user_id != user_id:
-            return jsonify({'error': 'Unauthorized access'}), 403
+        # Queue the restart; stopping the old container alone can take the full stop timeout
+        job, created = submit_provisioning_job('restart', user_id, assignment_id)
         
-        # Restart Docker instance
-        result = restart_docker_instance(user_id)
-        
-        return jsonify(result)
+        return jsonify({'success': True, 'job_id': job['id'], 'job': job, 'deduplicated': not created}), 202
     
     except Exception as e:
         current_app.logger.error(f"Error restarting instance: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @instance_bp.route('/shutdown-instance/<launch_id>/<user_id>', methods=['POST'])
-def shutdown_instance(launch_id, user_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    
+@launch_required
+def shutdown_instance(launch_id, user_id, assignment_id, launch):
     try:
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
-        
-        # Verify user_id matches the one in the launch data to prevent unauthorized access
-        launch_user_id = message_launch.get_launch_data().get('sub')
-        
-        if launch_user_id != user_id:
-            return jsonify({'error': 'Unauthorized access'}), 403
-        
         # Shutdown Docker instance
         result = shutdown_user_instance(user_id)
         
@@ -144,4 +84,27 @@ def shutdown_instance(launch_id, user_id):
     
     except Exception as e:
         current_app.logger.error(f"Error shutting down instance: {str(e)}")
-        return jsonify({'success': False, 'message': str(e)}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@instance_bp.route('/job-status/<launch_id>/<user_id>/<job_id>', methods=['GET'])
+@launch_required
+def job_status(launch_id, user_id, job_id, assignment_id, launch):
+    """Report the state of a create or restart job"""
+    job = get_provisioning_job(job_id)
+    
+    # Jobs of other users are reported as unknown rather than forbidden
+    if job is None or job['user_id'] != user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(job)
+
+@instance_bp.route('/capacity', methods=['GET'])
+@operator_required
+def capacity_status():
+    """Report host capacity and how much of it instances have committed, for operators"""
+    try:
+        return jsonify(get_capacity_status())
+    
+    except Exception as e:
+        current_app.logger.error(f"Error reading capacity status: {str(e)}")
+        return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -1,22 +1,52 @@
-from flask import Blueprint, request, render_template, redirect, jsonify, url_for, current_app
+from flask import Blueprint, Response, request, render_template, redirect, jsonify, url_for, current_app
+from markupsafe import Markup
 from pylti1p3.contrib.flask import FlaskOIDCLogin, FlaskRequest
 from pylti1p3.deep_link_resource import DeepLinkResource
-from pylti1p3.tool_config import ToolConfJsonFile
 import json
 import pprint
 from datetime import datetime
 
-from config import get_lti_config_path, PAGE_TITLE
+from config import PAGE_TITLE
 from services.lti_service import get_launch_data_storage
-from services.challenge_service import get_juice_shop_challenges
+from services.launch_context import get_tool_conf, get_tool_jwks, get_message_launch, get_launch_context, remember_launch, launch_required
+from services.lti_credentials import get_cache_stats
+from services.operator_access import operator_required
+from services.challenge_service import get_juice_shop_catalog, get_juice_shop_challenge
 from models.challenge import save_assigned_challenges
 
 # Create blueprint
 lti_bp = Blueprint('lti', __name__)
 
+# (catalog version, rendered challenge picker) of the deep linking page
+challenge_picker_cache = (None, None)
+
+def render_challenge_picker():
+    """Render the category-grouped challenge picker, once per catalog version"""
+    global challenge_picker_cache
+    
+    version, challenges = get_juice_shop_catalog()
+    cached_version, picker = challenge_picker_cache
+    if version is not None and version == cached_version:
+        return picker
+    
+    # Group challenges by category for better organization
+    challenge_categories = {}
+    for challenge in challenges:
+        category = challenge.get('category', 'Uncategorized')
+        if category not in challenge_categories:
+            challenge_categories[category] = []
+        challenge_categories[category].append(challenge)
+    
+    picker = Markup(render_template('challenge_picker.html', challenge_categories=challenge_categories))
+    
+    # A catalog that could not be loaded is not cached, so the next launch tries again
+    if version is not None:
+        challenge_picker_cache = (version, picker)
+    return picker
+
 @lti_bp.route('/login/', methods=['GET', 'POST'])
 def login():
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
+    tool_conf = get_tool_conf()
     launch_data_storage = get_launch_data_storage()
 
     flask_request = FlaskRequest()
@@ -31,20 +61,25 @@ def login():
 
 @lti_bp.route('/jwks/', methods=['GET'])
 def get_jwks():
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    return tool_conf.get_jwks()["keys"][0]
+    body, etag = get_tool_jwks()
+    
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['JWKS_MAX_AGE']
+    # Platforms that already have the key get an empty 304
+    return response.make_conditional(request)
+
+@lti_bp.route('/api/lti-cache-stats', methods=['GET'])
+@operator_required
+def lti_cache_stats():
+    """Report hits and misses of the LTI token and key caches in this process, for operators"""
+    return jsonify(get_cache_stats())
 
 @lti_bp.route('/configure/<launch_id>/', methods=['POST'])
 def save_configuration(launch_id):
     """Save selected challenges for an assignment"""
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                        launch_data_storage=launch_data_storage)
+    message_launch = get_message_launch(launch_id)
     
     if not message_launch.is_deep_link_launch():
         return jsonify({'error': 'Not a deep link launch'}), 400
@@ -90,21 +125,14 @@ def save_configuration(launch_id):
 
 @lti_bp.route('/configure/<launch_id>/<int:challenge_id>/', methods=['GET', 'POST'])
 def configure(launch_id, challenge_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                      launch_data_storage=launch_data_storage)
+    launch = get_launch_context(launch_id)
 
-    if not message_launch.is_deep_link_launch():
+    if not launch.is_deep_link:
         # For regular launches, redirect to assignment page
-        user_id = message_launch.get_launch_data().get('sub')
-        assignment_id = message_launch.get_launch_data().get('https://purl.imsglobal.org/spec/lti/claim/resource_link', {}).get('id')
-        
-        return redirect(f"/assignment/{launch_id}/{user_id}/{assignment_id}")
+        return redirect(f"/assignment/{launch_id}/{launch.user_id}/{launch.assignment_id}")
+
+    # Deep linking needs the full launch to sign the response
+    message_launch = get_message_launch(launch_id)
 
     # For deep linking, create a resource that will redirect to assignment page
     launch_url = f"{request.url_root}assignment"
@@ -122,28 +150,23 @@ def assignment_page():
     # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
     from app import ExtendedFlaskMessageLaunch
     
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
+    tool_conf = get_tool_conf()
     flask_request = FlaskRequest()
     launch_data_storage = get_launch_data_storage()
     message_launch = ExtendedFlaskMessageLaunch(flask_request, tool_conf, launch_data_storage=launch_data_storage)
     message_launch_data = message_launch.get_launch_data()
     
+    # Cache the launch claims so the page's API calls do not restore the launch again
+    remember_launch(message_launch)
+    
     # Log launch data for debugging
     current_app.logger.info("LTI Launch data received:")
     current_app.logger.info(pprint.pformat(message_launch_data))
 
     if message_launch.is_deep_link_launch():
         current_app.logger.info("Processing deep link launch")
-        # Fetch challenges for deep linking
-        challenges = get_juice_shop_challenges()
-        
-        # Group challenges by category for better organization
-        challenge_categories = {}
-        for challenge in challenges:
-            category = challenge.get('category', 'Uncategorized')
-            if category not in challenge_categories:
-                challenge_categories[category] = []
-            challenge_categories[category].append(challenge)
+        # The picker only changes with the catalog; the page around it is rendered per launch
+        challenge_picker = render_challenge_picker()
 
         # Log deep linking settings
         deep_link_settings = message_launch_data.get('https://purl.imsglobal.org/spec/lti-dl/claim/deep_linking_settings', {})
@@ -154,8 +177,7 @@ def assignment_page():
             'is_deep_link_launch': True,
             'launch_data': message_launch_data,
             'launch_id': message_launch.get_launch_id(),
-            'challenges': challenges,
-            'challenge_categories': challenge_categories
+            'challenge_picker': challenge_picker
         }
         return render_template('app.html', **tpl_kwargs)
     else:
@@ -182,23 +204,20 @@ def assignment_page():
                 selected_challenges = json.loads(selected_challenges_json)
                 current_app.logger.info(f"Parsed {len(selected_challenges)} selected challenges")
                 
-                # Get full challenge details from Juice Shop
-                all_challenges = get_juice_shop_challenges()
-                
                 # Prepare challenges with full details for saving
                 challenges_to_save = []
                 for selected in selected_challenges:
-                    for challenge in all_challenges:
-                        if selected['id'] == challenge['id']:
-                            # Create a complete challenge object
-                            challenge_info = {
-                                'id': challenge['id'],
-                                'name': selected['name'],
-                                'description': challenge.get('description', ''),
-                                'difficulty': selected['difficulty']
-                            }
-                            challenges_to_save.append(challenge_info)
-                            break
+                    # Get full challenge details from the cached Juice Shop catalog
+                    challenge = get_juice_shop_challenge(selected['id'])
+                    if challenge:
+                        # Create a complete challenge object
+                        challenge_info = {
+                            'id': challenge['id'],
+                            'name': selected['name'],
+                            'description': challenge.get('description', ''),
+                            'difficulty': selected['difficulty']
+                        }
+                        challenges_to_save.append(challenge_info)
                 
                 # Save to database
                 if challenges_to_save:
@@ -218,26 +237,9 @@ def assignment_page():
         return render_template('assignment.html', **tpl_kwargs)
 
 @lti_bp.route('/assignment/<launch_id>/<user_id>/<assignment_id>', methods=['GET'])
-def assignment(launch_id, user_id, assignment_id):
-    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-    from app import ExtendedFlaskMessageLaunch
-    
-    tool_conf = ToolConfJsonFile(get_lti_config_path())
-    flask_request = FlaskRequest()
-    launch_data_storage = get_launch_data_storage()
-    
+@launch_required
+def assignment(launch_id, user_id, assignment_id, launch):
     try:
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
-        
-        message_launch_data = message_launch.get_launch_data()
-        
-        # Verify user_id matches the one in the launch data to prevent unauthorized access
-        launch_user_id = message_launch_data.get('sub')
-        
-        if launch_user_id != user_id:
-            return jsonify({'error': 'Unauthorized access'}), 403
-        
         tpl_kwargs = {
             'page_title': PAGE_TITLE,
             'launch_id': launch_id,
@@ -255,16 +257,9 @@ def assignment(launch_id, user_id, assignment_id):
 def score(launch_id, earned_score):
     """Submit score back to LMS"""
     try:
-        # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
-        from app import ExtendedFlaskMessageLaunch
-        
         current_app.logger.info(f"Score submission request: launch_id={launch_id}, score={earned_score}")
         
-        tool_conf = ToolConfJsonFile(get_lti_config_path())
-        flask_request = FlaskRequest()
-        launch_data_storage = get_launch_data_storage()
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, flask_request, tool_conf,
-                                                            launch_data_storage=launch_data_storage)
+        message_launch = get_message_launch(launch_id)
 
         if not message_launch.has_ags():
             current_app.logger.error("LTI launch doesn't have Assignment and Grade Service")
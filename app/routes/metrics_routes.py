@@ -0,0 +1,18 @@
+from flask import Blueprint, Response, current_app
+
+from services.metrics import get_metrics_text
+from services.operator_access import operator_required
+
+# Create blueprint
+metrics_bp = Blueprint('metrics', __name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@operator_required
+def metrics():
+    """Expose request, Docker, SQLite, upstream HTTP and LTI metrics of this process to Prometheus"""
+    if not current_app.config['METRICS_ENABLED']:
+        return Response('Not found', status=404, mimetype='text/plain')
+
+    return Response(get_metrics_text(), content_type=PROMETHEUS_CONTENT_TYPE)
\ No newline at end of file
@@ -0,0 +1,49 @@
+from flask import Blueprint, Response, request, current_app
+
+from services.activity import record_activity
+from services.proxy import PROXY_PATH, is_instance_origin, resolve_route, proxy_request, tunnel_websocket
+
+# Create blueprint
+proxy_bp = Blueprint('proxy', __name__, url_prefix=PROXY_PATH)
+
+PROXY_METHODS = ['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS']
+
+def find_route(proxy_token):
+    """Look up a proxy token, returning (route, None) or (None, error response)"""
+    # Instances are never served on the tool's own origin once they have one of their own
+    if not current_app.config['PROXY_ENABLED'] or not is_instance_origin(request):
+        return None, Response('Not found', status=404, mimetype='text/plain')
+    
+    try:
+        route = resolve_route(proxy_token)
+    except Exception as e:
+        current_app.logger.error(f"Error resolving proxy route: {str(e)}")
+        return None, Response('Proxy error', status=500, mimetype='text/plain')
+    
+    if route is None:
+        return None, Response('Instance not found', status=404, mimetype='text/plain')
+    
+    # Proxied traffic is what keeps an instance from being suspended as idle
+    record_activity(route['instance_id'])
+    return route, None
+
+@proxy_bp.route('/<proxy_token>/', defaults={'path': ''}, methods=PROXY_METHODS)
+@proxy_bp.route('/<proxy_token>/<path:path>', methods=PROXY_METHODS)
+def proxy_instance(proxy_token, path):
+    """Forward a request to the instance a proxy token belongs to"""
+    route, error = find_route(proxy_token)
+    if error:
+        return error
+    
+    return proxy_request(proxy_token, route, request)
+
+# Werkzeug only matches WebSocket upgrade requests against rules marked as websocket
+@proxy_bp.route('/<proxy_token>/', defaults={'path': ''}, websocket=True)
+@proxy_bp.route('/<proxy_token>/<path:path>', websocket=True)
+def proxy_instance_websocket(proxy_token, path):
+    """Tunnel a WebSocket connection to the instance a proxy token belongs to"""
+    route, error = find_route(proxy_token)
+    if error:
+        return error
+    
+    return tunnel_websocket(proxy_token, route, request)
\ No newline at end of file
@@ -0,0 +1,42 @@
+import json
+import queue
+from flask import Blueprint, Response, jsonify, current_app
+
+from services.launch_context import launch_required
+from services.status_watcher import subscribe, unsubscribe
+
+# Create blueprint
+stream_bp = Blueprint('stream', __name__, url_prefix='/api')
+
+@stream_bp.route('/status-stream/<launch_id>/<user_id>/<assignment_id>', methods=['GET'])
+@launch_required
+def status_stream(launch_id, user_id, assignment_id, launch):
+    """Server-Sent Events stream of instance and challenge status changes"""
+    try:
+        subscriber = subscribe(user_id, assignment_id)
+    except Exception as e:
+        current_app.logger.error(f"Error opening status stream: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    heartbeat_interval = current_app.config['STATUS_STREAM_HEARTBEAT']
+
+    def generate():
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=heartbeat_interval)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            # Runs when the client disconnects and the generator is closed
+            unsubscribe(user_id, assignment_id, subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Disable response buffering in nginx
+    })
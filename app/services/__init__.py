@@ -8,7 +8,9 @@ from services.docker_service import (
 )
 from services.challenge_service import (
     get_juice_shop_challenges, 
+    get_juice_shop_challenge,
     get_user_challenges, 
     check_challenge_completion
 )
-from services.lti_service import get_launch_data_storage, submit_score
\ No newline at end of file
+from services.lti_service import get_launch_data_storage, submit_score
+from services.pool_service import claim_pooled_instance, refill_pool
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""
+Activity tracker for student instances
+
+Real accesses to an instance (status polls from the assignment page, and
+proxied traffic) are recorded here. Instances without activity for
+INSTANCE_IDLE_MINUTES are suspended by the cleanup thread. Writing
+last_accessed on every status poll would cost a database write per request,
+so each instance's activity is written at most once per ACTIVITY_WRITE_INTERVAL.
+"""
+import threading
+import time
+from flask import current_app
+from models.instance import touch_instance
+
+# Instance ID -> monotonic time its activity was last written to the database
+last_written = {}
+activity_lock = threading.Lock()
+
+def record_activity(instance_id):
+    """Record a real access to an instance"""
+    interval = current_app.config['ACTIVITY_WRITE_INTERVAL']
+    now = time.monotonic()
+
+    with activity_lock:
+        if now - last_written.get(instance_id, float('-inf')) < interval:
+            return
+
+        # Entries older than the interval no longer hold back a write, so they can be dropped
+        for stale_id in [key for key, written in last_written.items() if now - written >= interval]:
+            del last_written[stale_id]
+        last_written[instance_id] = now
+
+    touch_instance(instance_id)
@@ -0,0 +1,148 @@
+"""
+Shared cache backends for Flask-Caching
+
+LTI launch data, nonces and the challenge catalog live in the Flask-Caching
+cache. With the in-process cache a launch stored by one worker is missing on
+the others, so multi-worker deployments need a cache every worker can reach:
+- "redis": any Redis-protocol server, through Flask-Caching's RedisCache
+- "sqlite": a SQLite file shared by the workers on one host
+- "shm": the same SQLite cache on a tmpfs, i.e. in shared memory
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from flask_caching.backends.base import BaseCache
+
+# CACHE_BACKEND -> Flask-Caching CACHE_TYPE
+CACHE_TYPES = {
+    'memory': 'SimpleCache',
+    'redis': 'RedisCache',
+    'sqlite': 'services.cache_backends.SQLiteCache',
+    'shm': 'services.cache_backends.SharedMemoryCache'
+}
+
+# Writes between checks of the entry count
+PRUNE_EVERY = 64
+
+def get_cache_type(config):
+    """Get the Flask-Caching CACHE_TYPE for the configured cache backend"""
+    backend = config['CACHE_BACKEND']
+    if backend not in CACHE_TYPES:
+        raise ValueError(f"Unknown cache backend: {backend}")
+    return CACHE_TYPES[backend]
+
+class SQLiteCache(BaseCache):
+    """
+    Cache stored in a SQLite database file that every worker process opens.
+    Entries beyond the threshold are evicted soonest-expiring first.
+    """
+    def __init__(self, path, default_timeout=300, threshold=10000, synchronous='NORMAL', **kwargs):
+        super().__init__(default_timeout=default_timeout, **kwargs)
+        self.path = path
+        self.threshold = threshold
+        self.synchronous = synchronous
+        self.local = threading.local()
+        self.writes = 0
+
+        conn = self._connection()
+        # expires is a Unix time, 0 means the entry never expires
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires)")
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(path=config['CACHE_SQLITE_PATH'], threshold=config['CACHE_THRESHOLD'])
+        return cls(*args, **kwargs)
+
+    def _connection(self):
+        """Get this thread's connection to the cache database"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # WAL lets readers in other workers continue while one of them writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self.local.conn = conn
+        return conn
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else 0
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM cache WHERE key=? AND (expires=0 OR expires>?)", (key, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def has(self, key):
+        row = self._connection().execute(
+            "SELECT 1 FROM cache WHERE key=? AND (expires=0 OR expires>?)", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def set(self, key, value, timeout=None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires(timeout))
+        )
+        self._maybe_prune()
+        return True
+
+    def add(self, key, value, timeout=None):
+        """Store the value only if the key is missing or expired"""
+        cursor = self._connection().execute("""
+            INSERT INTO cache (key, value, expires) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value, expires=excluded.expires
+            WHERE cache.expires != 0 AND cache.expires <= ?
+        """, (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expires(timeout), time.time()))
+        added = cursor.rowcount > 0
+        if added:
+            self._maybe_prune()
+        return added
+
+    def delete(self, key):
+        cursor = self._connection().execute("DELETE FROM cache WHERE key=?", (key,))
+        return cursor.rowcount > 0
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache")
+        return True
+
+    def _maybe_prune(self):
+        self.writes += 1
+        if self.writes % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries, then evict the soonest-expiring ones beyond the threshold"""
+        conn = self._connection()
+        conn.execute("DELETE FROM cache WHERE expires != 0 AND expires <= ?", (time.time(),))
+
+        excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.threshold
+        if excess > 0:
+            conn.execute("""
+                DELETE FROM cache WHERE key IN (
+                    SELECT key FROM cache ORDER BY expires = 0, expires LIMIT ?
+                )
+            """, (excess,))
+
+class SharedMemoryCache(SQLiteCache):
+    """SQLite cache on a tmpfs such as /dev/shm, shared by the workers of one host without disk I/O"""
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        path = config['CACHE_SHM_PATH']
+        if not os.path.isdir(os.path.dirname(path)):
+            raise ValueError(f"Shared memory cache directory does not exist: {os.path.dirname(path)}")
+
+        # Nothing on a tmpfs survives a reboot, so there is no point in syncing it
+        kwargs.update(path=path, threshold=config['CACHE_THRESHOLD'], synchronous='OFF')
+        return cls(*args, **kwargs)
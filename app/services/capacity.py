@@ -0,0 +1,246 @@
+"""
+Host capacity and admission control for Juice Shop containers
+
+Every container is started with the CONTAINER_* memory, CPU and pids limits,
+so each node's capacity can be shared out in fixed slots. Before a container
+is started its limits are committed against a node's memory and CPUs, read
+from the cgroup the app runs in and /proc for the local node, or from the
+Docker daemon for remote ones. The node is picked among those with a free
+slot by the placement policy. Creates that would overcommit every node wait
+for a slot for a while and are then rejected as capacity full.
+"""
+import math
+import os
+import threading
+import time
+from flask import current_app
+from models.instance import count_active_instances_by_node
+from services.container_backends import get_container_backend
+from services.nodes import get_node, get_nodes, choose_node
+
+# Node name -> admitted containers that do not have an instance row yet
+admissions_in_flight = {}
+admission_lock = threading.Lock()
+# Bumped whenever admissions_in_flight changes, so a capacity snapshot can tell it went stale
+admission_generation = 0
+# Node name -> detected capacity, read once
+host_capacities = {}
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def read_meminfo():
+    """Read /proc/meminfo into a dict of values in MB"""
+    meminfo = {}
+    for line in (read_file('/proc/meminfo') or '').splitlines():
+        key, _, value = line.partition(':')
+        parts = value.split()
+        if parts and parts[0].isdigit():
+            meminfo[key] = int(parts[0]) // 1024
+    return meminfo
+
+def read_cgroup_memory_limit_mb():
+    """Read the memory limit of this process's cgroup (v2, then v1), or None if unlimited"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = read_file(path)
+        if value and value.isdigit():
+            limit_mb = int(value) // (1024 * 1024)
+            # cgroup v1 reports "unlimited" as a huge number
+            return limit_mb if limit_mb < 2 ** 40 else None
+    return None
+
+def read_cgroup_cpu_limit():
+    """Read the CPU quota of this process's cgroup (v2, then v1) in CPUs, or None if unlimited"""
+    value = read_file('/sys/fs/cgroup/cpu.max')
+    if value:
+        quota, _, period = value.partition(' ')
+        if quota.isdigit() and period.isdigit():
+            return int(quota) / int(period)
+        return None
+
+    quota = read_file('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = read_file('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and quota.isdigit() and period.isdigit():
+        return int(quota) / int(period)
+    return None
+
+def detect_local_capacity():
+    """Read the memory (MB) and CPUs of the host this app runs on"""
+    memory_mb = read_meminfo().get('MemTotal', 0)
+    cgroup_memory_mb = read_cgroup_memory_limit_mb()
+    if cgroup_memory_mb:
+        memory_mb = min(memory_mb, cgroup_memory_mb) if memory_mb else cgroup_memory_mb
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    cgroup_cpus = read_cgroup_cpu_limit()
+    if cgroup_cpus:
+        cpus = min(cpus, cgroup_cpus)
+
+    return {'memory_mb': memory_mb, 'cpus': cpus}
+
+def get_host_capacity(node=None):
+    """Get the memory (MB) and CPUs containers can use on a node, from config or detected once"""
+    node = get_node(node)
+
+    # Configured values win, e.g. when the app runs in a container of its own
+    if node['memory_mb'] and node['cpus']:
+        return {'memory_mb': node['memory_mb'], 'cpus': node['cpus']}
+
+    capacity = host_capacities.get(node['name'])
+    if capacity is None:
+        if node['local']:
+            capacity = detect_local_capacity()
+        else:
+            capacity = get_container_backend(node['name']).host_info()
+        host_capacities[node['name']] = capacity
+        current_app.logger.info(f"Detected capacity of node {node['name']}: {capacity['memory_mb']} MB memory, {capacity['cpus']} CPUs")
+
+    return {
+        'memory_mb': node['memory_mb'] or capacity['memory_mb'],
+        'cpus': node['cpus'] or capacity['cpus']
+    }
+
+def get_container_limits():
+    """Get the resource limits every Juice Shop container is started with"""
+    config = current_app.config
+    return {
+        'memory_mb': config['CONTAINER_MEMORY_MB'],
+        'cpus': config['CONTAINER_CPUS'],
+        'pids': config['CONTAINER_PIDS_LIMIT']
+    }
+
+def get_capacity_status():
+    """Get committed and available capacity, in total and per node, for operators"""
+    with admission_lock:
+        in_flight = dict(admissions_in_flight)
+    return capacity_status(in_flight)
+
+def capacity_status(in_flight):
+    """Work out committed and available capacity of every node given the admissions still in flight"""
+    counts = count_active_instances_by_node()
+    node_names = list(get_nodes())
+    # Rows saved before nodes were recorded belong to the first node
+    counts[node_names[0]] = counts.get(node_names[0], 0) + counts.pop(None, 0)
+
+    statuses = [node_capacity_status(name, counts.get(name, 0) + in_flight.get(name, 0)) for name in node_names]
+
+    def total(key):
+        values = [status[key] for status in statuses]
+        return None if None in values else sum(values)
+
+    instances = total('instances')
+    total_slots = total('slots')
+    return {
+        'host_memory_mb': total('host_memory_mb'),
+        'host_cpus': total('host_cpus'),
+        'memory_available_mb': total('memory_available_mb'),
+        'committed_memory_mb': total('committed_memory_mb'),
+        'committed_cpus': total('committed_cpus'),
+        'instances': instances,
+        'slots': total_slots,
+        'free_slots': total('free_slots'),
+        'utilisation': round(instances / total_slots, 3) if total_slots else None,
+        'nodes': statuses
+    }
+
+def node_capacity_status(node_name, instances):
+    """Work out committed and available capacity of one node holding the given number of instances"""
+    config = current_app.config
+    node = get_node(node_name)
+    try:
+        capacity = get_host_capacity(node_name)
+    except Exception as e:
+        # A node whose daemon cannot be reached takes no new containers until it answers again
+        current_app.logger.error(f"Error reading capacity of node {node_name}: {str(e)}")
+        capacity = {'memory_mb': 0, 'cpus': 0}
+    limits = get_container_limits()
+
+    memory_budget = max(capacity['memory_mb'] - config['ADMISSION_RESERVED_MEMORY_MB'], 0) * config['ADMISSION_MEMORY_OVERCOMMIT']
+    cpu_budget = capacity['cpus'] * config['ADMISSION_CPU_OVERCOMMIT']
+
+    # A dimension without a per-container limit does not bound the number of slots
+    slots = []
+    if limits['memory_mb']:
+        slots.append(math.floor(memory_budget / limits['memory_mb']))
+    if limits['cpus']:
+        slots.append(math.floor(cpu_budget / limits['cpus']))
+    total_slots = min(slots) if slots else None
+
+    # Only the local node's free memory can be read directly
+    memory_available_mb = read_meminfo().get('MemAvailable') if node['local'] else None
+
+    return {
+        'node': node_name,
+        'host_memory_mb': capacity['memory_mb'],
+        'host_cpus': capacity['cpus'],
+        'memory_available_mb': memory_available_mb,
+        'committed_memory_mb': instances * limits['memory_mb'],
+        'committed_cpus': instances * limits['cpus'],
+        'instances': instances,
+        'slots': total_slots,
+        'free_slots': max(total_slots - instances, 0) if total_slots is not None else None,
+        'utilisation': round(instances / total_slots, 3) if total_slots else None
+    }
+
+def has_capacity(status):
+    """Check whether one more container fits on a node"""
+    if not current_app.config['ADMISSION_ENABLED']:
+        return True
+
+    if status['free_slots'] is not None and status['free_slots'] < 1:
+        return False
+
+    # Other processes on the host use memory too, so also check what is actually free
+    memory_mb = current_app.config['CONTAINER_MEMORY_MB']
+    available_mb = status['memory_available_mb']
+    if memory_mb and available_mb is not None:
+        return available_mb - memory_mb >= current_app.config['ADMISSION_RESERVED_MEMORY_MB']
+    return True
+
+def reserve_capacity(wait_seconds=0, progress=None):
+    """
+    Reserve capacity for one container, waiting up to wait_seconds for a slot.
+    Returns the name of the node the container goes on, or None if every node is full;
+    release_capacity must follow once the instance row exists or the start failed.
+    """
+    global admission_generation
+    deadline = time.monotonic() + wait_seconds
+    waiting = False
+
+    while True:
+        # Counting instances and reading node capacity can be slow, so it happens outside the lock and the
+        # reservation is only made if no other admission was reserved or released in the meantime
+        with admission_lock:
+            generation = admission_generation
+            in_flight = dict(admissions_in_flight)
+        status = capacity_status(in_flight)
+        node = choose_node([node_status for node_status in status['nodes'] if has_capacity(node_status)])
+
+        with admission_lock:
+            if admission_generation != generation:
+                continue
+            if node is not None:
+                admissions_in_flight[node] = admissions_in_flight.get(node, 0) + 1
+                admission_generation += 1
+                return node
+
+        if time.monotonic() >= deadline:
+            current_app.logger.warning(f"Capacity full: {status['instances']} instances on {len(status['nodes'])} nodes")
+            return None
+
+        if not waiting:
+            waiting = True
+            if progress:
+                progress('waiting')
+        time.sleep(current_app.config['ADMISSION_RETRY_INTERVAL'])
+
+def release_capacity(node):
+    """Release a reservation made by reserve_capacity on a node"""
+    global admission_generation
+    with admission_lock:
+        admissions_in_flight[node] = max(admissions_in_flight.get(node, 0) - 1, 0)
+        admission_generation += 1
@@ -1,27 +1,159 @@
-import requests
+import hashlib
+import json
+import threading
+import time
 from flask import current_app
+from services.http_client import http_get
+from services.proxy import instance_base_url
 from models.instance import get_user_instance
 from models.challenge import (
     get_assigned_challenges, 
     save_assigned_challenges, 
     save_solved_challenge, 
-    get_user_solved_challenges
+    get_user_solved_challenges,
+    get_progress_version
 )
 
+# Key of the catalog in the shared cache, so worker processes reuse each other's fetches
+CATALOG_CACHE_KEY = 'challenge_catalog'
+
+class ChallengeCatalog:
+    """
+    Cached copy of the master Juice Shop challenge catalog.
+    Concurrent misses share a single upstream fetch, and stale data keeps being
+    served while a background refresh is in flight.
+    """
+    def __init__(self):
+        self.challenges = None
+        self.by_id = {}
+        self.fetched_at = 0.0
+        # Digest of the catalog's content; revalidating an unchanged catalog keeps it
+        self.version = None
+        self.lock = threading.Lock()
+        # Set while a fetch is in flight; waiters block on it
+        self.inflight = None
+
+    def _start_fetch(self):
+        """Become the fetching thread if nobody else is, returning the in-flight event and whether we own it"""
+        with self.lock:
+            if self.inflight is not None:
+                return self.inflight, False
+            self.inflight = threading.Event()
+            return self.inflight, True
+
+    def _store(self, challenges, age):
+        version = hashlib.sha256(json.dumps(challenges, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+        with self.lock:
+            self.challenges = challenges
+            self.by_id = {challenge['id']: challenge for challenge in challenges}
+            self.fetched_at = time.monotonic() - age
+            self.version = version
+
+    def _fetch(self, app, inflight):
+        try:
+            # Another worker may have fetched the catalog recently
+            try:
+                shared = app.cache.get(CATALOG_CACHE_KEY)
+            except Exception as e:
+                app.logger.warning(f"Error reading challenge catalog from the shared cache: {str(e)}")
+                shared = None
+            if shared is not None:
+                challenges, fetched_at = shared
+                age = max(time.time() - fetched_at, 0.0)
+                if age < app.config['CHALLENGE_CATALOG_TTL']:
+                    self._store(challenges, age)
+                    return
+
+            with app.app_context():
+                challenges = fetch_juice_shop_challenges()
+            if challenges is not None:
+                self._store(challenges, 0.0)
+                try:
+                    app.cache.set(CATALOG_CACHE_KEY, (challenges, time.time()),
+                                  timeout=app.config['CHALLENGE_CATALOG_STALE_TTL'])
+                except Exception as e:
+                    app.logger.warning(f"Error writing challenge catalog to the shared cache: {str(e)}")
+        finally:
+            with self.lock:
+                self.inflight = None
+            inflight.set()
+
+    def get(self):
+        """Get the catalog, fetching or revalidating it as needed"""
+        config = current_app.config
+        age = time.monotonic() - self.fetched_at
+
+        if self.challenges is not None and age < config['CHALLENGE_CATALOG_TTL']:
+            return self.challenges
+
+        app = current_app._get_current_object()
+
+        if self.challenges is not None and age < config['CHALLENGE_CATALOG_STALE_TTL']:
+            # Serve the stale copy and revalidate in the background
+            inflight, owner = self._start_fetch()
+            if owner:
+                threading.Thread(target=self._fetch, args=(app, inflight), daemon=True).start()
+            return self.challenges
+
+        inflight, owner = self._start_fetch()
+        if owner:
+            self._fetch(app, inflight)
+        else:
+            inflight.wait()
+
+        return self.challenges if self.challenges is not None else []
+
+    def get_versioned(self):
+        """Get the catalog together with its version, or (None, []) if it could not be loaded"""
+        self.get()
+        with self.lock:
+            if self.challenges is None:
+                return None, []
+            return self.version, self.challenges
+
+    def get_by_id(self, challenge_id):
+        """Look up a single challenge in the catalog"""
+        self.get()
+        return self.by_id.get(challenge_id)
+
+    def invalidate(self):
+        """Drop the cached catalog, e.g. after the master container restarted"""
+        with self.lock:
+            self.challenges = None
+            self.by_id = {}
+            self.fetched_at = 0.0
+        current_app.cache.delete(CATALOG_CACHE_KEY)
+
+# Global challenge catalog shared by all requests
+challenge_catalog = ChallengeCatalog()
+
+# User ID -> (container ID, monotonic fetch time, challenges) of the last poll of their instance
+challenge_polls = {}
+challenge_polls_lock = threading.Lock()
+
 def get_juice_shop_challenges():
-    """Fetch challenges from the master Juice Shop API"""
+    """Get challenges from the cached master Juice Shop catalog"""
+    return challenge_catalog.get()
+
+def get_juice_shop_catalog():
+    """Get the cached master Juice Shop catalog as (version, challenges)"""
+    return challenge_catalog.get_versioned()
+
+def get_juice_shop_challenge(challenge_id):
+    """Get a single challenge from the cached master Juice Shop catalog"""
+    return challenge_catalog.get_by_id(challenge_id)
+
+def invalidate_challenge_catalog():
+    """Forget the cached catalog so the next lookup fetches it from the master again"""
+    challenge_catalog.invalidate()
+
+def fetch_juice_shop_challenges():
+    """Fetch challenges from the master Juice Shop API, returning None on failure"""
     juice_shop_url = "http://127.0.0.1:3000"
     
     try:
         current_app.logger.info("Fetching challenges from master Juice Shop instance")
-        response = requests.get(f"{juice_shop_url}/api/challenges/", 
-                        headers={
-                            'Accept-Language': 'en-GB,en;q=0.9',
-                            'Accept': 'application/json, text/plain, */*',
-                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36',
-                            'Connection': 'keep-alive'
-                        },
-                        timeout=10)  # Add a timeout to prevent hanging
+        response = http_get(juice_shop_url, "/api/challenges/", timeout=10, target='master')  # Add a timeout to prevent hanging
         
         if response.status_code == 200:
             challenges = response.json().get('data', [])
@@ -29,37 +161,92 @@ def get_juice_shop_challenges():
             return challenges
         else:
             current_app.logger.error(f"Failed to fetch challenges from master Juice Shop: HTTP {response.status_code}")
-            return []
+            return None
     except Exception as e:
         current_app.logger.error(f"Error fetching challenges from master Juice Shop: {str(e)}")
-        return []
+        return None
 
 def get_challenges_from_instance(instance_url):
     """Fetch challenges from a specific Juice Shop instance"""
-    response = requests.get(f"{instance_url}/api/challenges/", 
-                            headers={
-                                'Accept-Language': 'en-GB,en;q=0.9',
-                                'Accept': 'application/json, text/plain, */*',
-                                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36',
-                                'Connection': 'keep-alive'
-                            })
+    response = http_get(instance_url, "/api/challenges/")
     
     if response.status_code == 200:
         return response.json().get('data', [])
     return []
 
-def get_user_challenges(user_id, assignment_id=None):
-    """Get challenges and user's progress for a specific assignment"""
+def get_instance_challenges(user_id, instance):
+    """
+    Get the challenge list of a user's instance.
+    The last poll is reused for CHALLENGE_POLL_TTL seconds as long as it came from the same container.
+    While the solve poller keeps snapshots fresh, its latest poll is used unless it fell behind.
+    """
+    from services.solve_poller import is_solve_poller_running
+    
+    config = current_app.config
+    container_id = instance['container_id']
+    
+    if is_solve_poller_running():
+        max_age = 2 * config['SOLVE_POLL_ACTIVE_INTERVAL']
+    else:
+        max_age = config['CHALLENGE_POLL_TTL']
+    
+    with challenge_polls_lock:
+        last_poll = challenge_polls.get(user_id)
+    
+    if last_poll and last_poll[0] == container_id and time.monotonic() - last_poll[1] < max_age:
+        return last_poll[2]
+    
+    challenges = get_challenges_from_instance(instance_base_url(instance))
+    record_challenge_poll(user_id, container_id, challenges)
+    return challenges
+
+def record_challenge_poll(user_id, container_id, challenges):
+    """Remember the latest challenge list fetched from a user's instance"""
+    with challenge_polls_lock:
+        challenge_polls[user_id] = (container_id, time.monotonic(), challenges)
+
+def forget_challenge_poll(user_id):
+    """Drop the last poll of a user's instance once it was stopped or restarted"""
+    with challenge_polls_lock:
+        challenge_polls.pop(user_id, None)
+
+def prune_challenge_polls():
+    """Drop polls too old to be reused, e.g. of instances that expired, returning how many were dropped"""
+    config = current_app.config
+    max_age = max(config['CHALLENGE_POLL_TTL'], 2 * config['SOLVE_POLL_ACTIVE_INTERVAL'])
+    cutoff = time.monotonic() - max_age
+    
+    with challenge_polls_lock:
+        stale = [user_id for user_id, (_, fetched_at, _) in challenge_polls.items() if fetched_at < cutoff]
+        for user_id in stale:
+            del challenge_polls[user_id]
+    return len(stale)
+
+def get_progress_etag(user_id, assignment_id, instance):
+    """
+    Validator of a user's challenge progress on an assignment. It changes when a solve is
+    recorded, when the assignment's challenge set changes and when the user's instance changes.
+    """
+    assignment_version, user_version = get_progress_version(user_id, assignment_id)
+    container = instance['container_id'][:12] if instance.get('exists') else 'none'
+    return f"{assignment_version}.{user_version}.{container}"
+
+def get_user_challenges(user_id, assignment_id=None, instance=None, all_challenges=None):
+    """
+    Get challenges and user's progress for a specific assignment.
+    Callers that already looked up the instance or its challenge list can pass them in.
+    """
     try:
         # Get user's instance
-        instance = get_user_instance(user_id)
+        if instance is None:
+            instance = get_user_instance(user_id)
         
         if not instance['exists']:
             return {'challenges': [], 'completed': 0, 'total': 0}
         
         # Fetch all challenges from Juice Shop
-        juice_shop_url = instance['url']
-        all_challenges = get_challenges_from_instance(juice_shop_url)
+        if all_challenges is None:
+            all_challenges = get_instance_challenges(user_id, instance)
         
         # If assignment_id is provided, filter for only assigned challenges
         if assignment_id:
@@ -141,22 +328,22 @@ def get_user_challenges(user_id, assignment_id=None):
         current_app.logger.error(f"Error fetching user challenges: {str(e)}")
         return {'challenges': [], 'completed': 0, 'total': 0}
 
-def check_challenge_completion(user_id, assignment_id=None, launch_id=None):
-    """Check if user has completed challenges and save to database"""
+def check_challenge_completion(user_id, assignment_id=None, launch_id=None, instance=None):
+    """Check if user has completed challenges and save to database; callers that already looked up the instance can pass it in"""
     try:
         from flask import current_app
         current_app.logger.info(f"Checking challenge completion for user {user_id}, assignment {assignment_id}")
         
         # Get user's instance
-        instance = get_user_instance(user_id)
+        if instance is None:
+            instance = get_user_instance(user_id)
         
         if not instance['exists']:
             current_app.logger.warning(f"No instance found for user {user_id}")
             return {'success': False, 'message': 'No running instance found'}
         
         # Fetch challenges from Juice Shop
-        juice_shop_url = instance['url']
-        all_challenges = get_challenges_from_instance(juice_shop_url)
+        all_challenges = get_instance_challenges(user_id, instance)
         
         current_app.logger.info(f"Retrieved {len(all_challenges)} challenges from Juice Shop")
         
@@ -190,24 +377,18 @@ def check_challenge_completion(user_id, assignment_id=None, launch_id=None):
         
         current_app.logger.info(f"Saved {new_solved_count} new solved challenges to database")
         
-        # Get updated challenge status
-        result = get_user_challenges(user_id, assignment_id)
+        # Get updated challenge status from the same instance snapshot
+        result = get_user_challenges(user_id, assignment_id, instance=instance, all_challenges=all_challenges)
         current_app.logger.info(f"Final result: {result['completed']}/{result['total']} challenges completed")
         
-        # Submit score directly if we have a launch_id
+        # Queue the score for the LMS if we have a launch_id; unchanged scores are not sent again
         if launch_id and result['completed'] > 0 and result['total'] > 0:
-            current_app.logger.info(f"Submitting score for user {user_id}: {result['completed']}/{result['total']}")
-            
             # Import here to avoid circular imports
-            from services.lti_service import submit_score
+            from services.launch_context import get_launch_context
+            from services.grade_outbox import submit_grade
             
             # The score is the number of completed challenges out of the total possible
-            score_result = submit_score(launch_id, result['completed'], result['total'])
-            
-            if score_result:
-                current_app.logger.info(f"Score submission successful: {result['completed']}/{result['total']}")
-            else:
-                current_app.logger.error(f"Score submission failed for user {user_id}")
+            submit_grade(get_launch_context(launch_id), result['completed'], result['total'])
         
         return result
     
@@ -0,0 +1,736 @@
+"""
+Container backends used by the Docker service
+
+Every backend exposes the same small set of operations, so the service layer
+does not care whether containers are managed through the Docker Engine API,
+the docker CLI, or an in-process fake used without a Docker daemon.
+"""
+import http.client
+import json
+import os
+import queue
+import socket
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+from flask import current_app
+from utils.metrics import docker_operation_seconds, docker_operation_errors, timed
+
+# Node name -> backend instance shared by all requests
+container_backends = {}
+backend_lock = threading.Lock()
+
+class ContainerBackendError(Exception):
+    """Raised when a container operation fails"""
+    pass
+
+class ContainerBackend:
+    """Interface implemented by all container backends"""
+    name = 'base'
+
+    def run_container(self, name, image, ports=None, env=None, labels=None, limits=None, network=None):
+        """
+        Start a detached, auto-removed container and return its ID.
+        ports maps a container port to a (host_ip, host_port) tuple; host_ip may be None.
+        limits may set 'memory_mb', 'cpus' and 'pids'; unset or zero limits are not applied.
+        network, if given, is the network the container joins instead of the default bridge.
+        """
+        raise NotImplementedError
+
+    def is_running(self, container_id):
+        """Check if a container exists and is running"""
+        raise NotImplementedError
+
+    def is_ready(self, container_id):
+        """
+        Readiness hook for backends that know whether a container's app answers without
+        probing it: True or False, or None to probe it over HTTP like a real container
+        """
+        return None
+
+    def ensure_network(self, network):
+        """Create a bridge network unless it exists already"""
+        raise NotImplementedError
+
+    def container_address(self, container_id, network):
+        """Get a container's IP address on a network, or None if it is not attached"""
+        raise NotImplementedError
+
+    def has_image(self, image):
+        """Check if an image is available locally"""
+        raise NotImplementedError
+
+    def pull_image(self, image):
+        """Pull an image from its registry, raising ContainerBackendError on failure"""
+        raise NotImplementedError
+
+    def stop_container(self, container_id, timeout=10):
+        """Stop a container, returning True on success"""
+        raise NotImplementedError
+
+    def stop_containers(self, container_ids, timeout=10):
+        """Stop several containers, returning the IDs of those that were stopped"""
+        return [container_id for container_id in container_ids if self.stop_container(container_id, timeout)]
+
+    def pause_container(self, container_id):
+        """Freeze all processes of a running container, returning True on success"""
+        raise NotImplementedError
+
+    def unpause_container(self, container_id):
+        """Resume a paused container, returning True on success"""
+        raise NotImplementedError
+
+    def remove_container(self, container_id, force=True):
+        """Remove a container, returning True on success"""
+        raise NotImplementedError
+
+    def list_containers(self, label=None, name=None, all=False):
+        """List IDs of containers matching a label and/or name"""
+        raise NotImplementedError
+
+    def list_container_states(self, label=None):
+        """Map the ID of every container matching a label, stopped ones included, to whether it is running"""
+        raise NotImplementedError
+
+    def host_info(self):
+        """Get the total memory (MB) and CPUs of the Docker host"""
+        raise NotImplementedError
+
+    def container_events(self, label=None):
+        """
+        Subscribe to container events matching a label.
+        The subscription is open when this returns; the returned iterator blocks and
+        yields (container_id, action) tuples until the event stream ends.
+        """
+        raise NotImplementedError
+
+def parse_event_line(line):
+    """Turn one JSON event line into a (container_id, action) tuple, or None"""
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    return event.get('Actor', {}).get('ID') or event.get('id'), event.get('Action') or event.get('status')
+
+def pull_stream_error(body):
+    """
+    Get the error reported in the progress stream of an image pull, or None.
+    The Engine API answers 200 as soon as the pull starts, so a pull that fails later
+    (unknown tag, denied registry access, full disk) only shows up as an error entry.
+    """
+    if isinstance(body, dict):
+        entries = [body]
+    else:
+        entries = []
+        for line in str(body or '').splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+
+    for entry in entries:
+        if isinstance(entry, dict) and (entry.get('error') or entry.get('errorDetail')):
+            return entry.get('error') or entry['errorDetail'].get('message', '')
+    return None
+
+class SubprocessBackend(ContainerBackend):
+    """Backend that shells out to the docker CLI for every operation"""
+    name = 'cli'
+
+    def __init__(self, docker_host=None):
+        # Any host the CLI accepts for -H, e.g. ssh://user@node or tcp://node:2376
+        self.docker_host = docker_host
+
+    def _docker(self):
+        return ["docker", "-H", self.docker_host] if self.docker_host else ["docker"]
+
+    def _run(self, cmd):
+        return subprocess.run(self._docker() + cmd, capture_output=True, text=True)
+
+    def run_container(self, name, image, ports=None, env=None, labels=None, limits=None, network=None):
+        cmd = ["run", "--rm", "-d", "--name", name]
+        for key, value in (env or {}).items():
+            cmd += ["-e", f"{key}={value}"]
+        for container_port, (host_ip, host_port) in (ports or {}).items():
+            binding = f"{host_ip}:{host_port}" if host_ip else f"{host_port}"
+            cmd += ["-p", f"{binding}:{container_port}"]
+        for key, value in (labels or {}).items():
+            cmd += ["--label", f"{key}={value}"]
+        limits = limits or {}
+        if limits.get('memory_mb'):
+            cmd += ["--memory", f"{limits['memory_mb']}m"]
+        if limits.get('cpus'):
+            cmd += ["--cpus", str(limits['cpus'])]
+        if limits.get('pids'):
+            cmd += ["--pids-limit", str(limits['pids'])]
+        if network:
+            cmd += ["--network", network]
+        cmd.append(image)
+
+        result = self._run(cmd)
+        if result.returncode != 0:
+            raise ContainerBackendError(result.stderr.strip())
+        return result.stdout.strip()
+
+    def is_running(self, container_id):
+        result = self._run(["inspect", "--format", "{{.State.Running}}", container_id])
+        return result.returncode == 0 and 'true' in result.stdout.lower()
+
+    def has_image(self, image):
+        return self._run(["image", "inspect", image]).returncode == 0
+
+    def ensure_network(self, network):
+        if self._run(["network", "inspect", network]).returncode == 0:
+            return
+        result = self._run(["network", "create", "--driver", "bridge", network])
+        if result.returncode != 0 and 'already exists' not in result.stderr:
+            raise ContainerBackendError(f"Failed to create network {network}: {result.stderr.strip()}")
+
+    def container_address(self, container_id, network):
+        result = self._run(["inspect", "--format", "{{json .NetworkSettings.Networks}}", container_id])
+        if result.returncode != 0:
+            return None
+        return (json.loads(result.stdout or 'null') or {}).get(network, {}).get('IPAddress') or None
+
+    def pull_image(self, image):
+        result = self._run(["pull", image])
+        if result.returncode != 0:
+            raise ContainerBackendError(f"Failed to pull image {image}: {result.stderr.strip()}")
+
+    def stop_container(self, container_id, timeout=10):
+        return self._run(["stop", "-t", str(timeout), container_id]).returncode == 0
+
+    def stop_containers(self, container_ids, timeout=10):
+        # One docker stop for the whole batch; it stops the containers in parallel and
+        # prints each one it stopped, while failures only go to stderr
+        if not container_ids:
+            return []
+        result = self._run(["stop", "-t", str(timeout)] + list(container_ids))
+        stopped = set(result.stdout.split())
+        return [container_id for container_id in container_ids if container_id in stopped]
+
+    def pause_container(self, container_id):
+        return self._run(["pause", container_id]).returncode == 0
+
+    def unpause_container(self, container_id):
+        return self._run(["unpause", container_id]).returncode == 0
+
+    def remove_container(self, container_id, force=True):
+        cmd = ["rm", "-f", container_id] if force else ["rm", container_id]
+        return self._run(cmd).returncode == 0
+
+    def list_containers(self, label=None, name=None, all=False):
+        cmd = ["ps", "-q", "--no-trunc"]
+        if all:
+            cmd.append("-a")
+        if label:
+            cmd += ["--filter", f"label={label}"]
+        if name:
+            cmd += ["--filter", f"name={name}"]
+
+        result = self._run(cmd)
+        if result.returncode != 0:
+            raise ContainerBackendError(result.stderr.strip())
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+    def list_container_states(self, label=None):
+        cmd = ["ps", "-a", "--no-trunc", "--format", "{{.ID}} {{.State}}"]
+        if label:
+            cmd += ["--filter", f"label={label}"]
+
+        result = self._run(cmd)
+        if result.returncode != 0:
+            raise ContainerBackendError(result.stderr.strip())
+
+        states = {}
+        for line in result.stdout.splitlines():
+            container_id, _, state = line.strip().partition(' ')
+            if container_id:
+                states[container_id] = state in ('running', 'paused')
+        return states
+
+    def host_info(self):
+        result = self._run(["info", "--format", "{{json .}}"])
+        if result.returncode != 0:
+            raise ContainerBackendError(f"Failed to read Docker host info: {result.stderr.strip()}")
+        info = json.loads(result.stdout)
+        return {'memory_mb': info.get('MemTotal', 0) // (1024 * 1024), 'cpus': info.get('NCPU', 0)}
+
+    def container_events(self, label=None):
+        cmd = self._docker() + ["events", "--filter", "type=container", "--format", "{{json .}}"]
+        if label:
+            cmd += ["--filter", f"label={label}"]
+
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+        def iter_events():
+            try:
+                for line in process.stdout:
+                    event = parse_event_line(line)
+                    if event:
+                        yield event
+            finally:
+                process.kill()
+
+        return iter_events()
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection that talks to a unix domain socket"""
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+# Engine API methods that can be sent again when it is unknown whether the daemon received them
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE')
+
+class EngineAPIBackend(ContainerBackend):
+    """
+    Backend that talks to the Docker Engine API over persistent connections,
+    to a unix socket path or a tcp://host:port address
+    """
+    name = 'engine'
+
+    def __init__(self, socket_path='/var/run/docker.sock', pool_size=8, timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self, timeout):
+        if self.socket_path.startswith('tcp://'):
+            host, _, port = self.socket_path[len('tcp://'):].partition(':')
+            return http.client.HTTPConnection(host, int(port or 2375), timeout=timeout)
+        return UnixHTTPConnection(self.socket_path, timeout=timeout)
+
+    def _acquire(self):
+        """Return (connection, whether it was reused from the pool)"""
+        try:
+            return self.pool.get_nowait(), True
+        except queue.Empty:
+            return self._connect(self.timeout), False
+
+    def _release(self, conn):
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _request(self, method, path, params=None, body=None):
+        """Send a request and return (status, decoded JSON body or None)"""
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+
+        # A pooled connection may have been closed by the daemon, so retry once on a fresh one. A request
+        # that may have reached the daemon is only repeated if repeating it is harmless.
+        conn, reused = self._acquire()
+        for attempt in range(2):
+            sent = False
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                sent = True
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                if attempt == 1 or not reused or (sent and method not in IDEMPOTENT_METHODS):
+                    raise ContainerBackendError(f"Docker Engine API request failed: {str(e)}")
+                conn = self._connect(self.timeout)
+                continue
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+
+            try:
+                return response.status, json.loads(data) if data else None
+            except ValueError:
+                return response.status, data.decode(errors='replace')
+
+    def _error_message(self, body):
+        if isinstance(body, dict):
+            return body.get('message', '')
+        return str(body or '')
+
+    def run_container(self, name, image, ports=None, env=None, labels=None, limits=None, network=None):
+        spec = {
+            'Image': image,
+            'Env': [f"{key}={value}" for key, value in (env or {}).items()],
+            'Labels': dict(labels or {}),
+            'ExposedPorts': {},
+            'HostConfig': {'AutoRemove': True, 'PortBindings': {}}
+        }
+        for container_port, (host_ip, host_port) in (ports or {}).items():
+            key = f"{container_port}/tcp"
+            spec['ExposedPorts'][key] = {}
+            spec['HostConfig']['PortBindings'][key] = [{'HostIp': host_ip or '', 'HostPort': str(host_port)}]
+        limits = limits or {}
+        if limits.get('memory_mb'):
+            spec['HostConfig']['Memory'] = int(limits['memory_mb']) * 1024 * 1024
+        if limits.get('cpus'):
+            spec['HostConfig']['NanoCpus'] = int(float(limits['cpus']) * 1e9)
+        if limits.get('pids'):
+            spec['HostConfig']['PidsLimit'] = int(limits['pids'])
+        if network:
+            spec['HostConfig']['NetworkMode'] = network
+
+        status, body = self._request('POST', '/containers/create', params={'name': name}, body=spec)
+
+        if status == 404:
+            # Image is not available locally yet, pull it like `docker run` would
+            self.pull_image(image)
+            status, body = self._request('POST', '/containers/create', params={'name': name}, body=spec)
+
+        if status != 201:
+            raise ContainerBackendError(self._error_message(body))
+
+        container_id = body['Id']
+        status, body = self._request('POST', f"/containers/{container_id}/start")
+        if status not in (204, 304):
+            self.remove_container(container_id)
+            raise ContainerBackendError(self._error_message(body))
+
+        return container_id
+
+    def is_running(self, container_id):
+        status, body = self._request('GET', f"/containers/{quote(container_id)}/json")
+        return status == 200 and bool(body.get('State', {}).get('Running'))
+
+    def has_image(self, image):
+        status, _ = self._request('GET', f"/images/{quote(image, safe='/:')}/json")
+        return status == 200
+
+    def ensure_network(self, network):
+        status, _ = self._request('GET', f"/networks/{quote(network)}")
+        if status == 200:
+            return
+        status, body = self._request('POST', '/networks/create', body={'Name': network, 'Driver': 'bridge'})
+        # 409: created concurrently by another worker
+        if status not in (201, 409):
+            raise ContainerBackendError(f"Failed to create network {network}: {self._error_message(body)}")
+
+    def container_address(self, container_id, network):
+        status, body = self._request('GET', f"/containers/{quote(container_id)}/json")
+        if status != 200:
+            return None
+        networks = body.get('NetworkSettings', {}).get('Networks') or {}
+        return networks.get(network, {}).get('IPAddress') or None
+
+    def pull_image(self, image):
+        image_name, _, tag = image.partition(':')
+        status, body = self._request('POST', '/images/create',
+                                     params={'fromImage': image_name, 'tag': tag or 'latest'})
+        if status != 200:
+            raise ContainerBackendError(f"Failed to pull image {image}: {self._error_message(body)}")
+        error = pull_stream_error(body)
+        if error is not None:
+            raise ContainerBackendError(f"Failed to pull image {image}: {error}")
+
+    def stop_container(self, container_id, timeout=10):
+        status, _ = self._request('POST', f"/containers/{quote(container_id)}/stop", params={'t': timeout})
+        return status in (204, 304)
+
+    def stop_containers(self, container_ids, timeout=10):
+        # The API has no multi-container stop, so the batch is sent concurrently over the connection pool
+        if not container_ids:
+            return []
+
+        def stop(container_id):
+            try:
+                return self.stop_container(container_id, timeout)
+            except ContainerBackendError:
+                return False
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(len(container_ids), self.pool.maxsize)) as executor:
+                results = list(executor.map(stop, container_ids))
+        except RuntimeError:
+            # Interpreter shutdown, when no new threads can be started
+            results = [stop(container_id) for container_id in container_ids]
+        return [container_id for container_id, stopped in zip(container_ids, results) if stopped]
+
+    def pause_container(self, container_id):
+        status, _ = self._request('POST', f"/containers/{quote(container_id)}/pause")
+        return status == 204
+
+    def unpause_container(self, container_id):
+        status, _ = self._request('POST', f"/containers/{quote(container_id)}/unpause")
+        return status == 204
+
+    def remove_container(self, container_id, force=True):
+        status, _ = self._request('DELETE', f"/containers/{quote(container_id)}", params={'force': int(force)})
+        return status in (204, 404)
+
+    def list_containers(self, label=None, name=None, all=False):
+        filters = {}
+        if label:
+            filters['label'] = [label]
+        if name:
+            filters['name'] = [name]
+
+        status, body = self._request('GET', '/containers/json',
+                                     params={'all': int(all), 'filters': json.dumps(filters)})
+        if status != 200:
+            raise ContainerBackendError(self._error_message(body))
+        return [container['Id'] for container in body]
+
+    def list_container_states(self, label=None):
+        filters = {'label': [label]} if label else {}
+        status, body = self._request('GET', '/containers/json',
+                                     params={'all': 1, 'filters': json.dumps(filters)})
+        if status != 200:
+            raise ContainerBackendError(self._error_message(body))
+        return {container['Id']: container.get('State') in ('running', 'paused') for container in body}
+
+    def host_info(self):
+        status, body = self._request('GET', '/info')
+        if status != 200:
+            raise ContainerBackendError(f"Failed to read Docker host info: {self._error_message(body)}")
+        return {'memory_mb': body.get('MemTotal', 0) // (1024 * 1024), 'cpus': body.get('NCPU', 0)}
+
+    def container_events(self, label=None):
+        filters = {'type': ['container']}
+        if label:
+            filters['label'] = [label]
+
+        # The event stream never ends on its own, so it gets a dedicated connection without a timeout
+        conn = self._connect(None)
+        try:
+            conn.request('GET', f"/events?{urlencode({'filters': json.dumps(filters)})}")
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            raise ContainerBackendError(f"Failed to subscribe to Docker events: {str(e)}")
+
+        if response.status != 200:
+            conn.close()
+            raise ContainerBackendError(f"Failed to subscribe to Docker events: HTTP {response.status}")
+
+        def iter_events():
+            try:
+                for line in iter(response.readline, b''):
+                    event = parse_event_line(line)
+                    if event:
+                        yield event
+            finally:
+                conn.close()
+
+        return iter_events()
+
+class FakeBackend(ContainerBackend):
+    """In-process backend for running the service layer without a Docker daemon"""
+    name = 'fake'
+
+    def __init__(self, memory_mb=8192, cpus=4):
+        self.containers = {}
+        self.images = set()
+        self.networks = set()
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.memory_mb = memory_mb
+        self.cpus = cpus
+
+    def _publish(self, container_id, action):
+        for subscriber in list(self.subscribers):
+            subscriber.put((container_id, action))
+
+    def run_container(self, name, image, ports=None, env=None, labels=None, limits=None, network=None):
+        with self.lock:
+            if any(c['name'] == name for c in self.containers.values()):
+                raise ContainerBackendError(f"Conflict. The container name \"/{name}\" is already in use")
+
+            container_id = uuid.uuid4().hex + uuid.uuid4().hex
+            self.containers[container_id] = {
+                'name': name,
+                'image': image,
+                'ports': dict(ports or {}),
+                'env': dict(env or {}),
+                'labels': dict(labels or {}),
+                'limits': dict(limits or {}),
+                'network': network,
+                'address': f"10.89.{len(self.containers) // 250}.{len(self.containers) % 250 + 2}" if network else None,
+                'running': True
+            }
+            self._publish(container_id, 'start')
+            return container_id
+
+    def _find(self, container_id):
+        for full_id in self.containers:
+            if full_id.startswith(container_id):
+                return full_id
+        return None
+
+    def is_running(self, container_id):
+        with self.lock:
+            full_id = self._find(container_id)
+            return bool(full_id and self.containers[full_id]['running'])
+
+    def is_ready(self, container_id):
+        # Nothing listens behind a fake container, so it is ready as soon as it runs
+        return self.is_running(container_id)
+
+    def has_image(self, image):
+        with self.lock:
+            return image in self.images
+
+    def ensure_network(self, network):
+        with self.lock:
+            self.networks.add(network)
+
+    def container_address(self, container_id, network):
+        with self.lock:
+            full_id = self._find(container_id)
+            if not full_id or self.containers[full_id]['network'] != network:
+                return None
+            return self.containers[full_id]['address']
+
+    def pull_image(self, image):
+        with self.lock:
+            self.images.add(image)
+
+    def stop_container(self, container_id, timeout=10):
+        with self.lock:
+            full_id = self._find(container_id)
+            if not full_id:
+                return False
+            # Containers are started with --rm, so stopping also removes them
+            del self.containers[full_id]
+            self._publish(full_id, 'die')
+            self._publish(full_id, 'destroy')
+            return True
+
+    def pause_container(self, container_id):
+        with self.lock:
+            full_id = self._find(container_id)
+            if not full_id or self.containers[full_id].get('paused'):
+                return False
+            self.containers[full_id]['paused'] = True
+            self._publish(full_id, 'pause')
+            return True
+
+    def unpause_container(self, container_id):
+        with self.lock:
+            full_id = self._find(container_id)
+            if not full_id or not self.containers[full_id].get('paused'):
+                return False
+            self.containers[full_id]['paused'] = False
+            self._publish(full_id, 'unpause')
+            return True
+
+    def remove_container(self, container_id, force=True):
+        with self.lock:
+            full_id = self._find(container_id)
+            if full_id:
+                del self.containers[full_id]
+                self._publish(full_id, 'destroy')
+            return True
+
+    def _has_label(self, container, label):
+        key, _, value = label.partition('=')
+        return container['labels'].get(key) == value
+
+    def list_containers(self, label=None, name=None, all=False):
+        with self.lock:
+            result = []
+            for container_id, container in self.containers.items():
+                if not all and not container['running']:
+                    continue
+                if label and not self._has_label(container, label):
+                    continue
+                if name and name not in container['name']:
+                    continue
+                result.append(container_id)
+            return result
+
+    def list_container_states(self, label=None):
+        with self.lock:
+            return {container_id: container['running']
+                    for container_id, container in self.containers.items()
+                    if not label or self._has_label(container, label)}
+
+    def host_info(self):
+        return {'memory_mb': self.memory_mb, 'cpus': self.cpus}
+
+    def container_events(self, label=None):
+        subscriber = queue.Queue()
+        self.subscribers.append(subscriber)
+
+        def iter_events():
+            try:
+                while True:
+                    yield subscriber.get()
+            finally:
+                self.subscribers.remove(subscriber)
+
+        return iter_events()
+
+class InstrumentedBackend:
+    """Wraps a backend to time each of its operations; everything else passes through"""
+    # container_events streams for as long as the watcher runs, so it is not timed
+    TIMED_OPERATIONS = frozenset(['run_container', 'is_running', 'ensure_network', 'container_address',
+                                  'has_image', 'pull_image', 'stop_container', 'stop_containers',
+                                  'pause_container', 'unpause_container', 'remove_container',
+                                  'list_containers', 'list_container_states', 'host_info'])
+
+    def __init__(self, backend, node_name):
+        self.backend = backend
+        self.node_name = node_name
+
+    def __getattr__(self, attr):
+        value = getattr(self.backend, attr)
+        if attr not in self.TIMED_OPERATIONS:
+            return value
+
+        node_name = self.node_name
+
+        def timed_operation(*args, **kwargs):
+            with timed(docker_operation_seconds, docker_operation_errors, node_name, attr):
+                return value(*args, **kwargs)
+
+        # Later lookups find the wrapper without going through __getattr__
+        setattr(self, attr, timed_operation)
+        return timed_operation
+
+def create_container_backend(node, config):
+    """Create the container backend for a node, as selected by its backend setting"""
+    backend_name = node['backend']
+    docker_host = node['docker_host']
+
+    if backend_name == 'fake':
+        return FakeBackend()
+
+    if backend_name == 'engine':
+        if docker_host and docker_host.startswith('tcp://'):
+            return EngineAPIBackend(docker_host, pool_size=config.get('DOCKER_API_POOL_SIZE', 8))
+        socket_path = docker_host[len('unix://'):] if docker_host else config.get('DOCKER_SOCKET', '/var/run/docker.sock')
+        if os.path.exists(socket_path):
+            return EngineAPIBackend(socket_path, pool_size=config.get('DOCKER_API_POOL_SIZE', 8))
+        current_app.logger.warning(f"Docker socket {socket_path} not found, falling back to the docker CLI")
+
+    return SubprocessBackend(docker_host)
+
+def get_container_backend(node=None):
+    """Get the shared container backend of a node (the first node by default), creating it on first use"""
+    from services.nodes import get_node
+
+    node = get_node(node)
+    backend = container_backends.get(node['name'])
+
+    if backend is None:
+        with backend_lock:
+            backend = container_backends.get(node['name'])
+            if backend is None:
+                backend = InstrumentedBackend(create_container_backend(node, current_app.config), node['name'])
+                container_backends[node['name']] = backend
+                current_app.logger.info(f"Using '{backend.name}' container backend for node {node['name']}")
+
+    return backend
@@ -0,0 +1,110 @@
+"""
+In-memory table of managed container states
+
+The table is filled in bulk by a single container listing and kept current by
+a Docker events subscription, so per-request status checks are dictionary
+lookups instead of one `docker inspect` each. Every Docker node has its own
+table and events subscription.
+"""
+import threading
+import time
+from flask import current_app
+from services.container_backends import get_container_backend
+from services.nodes import get_node, get_nodes
+
+MANAGED_LABEL = "managed-by=lti-juice-shop"
+
+# Node name -> {container ID -> whether the container is running}
+container_states = {}
+# Node name -> monotonic time of the last bulk refresh
+snapshot_taken_at = {}
+# Nodes whose events subscription is currently connected and keeping their table current
+events_connected = set()
+state_lock = threading.Lock()
+
+def refresh_container_states(node=None):
+    """Replace a node's state table with one bulk listing of managed containers"""
+    node_name = get_node(node)['name']
+    states = get_container_backend(node_name).list_container_states(label=MANAGED_LABEL)
+
+    with state_lock:
+        container_states[node_name] = states
+        snapshot_taken_at[node_name] = time.monotonic()
+
+    return states
+
+def record_container_state(container_id, running, node=None):
+    """Record a state change the application caused itself"""
+    node_name = get_node(node)['name']
+    with state_lock:
+        states = container_states.setdefault(node_name, {})
+        if running:
+            states[container_id] = True
+        else:
+            states.pop(container_id, None)
+
+def is_container_running_cached(container_id, node=None):
+    """
+    Check if a container is running using its node's state table.
+    The table is refreshed in bulk once it is older than CONTAINER_STATE_MAX_AGE,
+    unless the events subscription is keeping it current.
+    """
+    from services.docker_service import is_container_running
+
+    max_age = current_app.config['CONTAINER_STATE_MAX_AGE']
+    node_name = get_node(node)['name']
+
+    try:
+        if node_name not in events_connected and time.monotonic() - snapshot_taken_at.get(node_name, 0.0) > max_age:
+            refresh_container_states(node_name)
+    except Exception as e:
+        current_app.logger.error(f"Error refreshing container states of node {node_name}: {str(e)}")
+        return is_container_running(container_id, node_name)
+
+    with state_lock:
+        running = container_states.get(node_name, {}).get(container_id)
+
+    if running is None:
+        # Unknown to the snapshot, e.g. started by another worker since the last refresh
+        running = is_container_running(container_id, node_name)
+        if running:
+            record_container_state(container_id, True, node_name)
+
+    return running
+
+def start_container_state_watcher(app):
+    """Start one background thread per node that keeps its state table current from Docker events"""
+    def watcher_thread_func(node_name):
+        while True:
+            try:
+                with app.app_context():
+                    backend = get_container_backend(node_name)
+                    events = backend.container_events(label=MANAGED_LABEL)
+
+                    # Take the snapshot after subscribing so no event falls in between
+                    refresh_container_states(node_name)
+                    events_connected.add(node_name)
+
+                    for container_id, action in events:
+                        if not container_id:
+                            continue
+                        if action in ('start', 'unpause'):
+                            record_container_state(container_id, True, node_name)
+                        elif action in ('die', 'stop', 'kill', 'destroy'):
+                            record_container_state(container_id, False, node_name)
+            except Exception as e:
+                app.logger.error(f"Error in container state watcher of node {node_name}: {str(e)}")
+
+            # Stream ended or failed, fall back to bulk refreshes until it reconnects
+            events_connected.discard(node_name)
+            time.sleep(app.config['CONTAINER_STATE_MAX_AGE'])
+
+    with app.app_context():
+        node_names = list(get_nodes())
+
+    watcher_threads = []
+    for node_name in node_names:
+        watcher_thread = threading.Thread(target=watcher_thread_func, args=(node_name,), daemon=True)
+        watcher_thread.start()
+        watcher_threads.append(watcher_thread)
+    return watcher_threads
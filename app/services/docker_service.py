@@ -1,32 +1,123 @@
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
-from models.instance import find_available_port, save_instance, update_instance_status, get_user_instance, get_expired_instances
+from services.container_backends import get_container_backend
+from services.container_state import record_container_state
+from services.port_allocator import release_port
+from services.http_client import evict_http_session
+from services.challenge_service import forget_challenge_poll, prune_challenge_polls
+from services.readiness import wait_until_ready
+from services.capacity import get_container_limits, reserve_capacity, release_capacity
+from services.nodes import get_node, get_nodes
+from services.proxy import JUICE_SHOP_PORT, new_proxy_token, juice_shop_proxy_env, instance_base_url, instance_public_url
+from models.instance import find_available_port, save_instance, update_instance_status, update_instance_statuses, get_user_instance, get_idle_instances, get_expired_instances, archive_old_instances
 
-# Global list to track running containers in memory
-running_containers = []
+# Global dict to track running containers in memory, container ID -> node name
+running_containers = {}
 # Global variable to track the master Juice Shop container for challenges
 master_juice_shop_container = None
+# Nodes the Juice Shop image is known to be available on
+juice_shop_image_nodes = set()
+# Nodes DOCKER_NETWORK is known to exist on
+proxy_network_nodes = set()
 
-def is_container_running(container_id):
-    """Check if a Docker container exists and is running"""
+JUICE_SHOP_IMAGE = "bkimminich/juice-shop"
+
+def is_container_running(container_id, node=None):
+    """Check if a Docker container exists and is running on a node"""
     try:
-        # Check if container exists and is running
-        cmd = ["docker", "inspect", "--format='{{.State.Running}}'", container_id]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        # If command executed successfully and output contains "true", container is running
-        if result.returncode == 0 and 'true' in result.stdout.lower():
+        if get_container_backend(node).is_running(container_id):
             return True
         
         # Container not found or not running
-        current_app.logger.warning(f"Container {container_id} not running or not found: {result.stderr}")
+        current_app.logger.warning(f"Container {container_id} not running or not found")
         return False
     except Exception as e:
         current_app.logger.error(f"Error checking container {container_id} status: {str(e)}")
         return False
 
-def create_docker_instance(user_id, assignment_id=None):
-    """Create a new Juice Shop Docker instance for the user"""
+def ensure_juice_shop_image(progress=None, node=None):
+    """Pull the Juice Shop image if it is not available on a node yet"""
+    node_name = get_node(node)['name']
+    if node_name in juice_shop_image_nodes:
+        return
+    
+    backend = get_container_backend(node_name)
+    if not backend.has_image(JUICE_SHOP_IMAGE):
+        if progress:
+            progress('pulling')
+        current_app.logger.info(f"Pulling image {JUICE_SHOP_IMAGE} on node {node_name}")
+        backend.pull_image(JUICE_SHOP_IMAGE)
+    
+    juice_shop_image_nodes.add(node_name)
+
+def run_juice_shop_container(container_name, port, node=None, proxy_token=None):
+    """
+    Start a detached Juice Shop container published on the given host port of a node,
+    or, for a proxy token, attached to DOCKER_NETWORK without a published port
+    """
+    env = {"NODE_ENV": "unsafe"}
+    if proxy_token:
+        env.update(juice_shop_proxy_env(proxy_token))
+    
+    # Containers are auto-removed when stopped
+    try:
+        container_id = get_container_backend(node).run_container(
+            container_name,
+            JUICE_SHOP_IMAGE,
+            ports={JUICE_SHOP_PORT: (None, port)} if port else None,
+            env=env,
+            labels={"managed-by": "lti-juice-shop"},  # Add label for tracking
+            limits=get_container_limits(),
+            network=current_app.config['DOCKER_NETWORK'] if proxy_token else None
+        )
+    except Exception as e:
+        raise Exception(f"Failed to create Docker container: {str(e)}")
+    
+    record_container_state(container_id, True, node)
+    
+    # Keep track of running containers
+    running_containers[container_id] = get_node(node)['name']
+    
+    return container_id
+
+def start_juice_shop_instance(name_prefix, node=None):
+    """
+    Start the container of a new instance on a node, returning its container ID, node, and
+    either its host port or, with PROXY_ENABLED, its proxy token and upstream address
+    """
+    network = current_app.config['DOCKER_NETWORK']
+    node_name = get_node(node)['name']
+    
+    if not current_app.config['PROXY_ENABLED']:
+        port = find_available_port(node_name)
+        try:
+            container_id = run_juice_shop_container(f"{name_prefix}_{port}", port, node_name)
+        except Exception:
+            release_port(port, node_name)
+            raise
+        return {'container_id': container_id, 'node': node_name, 'port': port, 'proxy_token': None, 'upstream': None}
+    
+    backend = get_container_backend(node_name)
+    if node_name not in proxy_network_nodes:
+        backend.ensure_network(network)
+        proxy_network_nodes.add(node_name)
+    
+    proxy_token = new_proxy_token()
+    container_id = run_juice_shop_container(f"{name_prefix}_{proxy_token[:12]}", None, node_name, proxy_token)
+    
+    address = backend.container_address(container_id, network)
+    if not address:
+        stop_docker_container(container_id, node_name)
+        raise Exception(f"Container {container_id} has no address on network {network}")
+    
+    return {'container_id': container_id, 'node': node_name, 'port': None, 'proxy_token': proxy_token,
+            'upstream': f"{address}:{JUICE_SHOP_PORT}"}
+
+def create_docker_instance(user_id, assignment_id=None, progress=None):
+    """
+    Create a new Juice Shop Docker instance for the user.
+    progress, if given, is called with 'pulling' and 'starting' as provisioning advances.
+    """
     try:
         from flask import current_app
         
@@ -40,44 +131,71 @@ def create_docker_instance(user_id, assignment_id=None):
                 'instance': existing_instance
             }
         
-        # Find available port
-        port = find_available_port()
-        
-        # Create Docker container
-        container_name = f"juice_shop_{user_id}_{port}"
-        
-        # Run the docker command with auto-removal
-        cmd = [
-            "docker", "run", 
-            "--rm",  # Ensure container is removed when stopped
-            "-d",
-            "--name", container_name,
-            "-e", "NODE_ENV=unsafe",
-            "-p", f"{port}:3000",
-            "--label", "managed-by=lti-juice-shop",  # Add label for tracking
-            "bkimminich/juice-shop"
-        ]
+        if existing_instance.get('status') == 'starting':
+            return {
+                'success': False,
+                'message': 'User already has an instance that is starting',
+                'instance': existing_instance
+            }
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        # Hand out a pre-warmed container from the pool if one is available
+        from services.pool_service import claim_pooled_instance
+        pooled_instance = claim_pooled_instance(user_id, assignment_id)
         
-        if result.returncode != 0:
-            raise Exception(f"Failed to create Docker container: {result.stderr}")
+        if pooled_instance:
+            port = pooled_instance['port']
+            
+            # A pooled container that has not answered yet is waited for like a cold start
+            if pooled_instance['status'] == 'starting':
+                if progress:
+                    progress('starting')
+                if not wait_until_ready(pooled_instance['id'], pooled_instance['container_id'], instance_base_url(pooled_instance), node=pooled_instance['node']):
+                    return {'success': False, 'message': 'Instance did not become ready in time'}
+            
+            return {
+                'success': True,
+                'container_id': pooled_instance['container_id'],
+                'port': port,
+                'instance_id': pooled_instance['id'],
+                'url': instance_public_url(pooled_instance),
+                'pooled': True
+            }
         
-        container_id = result.stdout.strip()
+        # Wait for a free slot on some node, then give up with a capacity full response
+        node = reserve_capacity(current_app.config['ADMISSION_WAIT_SECONDS'], progress)
+        if node is None:
+            return {
+                'success': False,
+                'capacity_full': True,
+                'message': 'Capacity full: all lab slots on this server are in use. Please try again in a few minutes.'
+            }
         
-        # Keep track of running containers
-        global running_containers
-        running_containers.append(container_id)
+        try:
+            ensure_juice_shop_image(progress, node)
+            
+            # Create Docker container on a free port, or behind the proxy
+            if progress:
+                progress('starting')
+            started = start_juice_shop_instance(f"juice_shop_{user_id}", node)
+            container_id = started['container_id']
+            
+            # Save instance info to database; it is promoted to running once Juice Shop answers
+            instance_id = save_instance(user_id, container_id, started['port'], 'starting', assignment_id, node,
+                                        started['proxy_token'], started['upstream'])
+        finally:
+            # From here on the instance row itself counts towards committed capacity
+            release_capacity(node)
         
-        # Save instance info to database
-        instance_id = save_instance(user_id, container_id, port, 'running', assignment_id)
+        if not wait_until_ready(instance_id, container_id, instance_base_url(started), node=node):
+            return {'success': False, 'message': 'Instance did not become ready in time'}
         
         return {
             'success': True,
             'container_id': container_id,
-            'port': port,
+            'port': started['port'],
             'instance_id': instance_id,
-            'url': f"http://{current_app.config['HOST_IP']}:{port}"
+            'node': node,
+            'url': instance_public_url(started)
         }
     
     except Exception as e:
@@ -85,27 +203,103 @@ def create_docker_instance(user_id, assignment_id=None):
         current_app.logger.error(f"Error creating Docker instance: {str(e)}")
         return {'success': False, 'message': str(e)}
 
-def stop_docker_container(container_id):
-    """Stop a Docker container"""
+def stop_docker_container(container_id, node=None):
+    """Stop a Docker container on a node"""
     try:
         from flask import current_app
         current_app.logger.info(f"Stopping container {container_id}")
         
-        stop_cmd = ["docker", "stop", container_id]
-        result = subprocess.run(stop_cmd, capture_output=True, text=True)
+        stopped = get_container_backend(node).stop_container(container_id, current_app.config['DOCKER_STOP_TIMEOUT'])
+        record_container_state(container_id, False, node)
         
-        global running_containers
-        if container_id in running_containers:
-            running_containers.remove(container_id)
+        running_containers.pop(container_id, None)
         
-        return result.returncode == 0
+        return stopped
     except Exception as e:
         from flask import current_app
         current_app.logger.error(f"Error stopping Docker container: {str(e)}")
         return False
 
-def restart_docker_instance(user_id):
-    """Restart a user's Docker instance"""
+def stop_docker_containers(containers):
+    """
+    Stop many containers at once, returning the set of IDs that were stopped.
+    containers maps container IDs to the node they run on (None for the first node).
+    Each node's IDs are split into batches that are stopped in parallel, so the total
+    time is close to one stop timeout rather than one per container.
+    """
+    from flask import current_app
+    
+    containers = {container_id: get_node(node)['name'] for container_id, node in containers.items() if container_id}
+    if not containers:
+        return set()
+    
+    config = current_app.config
+    batch_size = config['CLEANUP_STOP_BATCH_SIZE']
+    batches = []
+    for node_name in dict.fromkeys(containers.values()):
+        node_ids = [container_id for container_id, node in containers.items() if node == node_name]
+        batches += [(node_name, node_ids[i:i + batch_size]) for i in range(0, len(node_ids), batch_size)]
+    
+    def stop_batch(node_batch):
+        node_name, batch = node_batch
+        try:
+            return get_container_backend(node_name).stop_containers(batch, config['DOCKER_STOP_TIMEOUT'])
+        except Exception as e:
+            current_app.logger.error(f"Error stopping containers {', '.join(batch)}: {str(e)}")
+            return []
+    
+    current_app.logger.info(f"Stopping {len(containers)} containers in {len(batches)} batches")
+    try:
+        with ThreadPoolExecutor(max_workers=min(config['CLEANUP_STOP_WORKERS'], len(batches))) as executor:
+            results = list(executor.map(stop_batch, batches))
+    except RuntimeError:
+        # No new threads can be started once the interpreter is shutting down, e.g. from atexit
+        results = [stop_batch(batch) for batch in batches]
+    stopped = set(container_id for result in results for container_id in result)
+    
+    # Stopped or not, the containers are gone as far as the app is concerned
+    for container_id, node_name in containers.items():
+        record_container_state(container_id, False, node_name)
+        running_containers.pop(container_id, None)
+    
+    return stopped
+
+def unpause_docker_container(container_id, node=None):
+    """Resume a paused container on a node, returning True if it was paused"""
+    try:
+        return get_container_backend(node).unpause_container(container_id)
+    except Exception as e:
+        from flask import current_app
+        current_app.logger.error(f"Error resuming Docker container {container_id}: {str(e)}")
+        return False
+
+def suspend_idle_instances():
+    """Pause the containers of instances idle for INSTANCE_IDLE_MINUTES, returning how many were suspended"""
+    from flask import current_app
+    
+    if not current_app.config['INSTANCE_IDLE_MINUTES']:
+        return 0
+    
+    suspended = []
+    
+    # Paused containers keep their memory but use no CPU, and resume in well under a second
+    for instance_id, container_id, node in get_idle_instances():
+        try:
+            if get_container_backend(node).pause_container(container_id):
+                suspended.append(instance_id)
+            else:
+                current_app.logger.warning(f"Could not pause container {container_id}")
+        except Exception as e:
+            current_app.logger.error(f"Error pausing container {container_id}: {str(e)}")
+    
+    update_instance_statuses(suspended, 'suspended')
+    if suspended:
+        current_app.logger.info(f"Suspended {len(suspended)} idle instances")
+    
+    return len(suspended)
+
+def restart_docker_instance(user_id, progress=None):
+    """Restart a user's Docker instance, reporting provisioning progress like create_docker_instance"""
     try:
         # Get user's current instance
         instance = get_user_instance(user_id)
@@ -114,8 +308,12 @@ def restart_docker_instance(user_id):
             return {'success': False, 'message': 'No running instance found'}
         
         # Stop the container
+        if progress:
+            progress('starting')
         container_id = instance['container_id']
-        stop_successful = stop_docker_container(container_id)
+        stop_successful = stop_docker_container(container_id, instance['node'])
+        evict_http_session(instance_base_url(instance))
+        forget_challenge_poll(user_id)
         
         if not stop_successful:
             from flask import current_app
@@ -126,7 +324,7 @@ def restart_docker_instance(user_id):
         
         # Create a new instance
         assignment_id = instance.get('assignment_id')
-        create_result = create_docker_instance(user_id, assignment_id)
+        create_result = create_docker_instance(user_id, assignment_id, progress)
         return create_result
     
     except Exception as e:
@@ -138,17 +336,24 @@ def cleanup_expired_instances():
     """Cleanup expired Docker instances"""
     try:
         from flask import current_app
+        # Pause instances nobody has used for a while
+        suspended_count = suspend_idle_instances()
+        
         # Get expired instances
         expired_instances = get_expired_instances()
         
-        for instance_id, container_id in expired_instances:
-            # Stop the container
-            stop_docker_container(container_id)
-            
-            # Update instance status
-            update_instance_status(instance_id, 'expired')
+        # Stop the containers in parallel batches and mark all rows in one statement
+        stop_docker_containers({container_id: node for _, container_id, node in expired_instances})
+        update_instance_statuses([instance_id for instance_id, _, _ in expired_instances], 'expired')
+        
+        # Move long-finished instances out of the hot table
+        archived_count = archive_old_instances()
         
-        return {'success': True, 'cleaned_count': len(expired_instances)}
+        # Forget challenge polls of instances that are gone
+        prune_challenge_polls()
+        
+        return {'success': True, 'suspended_count': suspended_count, 'cleaned_count': len(expired_instances),
+                'archived_count': archived_count}
     except Exception as e:
         from flask import current_app
         current_app.logger.error(f"Error cleaning up expired instances: {str(e)}")
@@ -165,7 +370,9 @@ def shutdown_user_instance(user_id):
         
         # Stop the container
         container_id = instance['container_id']
-        stop_successful = stop_docker_container(container_id)
+        stop_successful = stop_docker_container(container_id, instance['node'])
+        evict_http_session(instance_base_url(instance))
+        forget_challenge_poll(user_id)
         
         if not stop_successful:
             from flask import current_app
@@ -195,24 +402,18 @@ def start_master_juice_shop():
         
         # First, check if there's an orphaned container with our name from a previous run
         container_name = "juice_shop_master_challenges"
-        check_cmd = ["docker", "ps", "-a", "--filter", f"name={container_name}", "--format", "{{.ID}}"]
-        result = subprocess.run(check_cmd, capture_output=True, text=True)
+        backend = get_container_backend()
         
-        if result.returncode == 0 and result.stdout.strip():
+        for existing_container_id in backend.list_containers(name=container_name, all=True):
             # Found an existing container with this name, remove it first
-            existing_container_id = result.stdout.strip()
             current_app.logger.info(f"Found existing master Juice Shop container: {existing_container_id}. Removing it...")
             
             # Stop the container if it's running
-            stop_cmd = ["docker", "stop", existing_container_id]
-            subprocess.run(stop_cmd, capture_output=True, text=True)
+            backend.stop_container(existing_container_id)
             
             # Remove the container
-            rm_cmd = ["docker", "rm", "-f", existing_container_id]
-            rm_result = subprocess.run(rm_cmd, capture_output=True, text=True)
-            
-            if rm_result.returncode != 0:
-                error_msg = f"Failed to remove existing container: {rm_result.stderr}"
+            if not backend.remove_container(existing_container_id, force=True):
+                error_msg = f"Failed to remove existing container: {existing_container_id}"
                 current_app.logger.error(error_msg)
         
         # Check if we already have a tracked container
@@ -220,31 +421,28 @@ def start_master_juice_shop():
             current_app.logger.info(f"Master Juice Shop already running with container ID: {master_juice_shop_container}")
             return {'success': True, 'container_id': master_juice_shop_container}
 
-        # Run the docker command
-        cmd = [
-            "docker", "run", 
-            "--rm",  # Ensure container is removed when stopped
-            "-d",
-            "--name", container_name,
-            "-e", "NODE_ENV=unsafe",
-            "-p", "127.0.0.1:3000:3000",  # Bind to localhost only
-            "--label", "managed-by=lti-juice-shop-master",  # Special label for the master instance
-            "bkimminich/juice-shop"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            error_msg = f"Failed to create master Juice Shop container: {result.stderr}"
+        # Start the container, auto-removed when stopped
+        try:
+            container_id = backend.run_container(
+                container_name,
+                JUICE_SHOP_IMAGE,
+                ports={3000: ("127.0.0.1", 3000)},  # Bind to localhost only
+                env={"NODE_ENV": "unsafe"},
+                labels={"managed-by": "lti-juice-shop-master"},  # Special label for the master instance
+                limits=get_container_limits()
+            )
+        except Exception as e:
+            error_msg = f"Failed to create master Juice Shop container: {str(e)}"
             current_app.logger.error(error_msg)
             raise Exception(error_msg)
-        
-        container_id = result.stdout.strip()
         master_juice_shop_container = container_id
         
-        # Keep track of running containers
-        global running_containers
-        running_containers.append(container_id)
+        # The catalog cached from a previous master container may be out of date
+        from services.challenge_service import invalidate_challenge_catalog
+        invalidate_challenge_catalog()
+        
+        # Keep track of running containers; the master always runs on the first node
+        running_containers[container_id] = get_node()['name']
         
         current_app.logger.info(f"Master Juice Shop started with container ID: {container_id}")
         return {'success': True, 'container_id': container_id}
@@ -268,17 +466,18 @@ def stop_master_juice_shop():
         
         current_app.logger.info(f"Stopping master Juice Shop container {master_juice_shop_container}")
         
-        stop_cmd = ["docker", "stop", master_juice_shop_container]
-        result = subprocess.run(stop_cmd, capture_output=True, text=True)
+        stopped_container = master_juice_shop_container
+        stopped = get_container_backend().stop_container(stopped_container)
         
-        global running_containers
-        if master_juice_shop_container in running_containers:
-            running_containers.remove(master_juice_shop_container)
+        running_containers.pop(master_juice_shop_container, None)
         
         master_juice_shop_container = None
         
-        if result.returncode != 0:
-            error_msg = f"Failed to stop master Juice Shop container: {result.stderr}"
+        from services.challenge_service import invalidate_challenge_catalog
+        invalidate_challenge_catalog()
+        
+        if not stopped:
+            error_msg = f"Failed to stop master Juice Shop container: {stopped_container}"
             current_app.logger.error(error_msg)
             return {'success': False, 'message': error_msg}
         
@@ -304,42 +503,34 @@ def cleanup_all_containers():
         conn = get_db_connection()
         c = conn.cursor()
         
-        c.execute("SELECT container_id FROM instances WHERE status='running'")
-        containers_from_db = [row[0] for row in c.fetchall()]
+        c.execute("SELECT container_id, node FROM instances WHERE status IN ('running', 'starting', 'suspended', 'pooled')")
+        containers_from_db = {row[0]: row[1] for row in c.fetchall()}
+        
+        # Pooled and starting containers are going away too, so they can no longer be claimed or promoted
+        c.execute("UPDATE instances SET status='stopped' WHERE status IN ('starting', 'pooled')")
+        conn.commit()
         
         conn.close()
         
         # Also include any containers tracked in memory
-        global running_containers
-        containers_to_stop = set(running_containers + containers_from_db)
-        
-        # Count successful stops
-        success_count = 0
-        
-        # Stop each container
-        for container_id in containers_to_stop:
-            if container_id:
-                try:
-                    current_app.logger.info(f"Stopping container {container_id}")
-                    subprocess.run(["docker", "stop", container_id], capture_output=True, text=True)
-                    success_count += 1
-                except Exception as e:
-                    current_app.logger.error(f"Error stopping container {container_id}: {str(e)}")
+        containers_to_stop = {**containers_from_db, **running_containers}
+        
+        # Stop all containers in parallel batches
+        stopped = stop_docker_containers(containers_to_stop)
+        success_count = len(stopped)
         
         # As a backup, try to find and remove any containers with our labels that might have been missed
         try:
             current_app.logger.info("Checking for any labeled containers that might have been missed...")
-            # Check for both regular and master containers
-            for label in ["managed-by=lti-juice-shop", "managed-by=lti-juice-shop-master"]:
-                list_cmd = ["docker", "ps", "-q", "--filter", f"label={label}"]
-                result = subprocess.run(list_cmd, capture_output=True, text=True)
-                
-                if result.returncode == 0 and result.stdout.strip():
-                    labeled_containers = result.stdout.strip().split('\n')
-                    for container_id in labeled_containers:
-                        if container_id.strip():
-                            current_app.logger.info(f"Stopping missed labeled container {container_id}")
-                            subprocess.run(["docker", "stop", container_id.strip()], capture_output=True, text=True)
+            # Check for both regular and master containers on every node
+            missed_containers = {}
+            for node_name in get_nodes():
+                backend = get_container_backend(node_name)
+                for label in ["managed-by=lti-juice-shop", "managed-by=lti-juice-shop-master"]:
+                    missed_containers.update((container_id, node_name) for container_id in backend.list_containers(label=label))
+            if missed_containers:
+                current_app.logger.info(f"Stopping {len(missed_containers)} missed labeled containers")
+                stop_docker_containers(missed_containers)
         except Exception as e:
             current_app.logger.error(f"Error cleaning up labeled containers: {str(e)}")
         
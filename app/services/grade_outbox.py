@@ -0,0 +1,153 @@
+"""
+Outbox for scores sent to the LMS through LTI Assignment and Grade Services
+
+Status checks only queue a student's score, and only when it differs from the
+last score queued for the same launch, user and line item, so repeated polls
+never wait on the LMS or send the same grade again. The outbox is a table, so
+queued scores survive restarts. A sender thread hands due scores to a bounded
+worker pool; failed sends are retried with exponential backoff, and a score
+that changes before it was sent replaces the queued one.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from pylti1p3.assignments_grades import AssignmentsGradesService
+from pylti1p3.grade import Grade
+from models.grade import queue_grade, get_due_grades, mark_grade_sent, mark_grade_failed
+from services.launch_context import get_tool_conf
+from services.lti_credentials import CachingServiceConnector
+
+# Outbox row IDs with a send in flight
+grades_in_flight = set()
+grades_in_flight_lock = threading.Lock()
+# Set when a score is queued, so the sender does not wait for its next tick
+sender_wakeup = threading.Event()
+grade_sender_running = False
+grade_sender_lock = threading.Lock()
+
+def submit_grade(launch, earned_score, total_score):
+    """
+    Queue a launch's score for the LMS if it changed. Returns True if a new score was queued.
+    Never waits on the LMS unless GRADE_SENDER_ENABLED is off.
+    """
+    if not launch.ags_endpoint:
+        current_app.logger.warning(f"Launch {launch.launch_id} doesn't have Assignment and Grade Service")
+        return False
+
+    queued = queue_grade(launch.launch_id, launch.user_id, launch.ags_endpoint.get('lineitem') or '',
+                         launch.issuer, launch.client_id, launch.ags_endpoint, earned_score, total_score)
+    if not queued:
+        return False
+
+    current_app.logger.info(f"Queued score {earned_score}/{total_score} for user {launch.user_id}")
+    app = current_app._get_current_object()
+    if app.config['GRADE_SENDER_ENABLED']:
+        # Worker processes of a WSGI server start their sender on the first queued score
+        start_grade_sender(app)
+        sender_wakeup.set()
+    else:
+        send_due_grades(app)
+    return True
+
+def retry_delay(config, attempts):
+    """Seconds before the next attempt after the given number of failed ones"""
+    return min(config['GRADE_RETRY_INITIAL_DELAY'] * 2 ** (attempts - 1), config['GRADE_RETRY_MAX_DELAY'])
+
+def send_grade(app, grade):
+    """Send one queued score to the LMS and record the outcome"""
+    config = app.config
+
+    try:
+        with app.app_context():
+            try:
+                registration = get_tool_conf().find_registration_by_params(grade['issuer'], grade['client_id'])
+                ags = AssignmentsGradesService(CachingServiceConnector(registration), grade['ags_endpoint'])
+
+                sc = Grade()
+                sc.set_score_given(grade['score_given']) \
+                    .set_score_maximum(grade['score_maximum']) \
+                    .set_timestamp(grade['queued_at'] + 'Z') \
+                    .set_activity_progress('Completed') \
+                    .set_grading_progress('FullyGraded') \
+                    .set_user_id(grade['user_id'])
+
+                ags.put_grade(sc)
+            except Exception as e:
+                attempts = grade['attempts'] + 1
+                give_up = attempts >= config['GRADE_MAX_ATTEMPTS']
+                next_attempt_at = datetime.now() + timedelta(seconds=retry_delay(config, attempts))
+                mark_grade_failed(grade['id'], grade['score_given'], grade['score_maximum'], str(e),
+                                  next_attempt_at, give_up)
+
+                if give_up:
+                    app.logger.error(f"Giving up sending score of user {grade['user_id']} after {attempts} attempts: {str(e)}")
+                else:
+                    app.logger.warning(f"Error sending score of user {grade['user_id']} (attempt {attempts}): {str(e)}")
+                return
+
+            mark_grade_sent(grade['id'], grade['score_given'], grade['score_maximum'])
+            app.logger.info(f"Sent score {grade['score_given']}/{grade['score_maximum']} for user {grade['user_id']}")
+    except Exception as e:
+        app.logger.error(f"Error recording score submission: {str(e)}")
+    finally:
+        with grades_in_flight_lock:
+            grades_in_flight.discard(grade['id'])
+        # A free worker can take the next due score right away
+        if grade_sender_running:
+            sender_wakeup.set()
+
+def claim_due_grades(limit):
+    """Get up to limit due scores that are not already being sent, marking them in flight"""
+    claimed = []
+    with grades_in_flight_lock:
+        for grade in get_due_grades(limit + len(grades_in_flight)):
+            if grade['id'] not in grades_in_flight and len(claimed) < limit:
+                grades_in_flight.add(grade['id'])
+                claimed.append(grade)
+    return claimed
+
+def send_due_grades(app):
+    """Send due scores from the calling thread, for when no sender thread runs"""
+    for grade in claim_due_grades(app.config['GRADE_SEND_BATCH_SIZE']):
+        send_grade(app, grade)
+
+def schedule_due_grades(app, executor):
+    """Hand due scores to the worker pool, never queueing more than it can send at once"""
+    with grades_in_flight_lock:
+        free_workers = app.config['GRADE_SENDER_WORKERS'] - len(grades_in_flight)
+    if free_workers <= 0:
+        return
+
+    for grade in claim_due_grades(free_workers):
+        executor.submit(send_grade, app, grade)
+
+def start_grade_sender(app):
+    """Start the background thread that drains the grade outbox, once per process"""
+    global grade_sender_running
+
+    if not app.config['GRADE_SENDER_ENABLED']:
+        return None
+
+    with grade_sender_lock:
+        if grade_sender_running:
+            return None
+        grade_sender_running = True
+
+    executor = ThreadPoolExecutor(max_workers=app.config['GRADE_SENDER_WORKERS'],
+                                  thread_name_prefix='grade-sender')
+
+    def sender_thread_func():
+        while True:
+            try:
+                with app.app_context():
+                    schedule_due_grades(app, executor)
+            except Exception as e:
+                app.logger.error(f"Error in grade sender thread: {str(e)}")
+
+            sender_wakeup.wait(app.config['GRADE_SENDER_INTERVAL'])
+            sender_wakeup.clear()
+
+    sender_thread = threading.Thread(target=sender_thread_func, daemon=True)
+    sender_thread.start()
+    return sender_thread
@@ -0,0 +1,93 @@
+"""
+Shared HTTP client for calls to Juice Shop containers
+
+Each instance URL gets its own keep-alive session with a bounded connection
+pool, connect/read timeouts and retries with backoff, so polling reuses TCP
+connections and a hung container cannot block a worker forever.
+"""
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import current_app
+from utils.metrics import upstream_request_seconds, upstream_request_errors, timed
+
+# Headers Juice Shop expects from a browser-like client
+JUICE_SHOP_HEADERS = {
+    'Accept-Language': 'en-GB,en;q=0.9',
+    'Accept': 'application/json, text/plain, */*',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36',
+    'Connection': 'keep-alive'
+}
+
+# Instance base URL -> (session, monotonic time of last use)
+http_sessions = {}
+# Monotonic time of the last sweep for idle sessions
+last_idle_sweep = 0.0
+sessions_lock = threading.Lock()
+
+def create_http_session(config):
+    """Create a keep-alive session with bounded connections and retries"""
+    retry = Retry(
+        total=config['HTTP_RETRIES'],
+        backoff_factor=config['HTTP_RETRY_BACKOFF'],
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=config['HTTP_POOL_MAXSIZE'],
+        pool_block=True,  # Wait for a free connection rather than opening more
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.headers.update(JUICE_SHOP_HEADERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_http_session(base_url):
+    """Get the shared session for an instance URL, creating it on first use"""
+    global last_idle_sweep
+
+    config = current_app.config
+    idle_timeout = config['HTTP_SESSION_IDLE_TIMEOUT']
+    now = time.monotonic()
+    idle_sessions = []
+
+    with sessions_lock:
+        entry = http_sessions.get(base_url)
+        session = entry[0] if entry else create_http_session(config)
+        http_sessions[base_url] = (session, now)
+
+        # Drop sessions of instances nobody has polled for a while, e.g. expired ones
+        if now - last_idle_sweep > idle_timeout:
+            last_idle_sweep = now
+            for url, (idle_session, last_used) in list(http_sessions.items()):
+                if now - last_used > idle_timeout:
+                    idle_sessions.append(http_sessions.pop(url)[0])
+
+    for idle_session in idle_sessions:
+        idle_session.close()
+
+    return session
+
+def http_get(base_url, path, timeout=None, target='instance', **kwargs):
+    """GET a path from an instance through its pooled session; target labels the request in the metrics"""
+    config = current_app.config
+    if timeout is None:
+        timeout = (config['HTTP_CONNECT_TIMEOUT'], config['HTTP_READ_TIMEOUT'])
+    session = get_http_session(base_url)
+    with timed(upstream_request_seconds, upstream_request_errors, target):
+        return session.get(f"{base_url}{path}", timeout=timeout, **kwargs)
+
+def evict_http_session(base_url):
+    """Close the pooled connections of an instance that was stopped or restarted"""
+    with sessions_lock:
+        entry = http_sessions.pop(base_url, None)
+
+    if entry:
+        entry[0].close()
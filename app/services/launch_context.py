@@ -0,0 +1,150 @@
+"""
+Launch context layer for LTI routes
+
+The tool configuration is parsed once and reloaded only when its file changes,
+and the tool's public JWK is computed once per loaded configuration.
+The claims routes need from a launch (user, resource link, launch type) are
+kept per launch_id in a small LRU cache, so API calls do not rebuild the tool
+config and rehydrate the whole message launch on every request.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import current_app, g, jsonify
+from pylti1p3.contrib.flask import FlaskRequest
+from pylti1p3.tool_config import ToolConfJsonFile
+from config import get_lti_config_path
+from services.lti_service import get_launch_data_storage
+from utils.metrics import lti_operation_seconds, lti_operation_errors, timed
+
+RESOURCE_LINK_CLAIM = 'https://purl.imsglobal.org/spec/lti/claim/resource_link'
+AGS_ENDPOINT_CLAIM = 'https://purl.imsglobal.org/spec/lti-ags/claim/endpoint'
+
+# Claims of a launch that routes need, without the launch object itself. issuer, client_id and
+# ags_endpoint are what grades are sent with, so sending does not need the launch either.
+LaunchContext = namedtuple('LaunchContext', ['launch_id', 'user_id', 'assignment_id', 'is_deep_link', 'has_ags',
+                                             'issuer', 'client_id', 'ags_endpoint'])
+
+# (config path, modification time, parsed tool config)
+tool_conf_cache = (None, None, None)
+tool_conf_lock = threading.Lock()
+
+# (tool config, JWKS response body, ETag) for the tool config the JWKS was computed from
+tool_jwks_cache = (None, None, None)
+
+# launch_id -> (monotonic time cached, LaunchContext), least recently used first
+launch_contexts = OrderedDict()
+launch_contexts_lock = threading.Lock()
+
+def get_tool_conf():
+    """Get the parsed LTI tool config, reloading it when the file changes"""
+    global tool_conf_cache
+
+    path = get_lti_config_path()
+    mtime = os.stat(path).st_mtime_ns
+
+    cached_path, cached_mtime, tool_conf = tool_conf_cache
+    if cached_path == path and cached_mtime == mtime:
+        return tool_conf
+
+    with tool_conf_lock:
+        cached_path, cached_mtime, tool_conf = tool_conf_cache
+        if cached_path != path or cached_mtime != mtime:
+            tool_conf = ToolConfJsonFile(path)
+            tool_conf_cache = (path, mtime, tool_conf)
+            current_app.logger.info(f"Loaded LTI tool config from {path}")
+
+    return tool_conf
+
+def get_tool_jwks():
+    """Get the tool's public JWK as a JSON body and its ETag, computed once per loaded tool config"""
+    global tool_jwks_cache
+
+    tool_conf = get_tool_conf()
+    cached_conf, body, etag = tool_jwks_cache
+    if cached_conf is tool_conf:
+        return body, etag
+
+    body = json.dumps(tool_conf.get_jwks()["keys"][0], sort_keys=True).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()
+    tool_jwks_cache = (tool_conf, body, etag)
+    return body, etag
+
+def get_message_launch(launch_id):
+    """Restore the full message launch, for routes that need deep linking or AGS"""
+    # Import ExtendedFlaskMessageLaunch from app to avoid circular imports
+    from app import ExtendedFlaskMessageLaunch
+
+    with timed(lti_operation_seconds, lti_operation_errors, 'restore_launch'):
+        return ExtendedFlaskMessageLaunch.from_cache(launch_id, FlaskRequest(), get_tool_conf(),
+                                                     launch_data_storage=get_launch_data_storage())
+
+def remember_launch(message_launch):
+    """Cache the claims of a launch, e.g. right after the LMS launched the tool"""
+    launch_data = message_launch.get_launch_data()
+    audience = launch_data.get('aud')
+    launch = LaunchContext(
+        launch_id=message_launch.get_launch_id(),
+        user_id=launch_data.get('sub'),
+        assignment_id=launch_data.get(RESOURCE_LINK_CLAIM, {}).get('id'),
+        is_deep_link=message_launch.is_deep_link_launch(),
+        has_ags=message_launch.has_ags(),
+        issuer=launch_data.get('iss'),
+        client_id=audience[0] if isinstance(audience, list) else audience,
+        ags_endpoint=launch_data.get(AGS_ENDPOINT_CLAIM)
+    )
+
+    with launch_contexts_lock:
+        launch_contexts[launch.launch_id] = (time.monotonic(), launch)
+        launch_contexts.move_to_end(launch.launch_id)
+        while len(launch_contexts) > current_app.config['LAUNCH_CONTEXT_CACHE_SIZE']:
+            launch_contexts.popitem(last=False)
+
+    return launch
+
+def get_launch_context(launch_id):
+    """Get the claims of a launch, memoized per request and per launch_id"""
+    request_contexts = g.setdefault('launch_contexts', {})
+    if launch_id in request_contexts:
+        return request_contexts[launch_id]
+
+    with launch_contexts_lock:
+        entry = launch_contexts.get(launch_id)
+        if entry and time.monotonic() - entry[0] < current_app.config['LAUNCH_CONTEXT_TTL']:
+            launch_contexts.move_to_end(launch_id)
+            launch = entry[1]
+        else:
+            launch = None
+
+    if launch is None:
+        launch = remember_launch(get_message_launch(launch_id))
+
+    request_contexts[launch_id] = launch
+    return launch
+
+def launch_required(view):
+    """
+    Resolve the route's launch_id and pass user_id, assignment_id and launch to the view.
+    A user_id in the URL must match the launch's user; an assignment_id in the URL is kept.
+    """
+    @wraps(view)
+    def wrapper(launch_id, *args, **kwargs):
+        try:
+            launch = get_launch_context(launch_id)
+        except Exception as e:
+            current_app.logger.error(f"Error resolving launch {launch_id}: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+        # Verify user_id matches the one in the launch data to prevent unauthorized access
+        if 'user_id' in kwargs and kwargs['user_id'] != launch.user_id:
+            return jsonify({'error': 'Unauthorized access'}), 403
+
+        kwargs['user_id'] = launch.user_id
+        kwargs.setdefault('assignment_id', launch.assignment_id)
+        return view(launch_id, *args, launch=launch, **kwargs)
+
+    return wrapper
@@ -0,0 +1,221 @@
+"""
+Cached credentials for LTI launch validation and service calls
+
+pylti1p3 fetches a new OAuth2 access token for every service connector, downloads
+the platform's key set for every launch it validates and parses the tool's private
+key for every JWT it signs. Here:
+
+- Access tokens are kept in the app cache per issuer, client ID and scopes until
+  LTI_TOKEN_REFRESH_MARGIN seconds before they expire, so with a shared
+  CACHE_BACKEND all worker processes use the same token.
+- Platform key sets are kept in the app cache for LTI_JWKS_TTL seconds. A launch
+  signed with a key ID the cached set does not contain fetches the set again, at
+  most every LTI_JWKS_REFETCH_INTERVAL seconds, so rotated keys are picked up.
+- Public keys converted to PEM and parsed private keys are kept in process.
+
+Hits and misses of each cache are counted and reported by get_cache_stats.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+import jwt
+import requests
+from cryptography.hazmat.primitives import serialization
+from jwcrypto.jwk import JWK
+from flask import current_app
+from pylti1p3.exception import LtiException, LtiServiceException
+from pylti1p3.service_connector import ServiceConnector, REQUESTS_USER_AGENT
+from utils.metrics import lti_operation_seconds, lti_operation_errors, timed
+
+# Cache name -> hit and miss counts in this process
+cache_stats = {name: {'hits': 0, 'misses': 0} for name in ('access_token', 'jwks', 'public_key', 'private_key')}
+stats_lock = threading.Lock()
+# SHA-256 of a PEM private key -> parsed key
+private_keys = {}
+# (key set URL, kid, alg) -> (PEM public key, monotonic time it expires)
+public_keys = {}
+# Key set URL -> monotonic time this process last fetched it
+key_sets_fetched_at = {}
+keys_lock = threading.Lock()
+# Held while fetching a token, so concurrent misses fetch it once
+token_lock = threading.Lock()
+# Session for token, key set and service requests; keeps connections to the LMS alive
+lti_session = None
+session_lock = threading.Lock()
+
+def count(cache, hit):
+    with stats_lock:
+        cache_stats[cache]['hits' if hit else 'misses'] += 1
+
+def get_cache_stats():
+    """Get the hit and miss counts of each credential cache in this process"""
+    with stats_lock:
+        stats = {name: dict(counts) for name, counts in cache_stats.items()}
+
+    for counts in stats.values():
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / lookups, 3) if lookups else None
+    return stats
+
+def get_lti_session():
+    """Get the shared session for requests to LTI platforms, creating it on first use"""
+    global lti_session
+
+    if lti_session is None:
+        with session_lock:
+            if lti_session is None:
+                session = requests.Session()
+                session.headers['User-Agent'] = REQUESTS_USER_AGENT
+                lti_session = session
+
+    return lti_session
+
+def get_private_key(private_key_pem):
+    """Get the parsed form of a PEM private key, parsing each key once"""
+    digest = hashlib.sha256(private_key_pem.encode('utf-8')).hexdigest()
+    private_key = private_keys.get(digest)
+    count('private_key', private_key is not None)
+
+    if private_key is None:
+        private_key = serialization.load_pem_private_key(private_key_pem.encode('utf-8'), password=None)
+        private_keys[digest] = private_key
+
+    return private_key
+
+class CachingServiceConnector(ServiceConnector):
+    """Service connector that shares access tokens through the app cache and reuses parsed private keys"""
+    def __init__(self, registration, requests_session=None):
+        super().__init__(registration, requests_session or get_lti_session())
+
+    def get_access_token(self, scopes):
+        scopes = sorted(scopes)
+        registration = self._registration
+        scope_id = f"{registration.get_issuer()}|{registration.get_client_id()}|{' '.join(scopes)}"
+        cache_key = 'lti_token:' + hashlib.sha256(scope_id.encode('utf-8')).hexdigest()
+
+        token = current_app.cache.get(cache_key)
+        count('access_token', token is not None)
+        if token:
+            return token
+
+        with token_lock:
+            # Another thread may have fetched it while this one waited
+            token = current_app.cache.get(cache_key)
+            if token:
+                return token
+
+            with timed(lti_operation_seconds, lti_operation_errors, 'access_token'):
+                token, expires_in = self.request_access_token(scopes)
+            timeout = expires_in - current_app.config['LTI_TOKEN_REFRESH_MARGIN']
+            if timeout > 0:
+                current_app.cache.set(cache_key, token, timeout=timeout)
+
+        return token
+
+    def request_access_token(self, scopes):
+        """Exchange a signed client assertion for an access token; returns (token, seconds until it expires)"""
+        registration = self._registration
+        client_id = registration.get_client_id()
+        auth_url = registration.get_auth_token_url()
+        now = int(time.time())
+
+        jwt_claim = {
+            'iss': str(client_id),
+            'sub': str(client_id),
+            'aud': str(registration.get_auth_audience() or auth_url),
+            'iat': now - 5,
+            'exp': now + 60,
+            'jti': 'lti-service-token-' + str(uuid.uuid4())
+        }
+        kid = registration.get_kid()
+        headers = {'kid': kid} if kid else {}
+
+        r = self._requests_session.post(auth_url, data={
+            'grant_type': 'client_credentials',
+            'client_assertion_type': 'urn:ietf:params:oauth:client-assertion-type:jwt-bearer',
+            'client_assertion': self.encode_jwt(jwt_claim, registration.get_tool_private_key(), headers),
+            'scope': ' '.join(scopes)
+        })
+        if not r.ok:
+            raise LtiServiceException(r)
+
+        response = r.json()
+        # Platforms that leave out expires_in get the one-hour lifetime tokens usually have
+        return response['access_token'], int(response.get('expires_in', 3600))
+
+    def make_service_request(self, *args, **kwargs):
+        with timed(lti_operation_seconds, lti_operation_errors, 'service_request'):
+            return super().make_service_request(*args, **kwargs)
+
+    def encode_jwt(self, message, private_key, headers):
+        return jwt.encode(message, get_private_key(private_key), algorithm='RS256', headers=headers)
+
+def fetch_key_set(key_set_url):
+    """Download a platform's key set and put it in the app cache"""
+    try:
+        with timed(lti_operation_seconds, lti_operation_errors, 'key_set'):
+            r = get_lti_session().get(key_set_url, timeout=current_app.config['LTI_JWKS_TIMEOUT'])
+            r.raise_for_status()
+            key_set = r.json()
+    except (requests.RequestException, ValueError) as e:
+        raise LtiException(f"Error during fetch URL {key_set_url}: {str(e)}") from e
+
+    with keys_lock:
+        key_sets_fetched_at[key_set_url] = time.monotonic()
+    current_app.cache.set('lti_jwks:' + key_set_url, key_set, timeout=current_app.config['LTI_JWKS_TTL'])
+    return key_set
+
+def get_key_set(key_set_url):
+    """Get a platform's key set from the app cache, downloading it on a miss"""
+    key_set = current_app.cache.get('lti_jwks:' + key_set_url)
+    count('jwks', key_set is not None)
+    return key_set or fetch_key_set(key_set_url)
+
+def find_key(key_set, kid, alg):
+    for key in key_set.get('keys', []):
+        if key.get('kid') == kid and key.get('alg', 'RS256') == alg:
+            return key
+    return None
+
+def get_platform_public_key(registration, header):
+    """Get the PEM public key and algorithm a launch JWT with the given header was signed with"""
+    key_set_url = registration.get_key_set_url()
+    kid = header.get('kid')
+    alg = header.get('alg')
+
+    if not kid:
+        raise LtiException("JWT KID not found")
+    if not alg:
+        raise LtiException("JWT ALG not found")
+    if not key_set_url or not key_set_url.startswith(('http://', 'https://')):
+        raise LtiException(f"Invalid URL: {key_set_url}")
+
+    cache_key = (key_set_url, kid, alg)
+    now = time.monotonic()
+    with keys_lock:
+        entry = public_keys.get(cache_key)
+    if entry and entry[1] > now:
+        count('public_key', True)
+        return entry[0], alg
+    count('public_key', False)
+
+    key = find_key(get_key_set(key_set_url), kid, alg)
+    if key is None:
+        # An unknown key ID usually means the platform rotated its keys
+        with keys_lock:
+            fetched_at = key_sets_fetched_at.get(key_set_url)
+        if fetched_at is None or now - fetched_at >= current_app.config['LTI_JWKS_REFETCH_INTERVAL']:
+            key = find_key(fetch_key_set(key_set_url), kid, alg)
+    if key is None:
+        raise LtiException("Unable to find public key")
+
+    try:
+        public_key = JWK.from_json(json.dumps(key)).export_to_pem()
+    except (ValueError, TypeError) as e:
+        raise LtiException("Can't convert JWT key to PEM format") from e
+
+    with keys_lock:
+        public_keys[cache_key] = (public_key, now + current_app.config['LTI_JWKS_TTL'])
+    return public_key, alg
@@ -1,9 +1,7 @@
-from flask import current_app, request
-from pylti1p3.contrib.flask import FlaskCacheDataStorage, FlaskRequest
+from flask import current_app
+from pylti1p3.contrib.flask import FlaskCacheDataStorage
 from pylti1p3.grade import Grade
 from datetime import datetime
-from pylti1p3.tool_config import ToolConfJsonFile
-from config import get_lti_config_path
 
 # Declare ExtendedFlaskMessageLaunch class here to be used across the application
 class ExtendedFlaskMessageLaunch:
@@ -38,19 +36,12 @@ def submit_score(launch_id, earned_score, total_score):
     try:
         from flask import current_app
         # Import here to avoid circular imports
-        from app import ExtendedFlaskMessageLaunch
+        from services.launch_context import get_message_launch
         
         current_app.logger.info(f"Submitting score: {earned_score}/{total_score} for launch_id {launch_id}")
         
-        # Get the tool configuration
-        tool_conf = ToolConfJsonFile(get_lti_config_path())
-        launch_data_storage = get_launch_data_storage()
-        
-        # Create a mock Flask request if needed
-        mock_request = FlaskRequest(request_is_secure=request.is_secure if request else False)
-        
-        message_launch = ExtendedFlaskMessageLaunch.from_cache(launch_id, mock_request, tool_conf,
-                                                          launch_data_storage=launch_data_storage)
+        # Restore the launch with the cached tool configuration
+        message_launch = get_message_launch(launch_id)
         
         if message_launch.has_ags():
             # Get user ID from launch data
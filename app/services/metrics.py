@@ -0,0 +1,35 @@
+"""
+Gauges for /metrics, read from the database and in-process state at scrape time
+
+Latency histograms and error counters are recorded where the work happens, see
+utils/metrics.py. The gauges here are only evaluated when /metrics is scraped,
+so they add nothing to the request path.
+"""
+from flask import current_app
+from models.instance import count_instances_by_status
+from services.lti_credentials import get_cache_stats
+from services.nodes import get_nodes
+from services.port_allocator import ACTIVE_STATUSES, get_port_allocator
+from utils.metrics import gauge, render_metrics
+
+@gauge('securelabs_instances', 'Instances whose container holds host resources, by status', ('status',))
+def read_instance_counts():
+    counts = count_instances_by_status()
+    return [((status,), counts.get(status, 0)) for status in ACTIVE_STATUSES]
+
+@gauge('securelabs_free_ports', 'Host ports that can be allocated to new instances, by node', ('node',))
+def read_free_ports():
+    return [((name,), get_port_allocator(name).free_count()) for name in get_nodes()]
+
+@gauge('securelabs_lti_cache_lookups_total', 'Lookups in the LTI credential caches of this process, by cache and result',
+       ('cache', 'result'), metric_type='counter')
+def read_lti_cache_lookups():
+    samples = []
+    for cache, counts in get_cache_stats().items():
+        samples.append(((cache, 'hit'), counts['hits']))
+        samples.append(((cache, 'miss'), counts['misses']))
+    return samples
+
+def get_metrics_text():
+    """Render all metrics of this process in the Prometheus text format"""
+    return render_metrics(current_app.logger)
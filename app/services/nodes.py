@@ -0,0 +1,99 @@
+"""
+Registry of the Docker nodes student instances run on
+
+DOCKER_NODES lists the Docker hosts instances are spread across, each with
+its own backend, host IP, port range and capacity. Without it there is a
+single node, "local", described by the DOCKER_*, HOST_IP, PORT_RANGE_* and
+ADMISSION_HOST_* settings. New containers are placed on a node by
+PLACEMENT_POLICY, and every instance row records the node it runs on.
+"""
+import threading
+from flask import current_app
+
+DEFAULT_NODE = 'local'
+
+# Node name -> node, in configuration order
+nodes = None
+nodes_lock = threading.Lock()
+
+def load_nodes(config):
+    """Build the node registry from the configuration"""
+    if not config['DOCKER_NODES']:
+        return {DEFAULT_NODE: {
+            'name': DEFAULT_NODE,
+            'backend': config['DOCKER_BACKEND'],
+            'docker_host': None,
+            'host_ip': config['HOST_IP'],
+            'port_range_start': config['PORT_RANGE_START'],
+            'port_range_end': config['PORT_RANGE_END'],
+            'memory_mb': config['ADMISSION_HOST_MEMORY_MB'],
+            'cpus': config['ADMISSION_HOST_CPUS'],
+            'local': True
+        }}
+
+    registry = {}
+    for entry in config['DOCKER_NODES']:
+        if entry['name'] in registry:
+            raise ValueError(f"Duplicate Docker node name: {entry['name']}")
+        registry[entry['name']] = {
+            'name': entry['name'],
+            'backend': entry.get('backend', 'engine'),
+            # unix:///path/to/docker.sock or tcp://host:port (any -H value for the cli backend); None uses DOCKER_SOCKET
+            'docker_host': entry.get('docker_host'),
+            'host_ip': entry['host_ip'],
+            'port_range_start': entry.get('port_range_start', config['PORT_RANGE_START']),
+            'port_range_end': entry.get('port_range_end', config['PORT_RANGE_END']),
+            # 0 asks the node's Docker daemon
+            'memory_mb': entry.get('memory_mb', 0),
+            'cpus': entry.get('cpus', 0),
+            # The node this app runs on, whose cgroups and host ports can be checked directly
+            'local': entry.get('local', False)
+        }
+    return registry
+
+def get_nodes():
+    """Get all nodes by name, in configuration order"""
+    global nodes
+
+    if nodes is None:
+        with nodes_lock:
+            if nodes is None:
+                nodes = load_nodes(current_app.config)
+
+    return nodes
+
+def get_node(name=None):
+    """
+    Get a node by name. Rows saved before nodes were recorded have no node and
+    belong to the first node, as does the master Juice Shop.
+    """
+    registry = get_nodes()
+    if name is None:
+        return next(iter(registry.values()))
+    if name not in registry:
+        raise ValueError(f"Unknown Docker node: {name}")
+    return registry[name]
+
+def node_url(node_name, port):
+    """Get the URL of an instance published on a node's host port"""
+    return f"http://{get_node(node_name)['host_ip']}:{port}"
+
+def node_load(status):
+    """Fraction of a node's slots in use, or its instance count if its slots are unlimited"""
+    return status['instances'] / status['slots'] if status['slots'] else status['instances']
+
+def choose_node(candidates):
+    """
+    Pick the node for a new container from the capacity statuses of nodes that have room.
+    "least-loaded" spreads containers evenly; "bin-packing" fills the fullest node first,
+    so whole nodes stay free. Ties go to the node configured first.
+    """
+    if not candidates:
+        return None
+
+    policy = current_app.config['PLACEMENT_POLICY']
+    if policy == 'least-loaded':
+        return min(candidates, key=node_load)['node']
+    if policy == 'bin-packing':
+        return max(candidates, key=node_load)['node']
+    raise ValueError(f"Unknown placement policy: {policy}")
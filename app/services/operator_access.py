@@ -0,0 +1,39 @@
+"""
+Access control for operator-only routes
+
+Capacity, cache statistics and metrics describe the hosts and the load on them,
+so they are not served to students. A request gets through if it carries
+OPERATOR_TOKEN as a bearer token, or comes from an address or network listed in
+OPERATOR_ALLOWED_IPS. With neither configured, the routes are closed. Behind a
+reverse proxy every request comes from the proxy's address, so prefer the token
+there.
+"""
+import hmac
+import ipaddress
+from functools import wraps
+from flask import current_app, jsonify, request
+
+def is_operator_request():
+    """Check the request's bearer token and client address against the operator settings"""
+    config = current_app.config
+
+    token = config['OPERATOR_TOKEN']
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode()):
+        return True
+
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in config['OPERATOR_ALLOWED_IPS'])
+
+def operator_required(view):
+    """Answer 403 unless the request comes from an operator"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_operator_request():
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,121 @@
+import threading
+from flask import current_app
+from services.port_allocator import release_port
+from services.readiness import watch_instance
+from services.capacity import reserve_capacity, release_capacity
+from services.proxy import instance_base_url
+from models.instance import save_instance, update_instance_status, claim_pooled_instance as claim_pooled_instance_row, count_pooled_instances
+
+# Placeholder owner for pre-warmed containers that have not been claimed yet
+POOL_USER_ID = '__pool__'
+
+# Set whenever a container is claimed so the refiller wakes up early
+refill_requested = threading.Event()
+# Serialises refills so the refiller thread and manual calls never overshoot the pool size
+refill_lock = threading.Lock()
+# Number of claims since the last refill, used to grow the pool during bursts.
+# Request threads add to it and the refiller thread reads and resets it, so both hold claims_lock.
+claims_since_refill = 0
+claims_lock = threading.Lock()
+
+def claim_pooled_instance(user_id, assignment_id=None):
+    """Claim a pre-warmed container from the pool, or None if the pool is empty"""
+    from services.container_state import is_container_running_cached
+
+    if not current_app.config['POOL_ENABLED']:
+        return None
+
+    global claims_since_refill
+
+    while True:
+        instance = claim_pooled_instance_row(user_id, assignment_id)
+
+        if not instance:
+            current_app.logger.info("Container pool is empty, falling back to a cold start")
+            refill_requested.set()
+            return None
+
+        with claims_lock:
+            claims_since_refill += 1
+        refill_requested.set()
+
+        # A pooled container may have died while it was waiting
+        if is_container_running_cached(instance['container_id'], instance['node']):
+            current_app.logger.info(f"Assigned pooled container {instance['container_id']} to user {user_id}")
+            return instance
+
+        current_app.logger.warning(f"Pooled container {instance['container_id']} is not running, discarding it")
+        update_instance_status(instance['id'], 'stopped')
+
+def refill_pool():
+    """Start containers until the pool is back at its target size"""
+    from services.docker_service import start_juice_shop_instance
+
+    if not current_app.config['POOL_ENABLED']:
+        return {'success': True, 'started_count': 0}
+
+    global claims_since_refill
+
+    with refill_lock:
+        pooled_count = count_pooled_instances()
+
+        # Only refill once the pool has drained to its low-water mark
+        if pooled_count > current_app.config['POOL_LOW_WATER']:
+            return {'success': True, 'started_count': 0}
+
+        with claims_lock:
+            claims = claims_since_refill
+            claims_since_refill = 0
+
+        # Grow the target by recent demand, but never past the configured maximum
+        target = min(current_app.config['POOL_TARGET_SIZE'] + claims, current_app.config['POOL_MAX_SIZE'])
+
+        started_count = 0
+        for _ in range(target - pooled_count):
+            # Never pre-warm into capacity that users' own instances need
+            node = reserve_capacity()
+            if node is None:
+                current_app.logger.info("Host capacity is full, not refilling the container pool further")
+                break
+
+            try:
+                started = start_juice_shop_instance("juice_shop_pool", node)
+            except Exception as e:
+                release_capacity(node)
+                current_app.logger.error(f"Error starting pooled container: {str(e)}")
+                break
+
+            try:
+                instance_id = save_instance(POOL_USER_ID, started['container_id'], started['port'], 'pooled', node=node,
+                                            proxy_token=started['proxy_token'], upstream=started['upstream'])
+                watch_instance(instance_id, started['container_id'], instance_base_url(started), node=node)
+                started_count += 1
+            except Exception as e:
+                release_port(started['port'], node)
+                current_app.logger.error(f"Error starting pooled container: {str(e)}")
+                break
+            finally:
+                release_capacity(node)
+
+        if started_count:
+            current_app.logger.info(f"Container pool refilled with {started_count} containers (target {target})")
+
+        return {'success': True, 'started_count': started_count}
+
+def start_pool_refiller(app):
+    """Start a background thread that keeps the container pool topped up"""
+    def refiller_thread_func():
+        while True:
+            try:
+                with app.app_context():
+                    refill_pool()
+            except Exception as e:
+                app.logger.error(f"Error in pool refiller thread: {str(e)}")
+
+            # Wait for a claim or for the next periodic check
+            refill_requested.wait(app.config['POOL_REFILL_INTERVAL'])
+            refill_requested.clear()
+
+    refiller_thread = threading.Thread(target=refiller_thread_func, daemon=True)
+    refiller_thread.start()
+    return refiller_thread
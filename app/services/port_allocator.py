@@ -0,0 +1,154 @@
+"""
+Host port allocator backed by reservations in the database
+
+Every reserved port has a row in port_reservations, keyed by node and port, so
+inserting that row is the atomic reservation: two creates, in the same or in
+different worker processes, can never be handed the same port. Each process
+keeps a free list with a position index as a hint, so picking a random port
+and releasing one are both O(1). A port another process took meanwhile is
+dropped from the hint when its reservation fails, and an empty hint is reloaded
+from the database, which also picks up ports other processes released.
+Each Docker node has its own allocator over its own port range.
+"""
+import errno
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+
+# Node name -> allocator shared by all requests
+port_allocators = {}
+allocator_lock = threading.Lock()
+
+# Instance statuses that hold on to their host port
+ACTIVE_STATUSES = ('running', 'starting', 'suspended', 'pooled')
+
+def sync_reservations():
+    """Reserve the ports of active instances and drop reservations no instance took up in time"""
+    from models.instance import sync_port_reservations
+    from services.nodes import get_node
+
+    stale_before = datetime.now() - timedelta(seconds=current_app.config['PORT_RESERVATION_TIMEOUT'])
+    sync_port_reservations(get_node()['name'], stale_before)
+
+class PortAllocator:
+    """Allocator for a contiguous range of host ports on one node"""
+    def __init__(self, node, start, end, check_host=False, host_ip=''):
+        self.node = node
+        self.start = start
+        self.end = end
+        self.check_host = check_host
+        self.host_ip = host_ip
+        self.lock = threading.Lock()
+        self.free_ports = []
+        # Port -> its index in free_ports
+        self.free_positions = {}
+
+    def _remove_free(self, port):
+        index = self.free_positions.pop(port)
+        last_port = self.free_ports.pop()
+        if last_port != port:
+            # Move the last port into the hole left behind
+            self.free_ports[index] = last_port
+            self.free_positions[last_port] = index
+
+    def _add_free(self, port):
+        self.free_positions[port] = len(self.free_ports)
+        self.free_ports.append(port)
+
+    def load(self):
+        """Rebuild the free list from the ports reserved in the database"""
+        from models.instance import get_reserved_ports
+
+        reserved = get_reserved_ports(self.node)
+        with self.lock:
+            self.free_ports = [port for port in range(self.start, self.end + 1) if port not in reserved]
+            self.free_positions = {port: index for index, port in enumerate(self.free_ports)}
+
+    def allocate(self):
+        """Reserve and return a random free port"""
+        from models.instance import reserve_port
+
+        reloaded = False
+        while True:
+            with self.lock:
+                port = self.free_ports[random.randrange(len(self.free_ports))] if self.free_ports else None
+                if port is not None:
+                    self._remove_free(port)
+
+            if port is None:
+                if reloaded:
+                    raise Exception("No available ports in the specified range")
+                # Other processes may have released ports, and ports bound on the host get another chance
+                sync_reservations()
+                self.load()
+                reloaded = True
+                continue
+
+            if self.check_host and self.is_bound_on_host(port):
+                continue
+            # Fails if another process reserved the port since this one loaded its free list
+            if reserve_port(self.node, port):
+                return port
+
+    def release(self, port):
+        """Drop a port's reservation and return it to the free list"""
+        from models.instance import delete_port_reservation
+        from services.nodes import get_node
+
+        if port is None or not self.start <= port <= self.end:
+            return
+        delete_port_reservation(self.node, port, get_node()['name'])
+        with self.lock:
+            if port not in self.free_positions:
+                self._add_free(port)
+
+    def free_count(self):
+        """Number of ports of the range no process has reserved"""
+        from models.instance import count_reserved_ports
+
+        return self.end - self.start + 1 - count_reserved_ports(self.node, self.start, self.end)
+
+    def is_bound_on_host(self, port):
+        """Check if another process already listens on the port"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # SO_REUSEADDR ignores sockets in TIME_WAIT but still fails on a listening socket
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host_ip, port))
+            return False
+        except OSError as e:
+            return e.errno == errno.EADDRINUSE
+        finally:
+            sock.close()
+
+def get_port_allocator(node=None):
+    """Get the shared port allocator of a node, loading the reserved ports from the database on first use"""
+    from services.nodes import get_node, get_nodes
+
+    node_name = get_node(node)['name']
+    allocator = port_allocators.get(node_name)
+
+    if allocator is None:
+        with allocator_lock:
+            if not port_allocators:
+                config = current_app.config
+                sync_reservations()
+                # Only ports on this host can be probed; remote nodes rely on the database alone
+                for name, entry in get_nodes().items():
+                    allocator = PortAllocator(name, entry['port_range_start'], entry['port_range_end'],
+                                              check_host=config['PORT_CHECK_HOST'] and entry['local'])
+                    allocator.load()
+                    port_allocators[name] = allocator
+            allocator = port_allocators[node_name]
+
+    return allocator
+
+def allocate_port(node=None):
+    """Reserve an available host port on a node"""
+    return get_port_allocator(node).allocate()
+
+def release_port(port, node=None):
+    """Release a host port on a node once the instance holding it is gone"""
+    get_port_allocator(node).release(port)
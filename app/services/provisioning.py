@@ -0,0 +1,114 @@
+"""
+Asynchronous instance provisioning
+
+Creating or restarting an instance can take a long time (image pulls, the grace
+period of `docker stop`), so the API queues them as jobs served by a bounded
+worker pool and returns right away. A user has at most one unfinished job;
+asking again returns that job. Jobs move through queued, pulling, waiting (for
+host capacity) and starting to healthy, or end as failed.
+
+Jobs live in the database, so whichever worker process serves a status request
+can report a job queued by another one. A job whose process died before it
+finished would block its user forever, so an unfinished job that has not moved
+for PROVISION_JOB_STALE_AFTER seconds is failed when the user asks again.
+Workers refresh a job when they pick it up and skip it if it was failed while
+it waited in the queue, and a finished job never changes state again.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from models.job import (insert_provisioning_job, get_unfinished_job, get_provisioning_job, start_provisioning_job,
+                        update_provisioning_job, fail_stale_jobs, delete_finished_jobs)
+from services.docker_service import create_docker_instance, restart_docker_instance
+from services.status_watcher import publish_user
+
+JOB_KINDS = ('create', 'restart')
+
+executor_lock = threading.Lock()
+job_executor = None
+
+def get_job_executor(app):
+    """Get the worker pool jobs run on, creating it on first use"""
+    global job_executor
+
+    with executor_lock:
+        if job_executor is None:
+            job_executor = ThreadPoolExecutor(max_workers=app.config['PROVISION_WORKERS'],
+                                              thread_name_prefix='provisioning')
+        return job_executor
+
+def submit_provisioning_job(kind, user_id, assignment_id=None):
+    """Queue a create or restart job, returning (job, whether a new job was queued)"""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown provisioning job kind: {kind}")
+
+    app = current_app._get_current_object()
+    now = time.time()
+
+    delete_finished_jobs(now - app.config['PROVISION_JOB_TTL'])
+    if fail_stale_jobs(user_id, now - app.config['PROVISION_JOB_STALE_AFTER'], 'Provisioning was interrupted'):
+        app.logger.warning(f"Failed a stale provisioning job of user {user_id}")
+
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'user_id': user_id,
+        'assignment_id': assignment_id,
+        'state': 'queued',
+        'message': None,
+        'result': None,
+        'created_at': now,
+        'updated_at': now
+    }
+
+    # Repeated clicks and concurrent tabs, on any worker process, share the job already in progress.
+    # That job may finish between the insert and the lookup, so try once more.
+    for _ in range(2):
+        if insert_provisioning_job(job):
+            break
+        existing = get_unfinished_job(user_id)
+        if existing:
+            return existing, False
+    else:
+        raise Exception("Could not queue the provisioning job")
+
+    get_job_executor(app).submit(run_provisioning_job, app, dict(job))
+    app.logger.info(f"Queued {kind} job {job['id']} for user {user_id}")
+    return job, True
+
+def set_job_state(job_id, state, message=None, result=None):
+    """Move a job to a new state and push it to the user's status streams"""
+    job = update_provisioning_job(job_id, state, message, result, time.time())
+    if job is None:
+        return
+
+    publish_user(job['user_id'], 'job', job)
+
+def run_provisioning_job(app, job):
+    """Run a job on a worker thread"""
+    job_id = job['id']
+
+    def progress(state):
+        set_job_state(job_id, state)
+
+    with app.app_context():
+        # A job that waited in the queue long enough to be failed as stale must not create a container anyway
+        if not start_provisioning_job(job_id, time.time()):
+            app.logger.warning(f"Skipping provisioning job {job_id}, it already finished while it was queued")
+            return
+
+        try:
+            if job['kind'] == 'create':
+                result = create_docker_instance(job['user_id'], job['assignment_id'], progress=progress)
+            else:
+                result = restart_docker_instance(job['user_id'], progress=progress)
+        except Exception as e:
+            app.logger.error(f"Error running provisioning job {job_id}: {str(e)}")
+            result = {'success': False, 'message': str(e)}
+
+        if result.get('success'):
+            set_job_state(job_id, 'healthy', 'Instance is ready', result)
+        else:
+            set_job_state(job_id, 'failed', result.get('message', 'Provisioning failed'), result)
@@ -0,0 +1,272 @@
+"""
+Built-in reverse proxy for student instances
+
+With PROXY_ENABLED, Juice Shop containers join DOCKER_NETWORK without a
+published host port, so instances are not limited by a port range and only
+the app's own port has to be reachable. Each instance gets a random proxy
+token and is served at /instance/<token>/. Juice Shop runs with that path as
+its base path, so requests are forwarded to the container unchanged.
+
+Routes are kept in an in-memory table for PROXY_ROUTE_TTL seconds, responses
+are streamed back over keep-alive upstream connections, and WebSocket
+upgrades are tunnelled over the raw client socket. Every proxied request
+counts as activity for idle suspension.
+
+Juice Shop is deliberately vulnerable to XSS, so instances should be served
+from their own origin (PROXY_BASE_URL, e.g. another host name pointing at the
+app). On the tool's origin, a script injected into an instance could read the
+tool's pages and their launch IDs. When PROXY_BASE_URL is set, instances are
+only served on its host.
+"""
+import http.cookiejar
+import json
+import selectors
+import secrets
+import socket
+import threading
+import time
+from urllib.parse import quote, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Response, current_app
+from models.instance import get_proxy_route, get_user_instance
+from services.activity import record_activity
+from services.nodes import node_url
+from utils.metrics import upstream_request_seconds, upstream_request_errors, timed
+
+PROXY_PATH = '/instance'
+JUICE_SHOP_PORT = 3000
+
+# Headers that only apply to a single connection and are never forwarded
+HOP_BY_HOP_HEADERS = frozenset(['connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                                'te', 'trailer', 'transfer-encoding', 'upgrade'])
+
+# Proxy token -> (route, monotonic time the route expires)
+routes = {}
+# Monotonic time of the last sweep for expired routes
+last_route_sweep = 0.0
+routes_lock = threading.Lock()
+# Session shared by all proxied requests; urllib3 keeps a keep-alive connection pool per instance
+proxy_session = None
+session_lock = threading.Lock()
+
+def new_proxy_token():
+    return secrets.token_hex(16)
+
+def instance_base_path(proxy_token):
+    return f"{PROXY_PATH}/{proxy_token}"
+
+def juice_shop_proxy_env(proxy_token):
+    """Environment that makes Juice Shop serve everything under the instance's proxy path"""
+    return {'NODE_CONFIG': json.dumps({'server': {'basePath': instance_base_path(proxy_token)}})}
+
+def instance_base_url(instance):
+    """Get the URL the app itself reaches an instance's Juice Shop at"""
+    if instance['upstream']:
+        return f"http://{instance['upstream']}{instance_base_path(instance['proxy_token'])}"
+    return node_url(instance['node'], instance['port'])
+
+def instance_public_url(instance):
+    """Get the URL students open their instance at"""
+    if instance['upstream']:
+        return f"{current_app.config['PROXY_BASE_URL']}{instance_base_path(instance['proxy_token'])}/"
+    return node_url(instance['node'], instance['port'])
+
+def resolve_route(proxy_token):
+    """
+    Get the route of a proxy token from the routing table or the database, or None if
+    the token does not belong to a running instance. A suspended instance is resumed.
+    """
+    global last_route_sweep
+
+    now = time.monotonic()
+    with routes_lock:
+        entry = routes.get(proxy_token)
+        if entry and entry[1] > now:
+            return entry[0]
+
+    row = get_proxy_route(proxy_token)
+    if row is None:
+        forget_route(proxy_token)
+        return None
+
+    # get_user_instance unpauses the container of a suspended instance
+    if row['status'] == 'suspended' and not get_user_instance(row['user_id'])['exists']:
+        return None
+
+    route = {'instance_id': row['id'], 'upstream': row['upstream']}
+    ttl = current_app.config['PROXY_ROUTE_TTL']
+
+    with routes_lock:
+        routes[proxy_token] = (route, now + ttl)
+
+        # Drop routes of instances nobody has opened for a while, e.g. stopped ones
+        if now - last_route_sweep > ttl:
+            last_route_sweep = now
+            for token, (_, expires_at) in list(routes.items()):
+                if expires_at <= now:
+                    del routes[token]
+
+    return route
+
+def forget_route(proxy_token):
+    """Drop a route, e.g. once its container stopped answering"""
+    with routes_lock:
+        routes.pop(proxy_token, None)
+
+def get_proxy_session():
+    """Get the shared upstream session, creating it on first use"""
+    global proxy_session
+
+    if proxy_session is None:
+        with session_lock:
+            if proxy_session is None:
+                config = current_app.config
+                session = requests.Session()
+                # Cookies belong to the browser; the shared session must never store or replay them
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                session.trust_env = False
+                adapter = HTTPAdapter(pool_connections=config['PROXY_POOL_CONNECTIONS'],
+                                      pool_maxsize=config['PROXY_POOL_MAXSIZE'], max_retries=0)
+                session.mount('http://', adapter)
+                proxy_session = session
+
+    return proxy_session
+
+def upstream_target(request):
+    """Path and query string of a request, re-quoted for the upstream request line"""
+    target = quote(request.path, safe="/:@!$&'()*+,;=-._~")
+    if request.query_string:
+        target += '?' + request.query_string.decode('latin-1')
+    return target
+
+def is_instance_origin(request):
+    """Check that a request came in on the origin instances are served from"""
+    base_url = current_app.config['PROXY_BASE_URL']
+    if not base_url:
+        return True
+    return request.host.lower() == urlsplit(base_url).netloc.lower()
+
+def without_tool_credentials(request):
+    """
+    Request headers without the tool's session cookie, which the browser also sends to instances
+    on the tool's origin. Authorization is forwarded: Juice Shop's frontend uses it for its own logins.
+    """
+    session_cookie = current_app.config['SESSION_COOKIE_NAME']
+    headers = []
+
+    for key, value in request.headers.items():
+        if key.lower() == 'cookie':
+            cookies = [cookie for cookie in value.split(';') if cookie.split('=', 1)[0].strip() != session_cookie]
+            if not cookies:
+                continue
+            value = ';'.join(cookies).strip()
+        headers.append((key, value))
+
+    return headers
+
+def forwarded_headers(request):
+    """Request headers to send upstream, without hop-by-hop headers or tool credentials and with X-Forwarded-*"""
+    headers = {key: value for key, value in without_tool_credentials(request)
+               if key.lower() not in HOP_BY_HOP_HEADERS and key.lower() != 'host'}
+    headers['X-Forwarded-For'] = request.remote_addr or ''
+    headers['X-Forwarded-Proto'] = request.scheme
+    headers['X-Forwarded-Host'] = request.host
+    return headers
+
+def proxy_request(proxy_token, route, request):
+    """Forward an HTTP request to an instance and stream the response back"""
+    config = current_app.config
+    url = f"http://{route['upstream']}{upstream_target(request)}"
+
+    try:
+        # Timed until the response headers arrive; the body is streamed afterwards
+        with timed(upstream_request_seconds, upstream_request_errors, 'proxy'):
+            upstream = get_proxy_session().request(
+                request.method, url,
+                headers=forwarded_headers(request),
+                data=request.get_data() or None,
+                stream=True,
+                allow_redirects=False,
+                timeout=(config['PROXY_CONNECT_TIMEOUT'], config['PROXY_READ_TIMEOUT'])
+            )
+    except requests.RequestException as e:
+        forget_route(proxy_token)
+        current_app.logger.warning(f"Instance {route['instance_id']} is not reachable through the proxy: {str(e)}")
+        return Response('Instance is not reachable', status=502, mimetype='text/plain')
+
+    headers = [(key, value) for key, value in upstream.raw.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS]
+    chunk_size = config['PROXY_CHUNK_SIZE']
+
+    def stream():
+        complete = False
+        try:
+            # Passed through still encoded, matching the forwarded Content-Encoding and Content-Length
+            for chunk in upstream.raw.stream(chunk_size, decode_content=False):
+                yield chunk
+            complete = True
+        finally:
+            # A fully read response leaves the connection reusable; an aborted one is closed
+            if complete:
+                upstream.raw.release_conn()
+            else:
+                upstream.close()
+
+    return Response(stream(), status=upstream.status_code, headers=headers, direct_passthrough=True)
+
+class TunnelClosedResponse(Response):
+    """Response for a request whose connection was taken over by a tunnel, so nothing more may be written to it"""
+    def __call__(self, environ, start_response):
+        if 'gunicorn.socket' in environ:
+            raise StopIteration()
+        # Werkzeug's server treats this like a client that went away and writes no response
+        raise ConnectionError("Connection was taken over by a WebSocket tunnel")
+
+def tunnel_websocket(proxy_token, route, request):
+    """Relay a WebSocket connection between the client and an instance until either side closes it"""
+    config = current_app.config
+    client = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+    if client is None:
+        return Response('WebSocket proxying is not supported by this server', status=501, mimetype='text/plain')
+
+    host, _, port = route['upstream'].rpartition(':')
+    try:
+        upstream = socket.create_connection((host, int(port)), timeout=config['PROXY_CONNECT_TIMEOUT'])
+    except OSError as e:
+        forget_route(proxy_token)
+        current_app.logger.warning(f"Instance {route['instance_id']} is not reachable through the proxy: {str(e)}")
+        return Response('Instance is not reachable', status=502, mimetype='text/plain')
+
+    # The upgrade request is forwarded as is; the instance's 101 response and all frames after it go back raw
+    lines = [f"{request.method} {upstream_target(request)} HTTP/1.1", f"Host: {route['upstream']}"]
+    lines += [f"{key}: {value}" for key, value in without_tool_credentials(request) if key.lower() != 'host']
+    lines.append(f"X-Forwarded-For: {request.remote_addr or ''}")
+
+    try:
+        upstream.settimeout(None)
+        upstream.sendall(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        relay_sockets(client, upstream, route['instance_id'])
+    finally:
+        upstream.close()
+
+    return TunnelClosedResponse()
+
+def relay_sockets(client, upstream, instance_id):
+    """Copy bytes both ways between two sockets until one of them closes"""
+    selector = selectors.DefaultSelector()
+    selector.register(client, selectors.EVENT_READ, upstream)
+    selector.register(upstream, selectors.EVENT_READ, client)
+
+    try:
+        while True:
+            for key, _ in selector.select():
+                data = key.fileobj.recv(65536)
+                if not data:
+                    return
+                key.data.sendall(data)
+            # Open tabs keep an instance from being suspended
+            record_activity(instance_id)
+    except OSError:
+        pass
+    finally:
+        selector.close()
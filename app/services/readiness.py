@@ -0,0 +1,171 @@
+"""
+Readiness prober for new Juice Shop containers
+
+`docker run -d` returns long before the Node app inside listens, so new
+instances are saved as 'starting' (or as unready pooled containers) and probed
+over HTTP with exponential backoff by one background thread. The first
+successful probe promotes the instance to 'running', which is when its URL is
+handed out, and records how long the container took to become ready.
+Backends that know when a container is ready answer through their is_ready
+hook instead, so the fake backend needs no server behind its containers.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import requests
+from models.instance import get_unready_instances, mark_instance_ready, update_instance_status
+from services.container_backends import get_container_backend
+from services.proxy import instance_base_url
+from utils.metrics import upstream_request_seconds, upstream_request_errors, timed
+
+# Instance ID -> probe state, see watch_instance
+pending_probes = {}
+probes_lock = threading.Lock()
+# Set to make the prober look at newly watched instances right away
+wake_prober = threading.Event()
+prober_thread = None
+
+# Recent time-to-ready measurements in seconds
+ready_durations = deque(maxlen=1000)
+
+def watch_instance(instance_id, container_id, url, started_at=None, node=None):
+    """
+    Start probing an instance, returning its probe state. probe['done'] is set once the
+    instance is ready or has failed, and probe['ready'] tells which.
+    Watching an instance that is already being probed returns the existing state.
+    """
+    from flask import current_app
+
+    with probes_lock:
+        probe = pending_probes.get(instance_id)
+        if probe is None:
+            probe = {
+                'container_id': container_id,
+                'url': url,
+                'node': node,
+                'started_at': started_at if started_at is not None else time.time(),
+                'next_probe': 0.0,
+                'delay': current_app.config['READINESS_INITIAL_DELAY'],
+                'done': threading.Event(),
+                'ready': False
+            }
+            pending_probes[instance_id] = probe
+
+    start_readiness_prober(current_app._get_current_object())
+    wake_prober.set()
+    return probe
+
+def wait_until_ready(instance_id, container_id, url, started_at=None, node=None):
+    """Block until an instance is ready, returning whether it became ready in time"""
+    from flask import current_app
+
+    probe = watch_instance(instance_id, container_id, url, started_at, node)
+    probe['done'].wait(current_app.config['READINESS_TIMEOUT'] + current_app.config['READINESS_MAX_DELAY'])
+    return probe['ready']
+
+def probe_instance(app, url):
+    """Check if Juice Shop answers HTTP at an instance URL"""
+    try:
+        with timed(upstream_request_seconds, upstream_request_errors, 'readiness'):
+            response = requests.get(f"{url}/",
+                                    timeout=app.config['READINESS_PROBE_TIMEOUT'])
+        return response.status_code == 200
+    except requests.RequestException:
+        return False
+
+def is_instance_ready(app, probe):
+    """Ask the container backend whether an instance is ready, probing it over HTTP unless the backend knows"""
+    ready = get_container_backend(probe['node']).is_ready(probe['container_id'])
+    if ready is None:
+        ready = probe_instance(app, probe['url'])
+    return ready
+
+def finish_probe(instance_id, ready):
+    with probes_lock:
+        probe = pending_probes.pop(instance_id, None)
+        if probe:
+            probe['ready'] = ready
+    if probe:
+        probe['done'].set()
+
+def run_due_probes(app):
+    """Probe every watched instance whose backoff delay has passed"""
+    from services.docker_service import stop_docker_container
+
+    config = app.config
+    now = time.monotonic()
+
+    with probes_lock:
+        due = [(instance_id, dict(probe)) for instance_id, probe in pending_probes.items() if probe['next_probe'] <= now]
+
+    for instance_id, probe in due:
+        if is_instance_ready(app, probe):
+            ready_seconds = max(time.time() - probe['started_at'], 0.0)
+            mark_instance_ready(instance_id, ready_seconds)
+            ready_durations.append(ready_seconds)
+            app.logger.info(f"Instance {instance_id} ready after {ready_seconds:.1f}s")
+            finish_probe(instance_id, True)
+            continue
+
+        if time.time() - probe['started_at'] > config['READINESS_TIMEOUT']:
+            app.logger.error(f"Instance {instance_id} did not become ready within {config['READINESS_TIMEOUT']}s")
+            stop_docker_container(probe['container_id'], probe['node'])
+            update_instance_status(instance_id, 'failed')
+            finish_probe(instance_id, False)
+            continue
+
+        # Back off exponentially up to the maximum delay
+        with probes_lock:
+            pending = pending_probes.get(instance_id)
+            if pending:
+                pending['next_probe'] = time.monotonic() + pending['delay']
+                pending['delay'] = min(pending['delay'] * 2, config['READINESS_MAX_DELAY'])
+
+def resume_unready_instances():
+    """Watch the instances a restart left unready again"""
+    for instance in get_unready_instances():
+        try:
+            started_at = datetime.fromisoformat(instance['created_at']).timestamp()
+        except (TypeError, ValueError):
+            started_at = None
+        watch_instance(instance['id'], instance['container_id'], instance_base_url(instance), started_at, instance['node'])
+
+def start_readiness_prober(app):
+    """Start the prober thread once, resuming probes of instances left unready by a restart"""
+    global prober_thread
+
+    with probes_lock:
+        if prober_thread is not None:
+            return prober_thread
+
+        def prober_thread_func():
+            resumed = False
+            while True:
+                if not resumed:
+                    try:
+                        with app.app_context():
+                            resume_unready_instances()
+                        resumed = True
+                    except Exception as e:
+                        app.logger.error(f"Error resuming readiness probes: {str(e)}")
+
+                try:
+                    with app.app_context():
+                        run_due_probes(app)
+                except Exception as e:
+                    app.logger.error(f"Error in readiness prober thread: {str(e)}")
+
+                with probes_lock:
+                    next_probes = [probe['next_probe'] for probe in pending_probes.values()]
+                timeout = max(min(next_probes) - time.monotonic(), 0.05) if next_probes else None
+                if not resumed:
+                    # The database was not readable yet, e.g. locked during startup; try again shortly
+                    timeout = min(timeout or app.config['READINESS_MAX_DELAY'], app.config['READINESS_MAX_DELAY'])
+
+                wake_prober.wait(timeout)
+                wake_prober.clear()
+
+        prober_thread = threading.Thread(target=prober_thread_func, daemon=True)
+        prober_thread.start()
+        return prober_thread
@@ -0,0 +1,174 @@
+"""
+Central solve detection for all running instances
+
+One scheduler thread walks the running instances and hands polls that are due to
+a bounded worker pool. Recently active instances are polled every
+SOLVE_POLL_ACTIVE_INTERVAL seconds and idle ones every SOLVE_POLL_IDLE_INTERVAL,
+each with random jitter so the polls spread out. Solves found in one pass are
+written in a single batch, and the fetched lists become the instances' latest
+challenge snapshot, so status requests read stored state instead of calling the
+instance themselves.
+"""
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from models.instance import get_running_instances
+from services.proxy import instance_base_url
+from models.challenge import get_assigned_challenges, save_solved_challenges
+from services.challenge_service import get_challenges_from_instance, record_challenge_poll
+
+# Seconds between scheduler passes
+SCHEDULER_TICK = 1
+
+# container_id -> (monotonic time of the last poll, jitter factor for the next one)
+poll_schedule = {}
+# Containers with a poll in flight
+polls_in_flight = set()
+# container_id -> challenge IDs already written to solved_challenges
+recorded_solves = {}
+# Finished polls waiting to be written: (instance, challenge list or None)
+poll_results = queue.Queue()
+solve_poller_running = False
+
+def is_solve_poller_running():
+    """Whether the background poller keeps instance challenge snapshots fresh"""
+    return solve_poller_running
+
+def next_jitter(config):
+    jitter = config['SOLVE_POLL_JITTER']
+    return random.uniform(1 - jitter, 1 + jitter)
+
+def poll_interval(instance, config, active_since):
+    """Poll instances used within the active window faster than idle ones"""
+    try:
+        last_accessed = datetime.fromisoformat(instance['last_accessed'])
+    except (TypeError, ValueError):
+        last_accessed = None
+
+    if last_accessed and last_accessed >= active_since:
+        return config['SOLVE_POLL_ACTIVE_INTERVAL']
+    return config['SOLVE_POLL_IDLE_INTERVAL']
+
+def poll_instance(app, instance):
+    """Fetch one instance's challenge list; runs on a worker thread"""
+    challenges = None
+
+    try:
+        with app.app_context():
+            url = instance_base_url(instance)
+            challenges = get_challenges_from_instance(url)
+    except Exception as e:
+        app.logger.warning(f"Error polling challenges of instance {instance['id']}: {str(e)}")
+
+    poll_results.put((instance, challenges))
+
+def schedule_due_polls(app, executor):
+    """Submit a poll for every running instance whose interval has elapsed"""
+    config = app.config
+    now = time.monotonic()
+    active_since = datetime.now() - timedelta(seconds=config['SOLVE_POLL_ACTIVE_WINDOW'])
+    running = set()
+
+    for instance in get_running_instances():
+        container_id = instance['container_id']
+        running.add(container_id)
+
+        if container_id in polls_in_flight:
+            continue
+
+        interval = poll_interval(instance, config, active_since)
+
+        if container_id not in poll_schedule:
+            # Spread the first polls of newly seen instances over one interval
+            poll_schedule[container_id] = (now - interval * random.random(), 1.0)
+
+        last_polled, jitter = poll_schedule[container_id]
+        if now - last_polled < interval * jitter:
+            continue
+
+        poll_schedule[container_id] = (now, next_jitter(config))
+        polls_in_flight.add(container_id)
+        executor.submit(poll_instance, app, instance)
+
+    # Forget instances that are no longer running
+    for container_id in list(poll_schedule):
+        if container_id not in running and container_id not in polls_in_flight:
+            del poll_schedule[container_id]
+            recorded_solves.pop(container_id, None)
+
+def record_poll_results(app):
+    """Store finished polls as snapshots and write their new solves in one batch"""
+    solves = []
+    new_solves = []
+    assigned_ids = {}
+
+    while True:
+        try:
+            instance, challenges = poll_results.get_nowait()
+        except queue.Empty:
+            break
+
+        container_id = instance['container_id']
+        polls_in_flight.discard(container_id)
+
+        if not challenges:
+            continue
+
+        record_challenge_poll(instance['user_id'], container_id, challenges)
+
+        # Only challenges assigned to the instance's assignment count towards a grade
+        assignment_id = instance['assignment_id']
+        if not assignment_id:
+            continue
+        if assignment_id not in assigned_ids:
+            assigned_ids[assignment_id] = {c['challenge_id'] for c in get_assigned_challenges(assignment_id)}
+
+        recorded = recorded_solves.get(container_id, set())
+        for challenge in challenges:
+            if challenge.get('solved', False) and challenge['id'] in assigned_ids[assignment_id] \
+                    and challenge['id'] not in recorded:
+                solves.append((instance['user_id'], challenge['id'], assignment_id))
+                new_solves.append((container_id, challenge['id']))
+
+    if not solves:
+        return
+
+    saved_count = save_solved_challenges(solves)
+    if saved_count is None:
+        # Nothing was written; the next poll of these instances retries
+        return
+
+    for container_id, challenge_id in new_solves:
+        recorded_solves.setdefault(container_id, set()).add(challenge_id)
+
+    if saved_count:
+        app.logger.info(f"Recorded {saved_count} new solved challenges")
+
+def start_solve_poller(app):
+    """Start the background thread that polls all running instances for solves"""
+    global solve_poller_running
+
+    if not app.config['SOLVE_POLLER_ENABLED']:
+        return None
+
+    executor = ThreadPoolExecutor(max_workers=app.config['SOLVE_POLL_WORKERS'],
+                                  thread_name_prefix='solve-poller')
+
+    def poller_thread_func():
+        while True:
+            try:
+                with app.app_context():
+                    record_poll_results(app)
+                    schedule_due_polls(app, executor)
+            except Exception as e:
+                app.logger.error(f"Error in solve poller thread: {str(e)}")
+
+            time.sleep(SCHEDULER_TICK)
+
+    solve_poller_running = True
+    poller_thread = threading.Thread(target=poller_thread_func, daemon=True)
+    poller_thread.start()
+    return poller_thread
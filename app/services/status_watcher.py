@@ -0,0 +1,152 @@
+"""
+Server-side watcher for instance and challenge status
+
+Browser tabs subscribe to a (user, assignment) pair instead of polling. A single
+background thread checks every watched pair, records newly solved challenges,
+and pushes only what changed to each subscriber's queue.
+"""
+import queue
+import threading
+from flask import current_app
+from models.instance import get_user_instance
+from services.challenge_service import check_challenge_completion
+
+# Instance fields that describe its state; the rest (e.g. last_accessed) changes on every read
+INSTANCE_STATE_FIELDS = ('exists', 'id', 'container_id', 'status', 'url', 'reason', 'created_at')
+
+# (user_id, assignment_id) -> {'subscribers': set of queues, 'instance': ..., 'challenges': ...}
+watched = {}
+watched_lock = threading.Lock()
+# Set to make the watcher check immediately, e.g. for a new subscriber
+wake_watcher = threading.Event()
+watcher_thread = None
+
+def instance_state(instance):
+    return {field: instance.get(field) for field in INSTANCE_STATE_FIELDS}
+
+def subscribe(user_id, assignment_id):
+    """Subscribe to status updates, returning the queue events will be pushed to"""
+    global watcher_thread
+
+    subscriber = queue.Queue()
+    key = (user_id, assignment_id)
+
+    with watched_lock:
+        entry = watched.setdefault(key, {'subscribers': set(), 'instance': None, 'challenges': None})
+        entry['subscribers'].add(subscriber)
+
+        # Replay the last known state so the new tab does not wait for a change
+        if entry['instance'] is not None:
+            subscriber.put(('instance', entry['instance']))
+        if entry['challenges'] is not None:
+            subscriber.put(('challenges', challenge_delta(None, entry['challenges'])))
+
+        if watcher_thread is None:
+            watcher_thread = start_status_watcher(current_app._get_current_object())
+
+    wake_watcher.set()
+    return subscriber
+
+def unsubscribe(user_id, assignment_id, subscriber):
+    """Stop pushing updates to a subscriber queue"""
+    key = (user_id, assignment_id)
+
+    with watched_lock:
+        entry = watched.get(key)
+        if entry:
+            entry['subscribers'].discard(subscriber)
+            if not entry['subscribers']:
+                del watched[key]
+
+def challenge_delta(previous, current):
+    """Describe the changes between two challenge status results"""
+    if previous is None:
+        return {'full': True, 'challenges': current['challenges'],
+                'completed': current['completed'], 'total': current['total']}
+
+    previous_by_id = {challenge['id']: challenge for challenge in previous['challenges']}
+    current_ids = [challenge['id'] for challenge in current['challenges']]
+
+    # A different set of challenges is easier to redraw than to patch
+    if current_ids != [challenge['id'] for challenge in previous['challenges']]:
+        return challenge_delta(None, current)
+
+    changed = [challenge for challenge in current['challenges'] if previous_by_id.get(challenge['id']) != challenge]
+    if not changed and previous['completed'] == current['completed'] and previous['total'] == current['total']:
+        return None
+
+    return {'full': False, 'challenges': changed, 'completed': current['completed'], 'total': current['total']}
+
+def publish(key, event, data):
+    with watched_lock:
+        entry = watched.get(key)
+        subscribers = list(entry['subscribers']) if entry else []
+
+    for subscriber in subscribers:
+        subscriber.put((event, data))
+
+def publish_user(user_id, event, data):
+    """Push an event to all status streams of a user, whatever assignment they watch"""
+    with watched_lock:
+        keys = [key for key in watched if key[0] == user_id]
+
+    for key in keys:
+        publish(key, event, data)
+
+def record_watched_state(key, entry, field, value):
+    """Store the latest state of a watched pair, returning False if nobody watches it any more"""
+    with watched_lock:
+        if watched.get(key) is not entry:
+            return False
+        entry[field] = value
+        return True
+
+def check_watched_status(key):
+    """Check one watched pair and push whatever changed"""
+    user_id, assignment_id = key
+
+    with watched_lock:
+        entry = watched.get(key)
+        if not entry:
+            return
+        previous_instance = entry['instance']
+        previous_challenges = entry['challenges']
+
+    instance = get_user_instance(user_id)
+    if previous_instance is None or instance_state(instance) != instance_state(previous_instance):
+        if record_watched_state(key, entry, 'instance', instance):
+            publish(key, 'instance', instance)
+
+    if not instance.get('exists'):
+        return
+
+    # Records newly solved challenges; grades are still submitted by the browser's status call
+    result = check_challenge_completion(user_id, assignment_id, instance=instance)
+    if 'challenges' not in result or result.get('success') is False:
+        return
+
+    current_challenges = {'challenges': result['challenges'], 'completed': result['completed'], 'total': result['total']}
+    delta = challenge_delta(previous_challenges, current_challenges)
+    if delta and record_watched_state(key, entry, 'challenges', current_challenges):
+        publish(key, 'challenges', delta)
+
+def start_status_watcher(app):
+    """Start the background thread that checks all watched pairs"""
+    def watcher_thread_func():
+        while True:
+            with watched_lock:
+                keys = list(watched)
+
+            for key in keys:
+                try:
+                    with app.app_context():
+                        check_watched_status(key)
+                except Exception as e:
+                    app.logger.error(f"Error watching status for {key}: {str(e)}")
+
+            wake_watcher.wait(app.config['STATUS_WATCH_INTERVAL'])
+            wake_watcher.clear()
+
+    thread = threading.Thread(target=watcher_thread_func, daemon=True)
+    thread.start()
+    return thread
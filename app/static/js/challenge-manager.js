@@ -8,8 +8,14 @@ class ChallengeManager {
         this.instanceManager = instanceManager;
         this.challengesData = [];
         this.lastSubmittedScore = 0;
+        this.lastCompleted = undefined;
+        this.lastTotal = undefined;
         this.updateInterval = null;
         
+        // Progress versions (ETags) of the last list and status responses
+        this.listEtag = null;
+        this.statusEtag = null;
+        
         // Bind event handlers for challenge list
         this.bindChallengeEvents();
     }
@@ -48,7 +54,14 @@ class ChallengeManager {
         this.uiController.setChallengeListLoadingMessage('Loading challenges...');
         
         try {
-            const response = await fetch(`/api/challenge-list/${launchId}/${assignmentId}`);
+            const response = await this.fetchVersioned(`/api/challenge-list/${launchId}/${assignmentId}`, this.listEtag);
+            
+            // Unchanged since the last load, so redraw the list we already have
+            if (response.status === 304) {
+                this.uiController.displayChallengeList(this.challengesData);
+                this.uiController.updateProgress(this.lastCompleted, this.lastTotal);
+                return null;
+            }
             
             if (!response.ok) {
                 throw new Error('Failed to load challenges');
@@ -56,9 +69,12 @@ class ChallengeManager {
             
             const data = await response.json();
             console.log("Challenges loaded:", data);
+            this.listEtag = response.headers.get('ETag');
             
             // Store challenges data
             this.challengesData = data.challenges;
+            this.lastCompleted = data.completed;
+            this.lastTotal = data.total;
             
             // Update UI with challenges
             this.uiController.displayChallengeList(data.challenges);
@@ -72,6 +88,20 @@ class ChallengeManager {
         }
     }
     
+    /**
+     * Fetch a progress endpoint, sending the version we already have
+     * @param {string} url - Endpoint URL
+     * @param {string|null} etag - ETag of the last response from this endpoint
+     */
+    fetchVersioned(url, etag) {
+        // Bypass the browser cache so a 304 reaches us instead of being turned into a cached 200
+        const options = { cache: 'no-store', headers: {} };
+        if (etag) {
+            options.headers['If-None-Match'] = etag;
+        }
+        return fetch(url, options);
+    }
+    
     /**
      * Show challenge details in modal
      * @param {number} challengeId - ID of the challenge to show
@@ -112,7 +142,12 @@ class ChallengeManager {
         console.log('Checking challenge status...');
         
         try {
-            const response = await fetch(`/api/challenge-status/${launchId}/${userId}/${assignmentId}`);
+            const response = await this.fetchVersioned(`/api/challenge-status/${launchId}/${userId}/${assignmentId}`, this.statusEtag);
+            
+            // Nothing was solved and nothing changed since the last check
+            if (response.status === 304) {
+                return null;
+            }
             
             if (!response.ok) {
                 throw new Error(`Failed to update challenge status: ${response.status}`);
@@ -120,6 +155,7 @@ class ChallengeManager {
             
             const data = await response.json();
             console.log('Challenge status data:', data);
+            this.statusEtag = response.headers.get('ETag');
             
             // If this is the first time we're getting challenge data and the list is empty, populate it
             if (data.challenges && data.challenges.length > 0 && 
@@ -130,16 +166,31 @@ class ChallengeManager {
                 return;
             }
             
+            const previous = new Map(this.challengesData.map(c => [c.id, c]));
+            const sameChallenges = data.challenges.length === previous.size &&
+                data.challenges.every(c => previous.has(c.id));
+            
             // Update challenges data
             this.challengesData = data.challenges;
             
-            // Update progress
-            this.uiController.updateProgress(data.completed, data.total);
+            if (!sameChallenges) {
+                // The assignment's challenge set changed, so redraw the whole list
+                this.uiController.displayChallengeList(data.challenges);
+            } else {
+                // Only touch the challenges whose status actually changed
+                data.challenges.forEach(challenge => {
+                    if (previous.get(challenge.id).completed !== challenge.completed) {
+                        this.uiController.updateChallengeStatus(challenge);
+                    }
+                });
+            }
             
-            // Update individual challenge statuses
-            data.challenges.forEach(challenge => {
-                this.uiController.updateChallengeStatus(challenge);
-            });
+            // Update progress
+            if (data.completed !== this.lastCompleted || data.total !== this.lastTotal) {
+                this.uiController.updateProgress(data.completed, data.total);
+            }
+            this.lastCompleted = data.completed;
+            this.lastTotal = data.total;
             
             return data;
         } catch (error) {
@@ -148,6 +199,37 @@ class ChallengeManager {
         }
     }
     
+    /**
+     * Apply challenge status pushed over the status stream
+     * @param {Object} delta - Full challenge list or only the challenges that changed
+     */
+    applyChallengeDelta(delta) {
+        const previousCompleted = this.lastCompleted;
+        
+        if (delta.full) {
+            this.challengesData = delta.challenges;
+            this.uiController.displayChallengeList(delta.challenges);
+        } else {
+            delta.challenges.forEach(challenge => {
+                const index = this.challengesData.findIndex(c => c.id === challenge.id);
+                if (index >= 0) {
+                    this.challengesData[index] = challenge;
+                }
+                this.uiController.updateChallengeStatus(challenge);
+            });
+        }
+        
+        this.uiController.updateProgress(delta.completed, delta.total);
+        this.lastCompleted = delta.completed;
+        this.lastTotal = delta.total;
+        
+        // Progress changed, or this is the first status of the page (solves recorded while the
+        // tab was closed, e.g. by the background poller), so let the status call report it to the LMS
+        if (previousCompleted === undefined || previousCompleted !== delta.completed) {
+            this.updateChallengeStatus();
+        }
+    }
+    
     /**
      * Start periodic updates of challenge status
      * @param {number} interval - Update interval in milliseconds
@@ -158,8 +240,12 @@ class ChallengeManager {
             clearInterval(this.updateInterval);
         }
         
-        // Set new interval
-        this.updateInterval = setInterval(() => this.updateChallengeStatus(), interval);
+        // Set new interval; while the status stream is connected it pushes challenge status instead
+        this.updateInterval = setInterval(() => {
+            if (!this.instanceManager.statusStreamActive) {
+                this.updateChallengeStatus();
+            }
+        }, interval);
     }
     
     /**
@@ -2,11 +2,21 @@
  * Instance Manager - Handles Juice Shop instance operations
  */
 
+// Descriptions of the provisioning job states shown while an instance is created
+const JOB_STATE_MESSAGES = {
+    queued: 'Waiting for a free provisioning slot...',
+    pulling: 'Downloading the Juice Shop image...',
+    waiting: 'All lab slots are in use, waiting for one to free up...',
+    starting: 'Starting your Juice Shop instance...'
+};
+
 class InstanceManager {
     constructor(uiController) {
         this.uiController = uiController;
         this.instanceIsReady = false;
         this.currentInstanceUrl = null;
+        this.statusStreamActive = false;
+        this.currentJobId = null;
         
         // Bind event handlers to buttons
         this.bindEventHandlers();
@@ -54,30 +64,8 @@ class InstanceManager {
             
             const data = await response.json();
             
-            if (data.exists) {
-                // Store instance URL for other components to use
-                this.currentInstanceUrl = data.url;
-                
-                // Show existing instance info in UI
-                this.uiController.showInstanceExists(data);
-                
-                // Set instance status to ready
-                this.instanceIsReady = true;
-                
-                // Return data for other components to use
-                return data;
-            } else {
-                this.instanceIsReady = false;
-                this.currentInstanceUrl = null;
-                
-                // Show an appropriate message if we know the reason
-                if (data.reason === 'Container not running') {
-                    this.uiController.showError('Your container is no longer running. It may have been stopped or deleted. Please create a new instance.');
-                } else {
-                    this.uiController.showNoInstance();
-                }
-                return data;  // Return data even for non-existent instance for error handling
-            }
+            // Return data for other components to use, even for non-existent instance for error handling
+            return this.applyInstanceStatus(data);
         } catch (error) {
             console.error('Error checking instance status:', error);
             this.uiController.showError(error.message || 'Failed to check instance status');
@@ -87,6 +75,47 @@ class InstanceManager {
         }
     }
     
+    /**
+     * Update state and UI from instance status data
+     * Used for both polled responses and status pushed over the status stream
+     * @param {Object} data - Instance status data
+     * @returns {Object} The same instance data
+     */
+    applyInstanceStatus(data) {
+        if (data.exists) {
+            // Store instance URL for other components to use
+            this.currentInstanceUrl = data.url;
+            
+            // Show existing instance info in UI
+            this.uiController.showInstanceExists(data);
+            
+            // Set instance status to ready
+            this.instanceIsReady = true;
+        } else {
+            this.instanceIsReady = false;
+            this.currentInstanceUrl = null;
+            
+            // Show an appropriate message if we know the reason
+            if (data.reason === 'Instance is starting') {
+                this.uiController.showCreatingInstance();
+                this.uiController.setCreatingInstanceStatus('Waiting for Juice Shop to start...');
+            } else if (data.reason === 'Container not running') {
+                this.uiController.showError('Your container is no longer running. It may have been stopped or deleted. Please create a new instance.');
+            } else {
+                this.uiController.showNoInstance();
+            }
+        }
+        return data;
+    }
+    
+    /**
+     * Record whether the status stream is pushing instance updates; polling pauses while it is
+     * @param {boolean} active - Whether the stream is connected
+     */
+    setStatusStreamActive(active) {
+        this.statusStreamActive = active;
+    }
+    
     /**
      * Get instance status without changing UI state
      * Now with container verification
@@ -181,8 +210,8 @@ class InstanceManager {
             const data = await response.json();
             
             if (data.success) {
-                // Poll for instance status
-                setTimeout(() => this.checkInstanceStatus(), 5000);
+                // Follow the restart job until the new instance is up
+                this.followJob(data.job);
                 return data;
             } else {
                 this.uiController.showError(data.message || 'Failed to restart instance');
@@ -257,8 +286,8 @@ class InstanceManager {
             const data = await response.json();
             
             if (data.success) {
-                // Poll for instance status
-                this.pollInstanceCreation();
+                // Follow the creation job until the instance is up
+                this.followJob(data.job);
                 return data;
             } else {
                 this.uiController.showError(data.message || 'Failed to create instance');
@@ -272,33 +301,86 @@ class InstanceManager {
     }
     
     /**
-     * Poll instance status until ready
-     * Now with improved container verification
+     * Follow a create or restart job until it finishes
+     * The status stream pushes job updates as they happen; one poll also catches
+     * updates sent before this page knew the job ID, and polling takes over without the stream
+     * @param {Object} job - Job returned by the create or restart endpoint
      */
-    pollInstanceCreation() {
-        // Check status every 5 seconds until instance is ready
+    followJob(job) {
+        this.currentJobId = job.id;
+        this.applyJobStatus(job);
+        this.pollJobStatus(job.id);
+    }
+    
+    /**
+     * Update the UI from a provisioning job's state
+     * @param {Object} job - Job status data
+     */
+    applyJobStatus(job) {
+        // Ignore updates for jobs this page is not following
+        if (job.id !== this.currentJobId) {
+            return;
+        }
+        
+        if (job.state === 'healthy') {
+            this.currentJobId = null;
+            this.uiController.setCreatingInstanceStatus('');
+            this.checkInstanceStatus();
+        } else if (job.state === 'failed') {
+            this.currentJobId = null;
+            this.uiController.setCreatingInstanceStatus('');
+            this.uiController.showError(job.message || 'Failed to create instance');
+        } else {
+            this.uiController.showCreatingInstance();
+            this.uiController.setCreatingInstanceStatus(JOB_STATE_MESSAGES[job.state] || '');
+        }
+    }
+    
+    /**
+     * Poll a job's status until it finishes
+     * @param {string} jobId - ID of the job to poll
+     */
+    pollJobStatus(jobId) {
+        let polls = 0;
         const pollInterval = setInterval(async () => {
+            // Stop once the job finished or another job replaced it
+            if (this.currentJobId !== jobId) {
+                clearInterval(pollInterval);
+                return;
+            }
+            
+            // The connected status stream pushes job updates; only the first poll is still needed
+            // for updates sent before this page knew the job ID
+            polls += 1;
+            if (this.statusStreamActive && polls > 1) {
+                return;
+            }
+            
             try {
-                const data = await this.getInstanceStatus();
+                const response = await fetch(`/api/job-status/${launchId}/${userId}/${jobId}`);
                 
-                if (data && data.exists && data.status === 'running') {
-                    clearInterval(pollInterval);
-                    await this.checkInstanceStatus();
-                } else if (data && !data.exists && data.reason === 'Container not running') {
-                    // Container was created but isn't running anymore
+                if (response.status === 404) {
+                    // The job is gone, e.g. after a server restart
                     clearInterval(pollInterval);
-                    this.uiController.showContainerError('Container failed to start properly. Please try creating a new instance.');
+                    this.currentJobId = null;
+                    this.checkInstanceStatus();
+                    return;
                 }
+                
+                this.applyJobStatus(await response.json());
             } catch (error) {
-                console.error('Error polling instance status:', error);
+                console.error('Error polling job status:', error);
                 // Continue polling despite errors
             }
-        }, 5000);
+        }, 2000);
         
         // Set a timeout to stop polling after 5 minutes (to prevent infinite polling)
         setTimeout(() => {
             clearInterval(pollInterval);
-            this.checkInstanceStatus();
+            if (this.currentJobId === jobId) {
+                this.currentJobId = null;
+                this.checkInstanceStatus();
+            }
         }, 300000);
     }
     
@@ -12,13 +12,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize Challenge Manager
     const challengeManager = new ChallengeManager(uiController, instanceManager);
     
-    // Initial actions - check instance status first, as challenges depend on it
-    instanceManager.checkInstanceStatus();
-    
-    // Periodically check status
-    setInterval(() => instanceManager.checkInstanceStatus(), 30000); // Every 30 seconds
-    
-    // Start checking for challenges completion immediately, then periodically
-    challengeManager.updateChallengeStatus();
-    challengeManager.startPeriodicUpdates(5000); // Every 5 seconds
+    // Receive status updates from the server, falling back to polling
+    const statusStream = new StatusStream(instanceManager, challengeManager);
+    statusStream.start();
 });
\ No newline at end of file
@@ -0,0 +1,106 @@
+/**
+ * Status Stream - Receives instance and challenge status pushed by the server
+ * Falls back to periodic polling when Server-Sent Events are not available
+ */
+
+// Milliseconds before a failed status stream is opened again
+const STREAM_RETRY_INTERVAL = 60000;
+
+class StatusStream {
+    constructor(instanceManager, challengeManager) {
+        this.instanceManager = instanceManager;
+        this.challengeManager = challengeManager;
+        this.eventSource = null;
+        this.connected = false;
+        this.pollingStarted = false;
+    }
+    
+    /**
+     * Open the status stream, or start polling if it is not supported
+     */
+    start() {
+        if (this.eventSource) {
+            return;
+        }
+        
+        if (!window.EventSource) {
+            this.startPolling();
+            return;
+        }
+        
+        this.eventSource = new EventSource(`/api/status-stream/${launchId}/${userId}/${assignmentId}`);
+        
+        this.eventSource.addEventListener('open', () => {
+            this.connected = true;
+            this.instanceManager.setStatusStreamActive(true);
+        });
+        
+        this.eventSource.addEventListener('instance', (event) => {
+            const data = Utils.safeJsonParse(event.data);
+            if (data) {
+                this.instanceManager.applyInstanceStatus(data);
+            }
+        });
+        
+        this.eventSource.addEventListener('job', (event) => {
+            const data = Utils.safeJsonParse(event.data);
+            if (data) {
+                this.instanceManager.applyJobStatus(data);
+            }
+        });
+        
+        this.eventSource.addEventListener('challenges', (event) => {
+            const data = Utils.safeJsonParse(event.data);
+            if (data) {
+                this.challengeManager.applyChallengeDelta(data);
+            }
+        });
+        
+        this.eventSource.addEventListener('error', () => {
+            // EventSource reconnects on its own; only give up if the stream never opened or was closed for good
+            if (!this.connected || this.eventSource.readyState === EventSource.CLOSED) {
+                console.warn('Status stream unavailable, falling back to polling');
+                this.stop();
+                this.startPolling();
+                // Try the stream again later; polling pauses while it is connected
+                setTimeout(() => this.start(), STREAM_RETRY_INTERVAL);
+            }
+        });
+    }
+    
+    /**
+     * Close the status stream
+     */
+    stop() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+        this.connected = false;
+        this.instanceManager.setStatusStreamActive(false);
+    }
+    
+    /**
+     * Poll instance and challenge status periodically
+     */
+    startPolling() {
+        if (this.pollingStarted) {
+            return;
+        }
+        this.pollingStarted = true;
+        
+        // Initial actions - check instance status first, as challenges depend on it
+        this.instanceManager.checkInstanceStatus();
+        
+        // Periodically check status, unless the stream reconnected and pushes it
+        setInterval(() => {
+            if (!this.instanceManager.statusStreamActive) {
+                this.instanceManager.checkInstanceStatus();
+            }
+        }, 30000); // Every 30 seconds
+        
+        // Start checking for challenges completion immediately, then periodically
+        this.challengeManager.updateChallengeStatus();
+        this.challengeManager.startPeriodicUpdates(5000); // Every 5 seconds
+    }
+}
@@ -9,6 +9,7 @@ class UIController {
         this.instanceExistsSection = document.getElementById('instance-exists');
         this.noInstanceSection = document.getElementById('no-instance');
         this.creatingInstanceSection = document.getElementById('creating-instance');
+        this.creatingInstanceStatus = document.getElementById('creating-instance-status');
         this.errorMessageSection = document.getElementById('error-message');
         this.errorText = document.getElementById('error-text');
         
@@ -125,6 +126,16 @@ class UIController {
         this.showSection(this.creatingInstanceSection);
     }
     
+    /**
+     * Show the current provisioning step in the creating instance section
+     * @param {string} message - Step description
+     */
+    setCreatingInstanceStatus(message) {
+        if (this.creatingInstanceStatus) {
+            this.creatingInstanceStatus.textContent = message || '';
+        }
+    }
+    
     /**
      * Show error message section
      * @param {string} errorMessage - The error message to display
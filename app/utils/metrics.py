@@ -0,0 +1,209 @@
+"""
+Metrics in the Prometheus text exposition format
+
+Counters and histograms are kept in memory with a lock per metric, so recording
+a sample costs about a microsecond. Gauges are read from callbacks only when
+/metrics is scraped. Each process keeps its own metrics: with several WSGI
+worker processes every worker has to be scraped, or one worker run with them.
+
+Route durations are measured until the view returns its response, so for
+streamed responses they exclude the time spent streaming the body.
+"""
+import bisect
+import math
+import threading
+import time
+from flask import g, request
+
+# Latency buckets in seconds, from SQLite lookups to container starts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Metrics in the order they are rendered
+registry = []
+registry_lock = threading.Lock()
+
+def register(metric):
+    with registry_lock:
+        registry.append(metric)
+    return metric
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonically increasing count per label values"""
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        register(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [(self.name, self.labels, label_values, '', value) for label_values, value in items]
+
+class Histogram:
+    """Distribution of observed values per label values, e.g. durations in seconds"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self.series = {}
+        self.lock = threading.Lock()
+        register(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *label_values):
+        """Context manager that observes how long its block took"""
+        return timed(self, None, *label_values)
+
+    def samples(self):
+        with self.lock:
+            items = [(label_values, list(counts), total, count) for label_values, (counts, total, count) in self.series.items()]
+
+        samples = []
+        for label_values, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append((self.name + '_bucket', self.labels, label_values, f'le="{format_value(float(bound))}"', cumulative))
+            samples.append((self.name + '_sum', self.labels, label_values, '', total))
+            samples.append((self.name + '_count', self.labels, label_values, '', count))
+        return samples
+
+class CallbackMetric:
+    """Metric whose values are read when it is scraped; read returns [(label values, value)]"""
+    def __init__(self, name, documentation, metric_type, labels, read):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.labels = tuple(labels)
+        self.read = read
+        register(self)
+
+    def samples(self):
+        return [(self.name, self.labels, tuple(label_values), '', value) for label_values, value in self.read()]
+
+def gauge(name, documentation, labels=(), metric_type='gauge'):
+    """Decorator registering a function as the callback of a scraped metric"""
+    def decorator(read):
+        CallbackMetric(name, documentation, metric_type, labels, read)
+        return read
+    return decorator
+
+def render_metrics(logger=None):
+    """Render all metrics in the Prometheus text format"""
+    with registry_lock:
+        metrics = list(registry)
+
+    lines = []
+    for metric in metrics:
+        try:
+            samples = metric.samples()
+        except Exception as e:
+            # One broken gauge must not hide all other metrics
+            if logger:
+                logger.error(f"Error reading metric {metric.name}: {str(e)}")
+            continue
+
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+        for name, label_names, label_values, extra, value in sorted(samples, key=lambda sample: tuple(map(str, sample[2]))):
+            lines.append(f"{name}{format_labels(label_names, label_values, extra)} {format_value(value)}")
+
+    return '\n'.join(lines) + '\n'
+
+# Metrics recorded across the app
+http_request_seconds = Histogram('securelabs_http_request_duration_seconds',
+                                 'Time to handle a request, by endpoint, method and status',
+                                 ('endpoint', 'method', 'status'))
+docker_operation_seconds = Histogram('securelabs_docker_operation_duration_seconds',
+                                     'Time of container backend operations, by node and operation',
+                                     ('node', 'operation'))
+docker_operation_errors = Counter('securelabs_docker_operation_errors_total',
+                                  'Container backend operations that raised, by node and operation',
+                                  ('node', 'operation'))
+sqlite_query_seconds = Histogram('securelabs_sqlite_query_duration_seconds',
+                                 'Time of SQLite statements and commits, by statement type',
+                                 ('statement',))
+upstream_request_seconds = Histogram('securelabs_upstream_request_duration_seconds',
+                                     'Time of HTTP requests to Juice Shop containers, by target',
+                                     ('target',))
+upstream_request_errors = Counter('securelabs_upstream_request_errors_total',
+                                  'HTTP requests to Juice Shop containers that failed, e.g. on timeouts, by target',
+                                  ('target',))
+lti_operation_seconds = Histogram('securelabs_lti_operation_duration_seconds',
+                                  'Time of LTI launch validation, launch restores and calls to the platform, by operation',
+                                  ('operation',))
+lti_operation_errors = Counter('securelabs_lti_operation_errors_total',
+                               'LTI operations that raised, by operation',
+                               ('operation',))
+
+class timed:
+    """Time a block in a histogram and, if errors is given, count it there when it raises"""
+    __slots__ = ('histogram', 'errors', 'label_values', 'started')
+
+    def __init__(self, histogram, errors, *label_values):
+        self.histogram = histogram
+        self.errors = errors
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(*self.label_values)
+        return False
+
+def register_request_metrics(app):
+    """Time every request handled by the app"""
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_duration(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            # Unmatched URLs share one label so random paths cannot create new series
+            http_request_seconds.observe(time.perf_counter() - started, request.endpoint or 'unmatched',
+                                         request.method, str(response.status_code))
+        return response
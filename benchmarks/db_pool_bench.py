@@ -0,0 +1,126 @@
+"""
+Status-poll throughput with and without the pooled SQLite connections
+
+Each poll runs the model calls behind /api/challenge-status: the student's
+instance, the assignment's challenges and the student's solves. A writer thread
+updates last access times meanwhile, like the activity tracker and cleanup
+thread do. The "unpooled" mode reproduces the previous setup: a new connection
+for every model call and the rollback journal instead of WAL.
+
+    python benchmarks/db_pool_bench.py [--unpooled] [--no-writer] [--seconds 3] [--threads 1 8]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from flask import Flask
+from config import config
+import models.challenge
+import models.instance
+from models.database import connection_pools, init_db, release_db_connection
+from models.challenge import get_assigned_challenges, get_user_solved_challenges, save_assigned_challenges
+from models.instance import get_user_instance, save_instance, touch_instance
+from services.container_backends import get_container_backend
+
+USERS = 50
+
+def create_app(db_path):
+    app = Flask(__name__)
+    app.config.from_mapping(config)
+    # Every poll writes the instance's last access, as every poll did before pooling
+    app.config.update(DB_PATH=db_path, DOCKER_BACKEND='fake', ACTIVITY_WRITE_INTERVAL=0)
+    init_db(db_path)
+    app.teardown_appcontext(release_db_connection)
+    return app
+
+def use_unpooled_connections(db_path):
+    """Open a new rollback-journal connection for every model call, as before pooling"""
+    # Pooled connections would keep the database in WAL mode
+    for pool in connection_pools.values():
+        while not pool.empty():
+            pool.get_nowait().close_for_real()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+    def get_db_connection():
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    for module in (models.instance, models.challenge):
+        module.get_db_connection = get_db_connection
+
+def poll(app, user_id):
+    with app.app_context():
+        get_user_instance(user_id)
+        get_assigned_challenges('as1')
+        get_user_solved_challenges(user_id, 'as1')
+
+def run(app, threads, seconds, with_writer=True):
+    """Return the status polls per second of the given number of polling threads"""
+    stop = time.monotonic() + seconds
+    counts = []
+    lock = threading.Lock()
+
+    def poller(index):
+        polls = 0
+        while time.monotonic() < stop:
+            poll(app, f'u{(index * 7 + polls) % USERS}')
+            polls += 1
+        with lock:
+            counts.append(polls)
+
+    def writer():
+        instance_id = 1
+        while time.monotonic() < stop:
+            with app.app_context():
+                touch_instance(instance_id)
+            instance_id = instance_id % USERS + 1
+            time.sleep(0.001)
+
+    workers = [threading.Thread(target=poller, args=(i,)) for i in range(threads)]
+    if with_writer:
+        workers.append(threading.Thread(target=writer))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--unpooled', action='store_true', help="measure the previous connection handling")
+    parser.add_argument('--no-writer', action='store_true', help="poll without the concurrent writer thread")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = create_app(db_path)
+    with app.app_context():
+        backend = get_container_backend()
+        for user in range(USERS):
+            container_id = backend.run_container(f'juice_shop_u{user}', 'img')
+            save_instance(f'u{user}', container_id, 3001 + user, 'running', 'as1', node='local')
+        save_assigned_challenges('as1', [{'id': i, 'name': f'c{i}'} for i in range(10)])
+
+    if args.unpooled:
+        use_unpooled_connections(db_path)
+
+    mode = 'unpooled, rollback journal' if args.unpooled else 'pooled, WAL'
+    if args.no_writer:
+        mode += ', no writer'
+    for threads in args.threads:
+        polls_per_second = run(app, threads, args.seconds, with_writer=not args.no_writer)
+        print(f"{mode}: {threads} polling thread(s): {polls_per_second:.0f} status polls/s")
+
+if __name__ == '__main__':
+    main()
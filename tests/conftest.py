@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from config import config
+from models.database import init_db, release_db_connection
+import services.activity
+import services.capacity
+import services.challenge_service
+import services.container_backends
+import services.container_state
+import services.nodes
+import services.port_allocator
+
+def reset_process_state():
+    """Forget the per-process registries, caches and backends a previous test built"""
+    services.nodes.nodes = None
+    services.port_allocator.port_allocators.clear()
+    services.container_backends.container_backends.clear()
+    services.container_state.container_states.clear()
+    services.container_state.snapshot_taken_at.clear()
+    services.activity.last_written.clear()
+    services.capacity.admissions_in_flight.clear()
+    services.capacity.host_capacities.clear()
+    services.challenge_service.challenge_polls.clear()
+
+@pytest.fixture
+def app(tmp_path):
+    """App with a fresh database and the fake container backend, without starting any background thread"""
+    app = Flask(__name__)
+    app.config.from_mapping(config)
+    app.config.update(DB_PATH=str(tmp_path / 'test.db'), DOCKER_BACKEND='fake', PORT_CHECK_HOST=False)
+    init_db(app.config['DB_PATH'])
+    app.teardown_appcontext(release_db_connection)
+
+    reset_process_state()
+    yield app
+    reset_process_state()
@@ -0,0 +1,184 @@
+import socketserver
+import threading
+import time
+import pytest
+from flask import Flask
+from flask_caching import Cache
+
+from services.cache_backends import PRUNE_EVERY, get_cache_type
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Answers the RESP commands RedisCache sends, from a dict shared by all connections"""
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b"_\r\n" if self.proto == 3 else b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, bytes):
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+        elif isinstance(value, dict):
+            # RESP3 map, only sent to clients that asked for RESP3 in HELLO
+            self.wfile.write(b"%%%d\r\n" % len(value))
+            for key, item in value.items():
+                self.reply(key)
+                self.reply(item)
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self.reply(item)
+        else:
+            self.wfile.write(f"{value}\r\n".encode())
+
+    def live(self, key):
+        value, expires = self.server.data.get(key, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            self.server.data.pop(key, None)
+            return None
+        return value
+
+    def handle(self):
+        data = self.server.data
+        self.proto = 2
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command, args = args[0].decode().upper(), args[1:]
+            with self.server.lock:
+                if command == 'PING':
+                    self.reply('+PONG')
+                elif command == 'HELLO':
+                    # Connection handshake that picks RESP2 or RESP3 replies
+                    self.proto = int(args[0]) if args else 2
+                    info = {b'server': b'redis', b'version': b'7.2.0', b'proto': self.proto}
+                    self.reply(info if self.proto == 3 else [item for pair in info.items() for item in pair])
+                elif command in ('CLIENT', 'SELECT', 'FLUSHDB'):
+                    if command == 'FLUSHDB':
+                        data.clear()
+                    self.reply('+OK')
+                elif command == 'GET':
+                    self.reply(self.live(args[0]))
+                elif command == 'SET':
+                    options = [arg.decode().upper() for arg in args[2:]]
+                    expires = time.monotonic() + int(options[options.index('EX') + 1]) if 'EX' in options else None
+                    data[args[0]] = (args[1], expires)
+                    self.reply('+OK')
+                elif command == 'SETNX':
+                    created = self.live(args[0]) is None
+                    if created:
+                        data[args[0]] = (args[1], None)
+                    self.reply(int(created))
+                elif command == 'EXPIRE':
+                    value = self.live(args[0])
+                    if value is not None:
+                        data[args[0]] = (value, time.monotonic() + int(args[1]))
+                    self.reply(int(value is not None))
+                elif command in ('DEL', 'UNLINK', 'EXISTS'):
+                    found = [key for key in args if self.live(key) is not None]
+                    if command != 'EXISTS':
+                        for key in found:
+                            del data[key]
+                    self.reply(len(found))
+                else:
+                    self.reply(f"-ERR unknown command '{command}'")
+            self.wfile.flush()
+
+@pytest.fixture
+def fake_redis():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}/0"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(params=['sqlite', 'shm', 'redis'])
+def make_cache(request, tmp_path):
+    """Build caches of one backend that share their storage, the way worker processes do"""
+    config = {
+        'CACHE_BACKEND': request.param,
+        'CACHE_DEFAULT_TIMEOUT': 600,
+        'CACHE_THRESHOLD': 10000,
+        'CACHE_SQLITE_PATH': str(tmp_path / 'cache.db'),
+        'CACHE_SHM_PATH': str(tmp_path / 'shm' / 'cache.db')
+    }
+    (tmp_path / 'shm').mkdir()
+    if request.param == 'redis':
+        pytest.importorskip('redis')
+        config['CACHE_REDIS_URL'] = request.getfixturevalue('fake_redis')
+
+    def make_cache(**overrides):
+        app = Flask(__name__)
+        app.config.update(config, **overrides)
+        app.config['CACHE_TYPE'] = get_cache_type(app.config)
+        return Cache(app)
+
+    return make_cache
+
+def test_get_set_add_delete(make_cache):
+    cache = make_cache()
+
+    assert cache.get('launch') is None
+    assert cache.set('launch', {'user': 'alice'})
+    assert cache.get('launch') == {'user': 'alice'}
+    assert cache.has('launch')
+
+    assert not cache.add('launch', {'user': 'bob'})
+    assert cache.get('launch') == {'user': 'alice'}
+    assert cache.add('nonce', 'n-1')
+    assert cache.get('nonce') == 'n-1'
+
+    assert cache.delete('launch')
+    assert cache.get('launch') is None
+    assert not cache.has('launch')
+
+def test_entries_expire(make_cache):
+    cache = make_cache()
+    cache.set('short', 1, timeout=1)
+    cache.set('long', 2, timeout=60)
+    cache.set('forever', 3, timeout=0)
+
+    time.sleep(1.1)
+    assert cache.get('short') is None
+    assert cache.get('long') == 2
+    assert cache.get('forever') == 3
+    # An expired key can be added again
+    assert cache.add('short', 4)
+    assert cache.get('short') == 4
+
+def test_caches_on_the_same_storage_share_entries(make_cache):
+    first, second = make_cache(), make_cache()
+
+    first.set('launch', 'from first worker')
+    assert second.get('launch') == 'from first worker'
+    assert not second.add('launch', 'from second worker')
+
+    second.delete('launch')
+    assert first.get('launch') is None
+
+def test_entries_beyond_the_threshold_are_evicted(make_cache, request):
+    if request.node.callspec.params['make_cache'] == 'redis':
+        pytest.skip("Redis evicts by its own maxmemory-policy")
+    cache = make_cache(CACHE_THRESHOLD=10)
+
+    cache.set('forever', 'kept', timeout=0)
+    for i in range(PRUNE_EVERY - 1):
+        cache.set(f"key{i}", i, timeout=60 + i)
+
+    # Soonest-expiring entries go first, entries without an expiry last
+    assert cache.get('forever') == 'kept'
+    assert cache.get('key0') is None
+    assert cache.get(f"key{PRUNE_EVERY - 2}") == PRUNE_EVERY - 2
+    assert sum(cache.has(f"key{i}") for i in range(PRUNE_EVERY - 1)) == 9
@@ -0,0 +1,23 @@
+import time
+import pytest
+
+from routes.challenge_routes import challenge_bp
+from services import launch_context, solve_poller
+from services.launch_context import LaunchContext
+
+LAUNCH = LaunchContext('launch', 'alice', 'assignment', False, False, None, None, None)
+
+@pytest.fixture
+def client(app):
+    app.register_blueprint(challenge_bp)
+    launch_context.launch_contexts['launch'] = (time.monotonic(), LAUNCH)
+    yield app.test_client()
+    launch_context.launch_contexts.clear()
+
+@pytest.mark.parametrize('poller_running,status', [(True, 304), (False, 200)])
+def test_challenge_list_is_only_revalidated_while_the_poller_records_solves(client, monkeypatch, poller_running, status):
+    monkeypatch.setattr(solve_poller, 'solve_poller_running', poller_running)
+
+    etag = client.get('/api/challenge-list/launch/assignment').headers['ETag']
+    response = client.get('/api/challenge-list/launch/assignment', headers={'If-None-Match': etag})
+    assert response.status_code == status
@@ -0,0 +1,94 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+
+from services.container_backends import ContainerBackendError, EngineAPIBackend
+
+PULL_PROGRESS = [{'status': 'Pulling from bkimminich/juice-shop', 'id': 'latest'},
+                 {'status': 'Downloading', 'progressDetail': {'current': 1, 'total': 2}, 'id': 'a1b2'}]
+
+def engine_answering_pull(entries):
+    """Start a Docker Engine API stand-in that answers every image pull with 200 and the given progress stream"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = ''.join(json.dumps(entry) + '\r\n' for entry in entries).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@pytest.fixture
+def engine():
+    servers = []
+
+    def start(entries):
+        server = engine_answering_pull(entries)
+        servers.append(server)
+        return EngineAPIBackend(f"tcp://127.0.0.1:{server.server_address[1]}", timeout=5)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+def test_pull_succeeds_when_the_stream_has_no_error(engine):
+    engine(PULL_PROGRESS + [{'status': 'Status: Downloaded newer image for bkimminich/juice-shop:latest'}]).pull_image('bkimminich/juice-shop')
+
+@pytest.mark.parametrize('failure', [
+    {'errorDetail': {'message': 'manifest unknown'}, 'error': 'manifest unknown'},
+    {'errorDetail': {'message': 'manifest unknown'}}
+])
+def test_pull_raises_on_an_error_in_the_stream(engine, failure):
+    with pytest.raises(ContainerBackendError, match='manifest unknown'):
+        engine(PULL_PROGRESS + [failure]).pull_image('bkimminich/juice-shop:nope')
+
+def test_pull_raises_on_a_single_error_entry(engine):
+    with pytest.raises(ContainerBackendError, match='denied'):
+        engine([{'error': 'pull access denied'}]).pull_image('private/image')
+
+def engine_dropping_requests():
+    """Start an Engine API stand-in that keeps connections alive but drops any request to /drop unanswered"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def answer(self):
+            self.server.requests.append((self.command, self.path))
+            if self.path == '/drop':
+                self.close_connection = True
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        do_GET = do_POST = do_DELETE = answer
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@pytest.mark.parametrize('method,attempts', [('GET', 2), ('DELETE', 2), ('POST', 1)])
+def test_only_idempotent_requests_are_retried_after_reaching_the_daemon(method, attempts):
+    server = engine_dropping_requests()
+    backend = EngineAPIBackend(f"tcp://127.0.0.1:{server.server_address[1]}", timeout=5)
+    try:
+        # Leaves a kept-alive connection in the pool
+        assert backend._request('GET', '/ping') == (200, {})
+
+        with pytest.raises(ContainerBackendError):
+            backend._request(method, '/drop')
+        assert server.requests[1:] == [(method, '/drop')] * attempts
+    finally:
+        server.shutdown()
@@ -0,0 +1,97 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models.database import get_db_connection
+from models.instance import save_instance, get_user_instance, claim_pooled_instance as claim_pooled_instance_row
+from services import pool_service
+from services.challenge_service import challenge_polls, prune_challenge_polls, record_challenge_poll
+from services.container_backends import get_container_backend
+from services.docker_service import create_docker_instance, shutdown_user_instance
+from services.pool_service import POOL_USER_ID, claim_pooled_instance
+
+def instance_status(instance_id):
+    return get_db_connection().execute("SELECT status FROM instances WHERE id=?", (instance_id,)).fetchone()[0]
+
+def start_suspended_instance(user_id):
+    backend = get_container_backend()
+    container_id = backend.run_container(f'juice_shop_{user_id}', 'img')
+    backend.pause_container(container_id)
+    return backend, container_id, save_instance(user_id, container_id, None, 'suspended', node='local')
+
+def test_suspended_instance_is_resumed(app):
+    with app.app_context():
+        backend, container_id, instance_id = start_suspended_instance('alice')
+
+        assert get_user_instance('alice')['exists']
+        assert instance_status(instance_id) == 'running'
+        assert not backend.containers[container_id]['paused']
+
+def test_instance_that_cannot_be_resumed_stays_suspended(app):
+    with app.app_context():
+        backend, container_id, instance_id = start_suspended_instance('alice')
+        backend.unpause_container = lambda container_id: False
+
+        instance = get_user_instance('alice')
+        assert not instance['exists']
+        assert instance['reason'] == 'Instance could not be resumed'
+        assert instance_status(instance_id) == 'suspended'
+
+def test_suspended_instance_whose_container_is_gone_is_stopped(app):
+    with app.app_context():
+        backend, container_id, instance_id = start_suspended_instance('alice')
+        backend.remove_container(container_id)
+
+        assert not get_user_instance('alice')['exists']
+        assert instance_status(instance_id) == 'stopped'
+
+def test_pooled_instance_is_claimed_inside_an_open_transaction(app):
+    with app.app_context():
+        instance_id = save_instance(POOL_USER_ID, 'c1', 3001, 'pooled', node='local')
+        conn = get_db_connection()
+        # Left open on the leased connection by earlier work in the same request
+        conn.execute("BEGIN")
+        conn.execute("UPDATE instances SET container_id='half-finished' WHERE id=?", (instance_id,))
+
+        instance = claim_pooled_instance_row('alice')
+        assert instance['id'] == instance_id
+        assert not conn.in_transaction
+        assert instance_status(instance_id) == 'starting'
+        # The stray change is rolled back rather than committed along with the claim
+        assert instance['container_id'] == 'c1'
+        assert conn.execute("SELECT container_id FROM instances WHERE id=?", (instance_id,)).fetchone()[0] == 'c1'
+
+def test_concurrent_claims_are_all_counted(app):
+    with app.app_context():
+        backend = get_container_backend()
+        for i in range(40):
+            save_instance(POOL_USER_ID, backend.run_container(f'pool_{i}', 'img'), 3001 + i, 'pooled', node='local')
+
+    def claim(user_id):
+        with app.app_context():
+            return claim_pooled_instance(user_id)
+
+    pool_service.claims_since_refill = 0
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        claimed = list(executor.map(claim, [f'user{i}' for i in range(40)]))
+
+    assert all(claimed)
+    assert pool_service.claims_since_refill == 40
+
+def test_challenge_poll_is_forgotten_on_shutdown(app):
+    with app.app_context():
+        created = create_docker_instance('alice')
+        record_challenge_poll('alice', created['container_id'], [{'id': 1, 'solved': True}])
+
+        assert shutdown_user_instance('alice')['success']
+        assert 'alice' not in challenge_polls
+
+def test_challenge_polls_too_old_to_reuse_are_pruned(app):
+    app.config.update(CHALLENGE_POLL_TTL=4, SOLVE_POLL_ACTIVE_INTERVAL=5)
+    with app.app_context():
+        record_challenge_poll('alice', 'c1', [])
+        record_challenge_poll('bob', 'c2', [])
+        # Alice's instance expired long ago; nobody will look at her last poll again
+        challenge_polls['alice'] = ('c1', time.monotonic() - 11, [])
+
+        assert prune_challenge_polls() == 1
+        assert list(challenge_polls) == ['bob']
@@ -0,0 +1,65 @@
+import sqlite3
+import pytest
+
+from models import migrations
+from models.migrations import MIGRATIONS, INDEXED_QUERIES, run_migrations, check_query_plans, get_schema_version
+
+# Hot query -> index its plan has to use
+EXPECTED_INDEXES = {
+    'get_user_instance': 'idx_instances_user_status',
+    'get_reserved_ports': 'sqlite_autoindex_port_reservations_1',
+    'count_active_instances_by_node': 'idx_instances_status_port',
+    'count_instances_by_status': 'idx_instances_status_port',
+    'get_running_instances': 'idx_instances_status_port',
+    'claim_pooled_instance': 'idx_instances_status_port',
+    'get_unready_instances': 'idx_instances_status_port',
+    'get_idle_instances': 'idx_instances_status_accessed',
+    'get_expired_instances': 'idx_instances_status_accessed',
+    'get_proxy_route': 'idx_instances_proxy_token',
+    'get_queued_grade': 'sqlite_autoindex_grade_outbox_1',
+    'get_due_grades': 'idx_grade_outbox_status_next',
+    'get_progress_version': 'sqlite_autoindex_progress_versions_1',
+    'get_user_solved_challenges': 'idx_solved_user_assignment',
+    'get_assigned_challenges': 'sqlite_autoindex_assignment_challenges_1',
+    'get_provisioning_job': 'sqlite_autoindex_provisioning_jobs_1',
+    'get_unfinished_job': 'idx_provisioning_jobs_unfinished',
+    'delete_finished_jobs': 'idx_provisioning_jobs_state_updated'
+}
+
+def migrated_connection(migrations_to_apply=MIGRATIONS):
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    saved = migrations.MIGRATIONS
+    migrations.MIGRATIONS = migrations_to_apply
+    try:
+        run_migrations(conn)
+    finally:
+        migrations.MIGRATIONS = saved
+    return conn
+
+def test_every_hot_query_has_an_expected_index():
+    assert sorted(EXPECTED_INDEXES) == sorted(name for name, _, _ in INDEXED_QUERIES)
+
+@pytest.mark.parametrize('name,query,params', INDEXED_QUERIES, ids=[name for name, _, _ in INDEXED_QUERIES])
+def test_query_plan_uses_its_index(name, query, params):
+    conn = migrated_connection()
+    steps = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+    table_steps = [step for step in steps if step.startswith(('SEARCH ', 'SCAN '))]
+
+    assert table_steps
+    for step in table_steps:
+        assert step.startswith('SEARCH '), step
+        assert f"INDEX {EXPECTED_INDEXES[name]} " in step, step
+
+@pytest.mark.parametrize('version', [version for version, _, _ in MIGRATIONS])
+def test_upgrade_from_each_version_keeps_query_plans(version):
+    # A database created at an older version reaches the same schema and plans as a new one
+    conn = migrated_connection([migration for migration in MIGRATIONS if migration[0] <= version])
+    assert get_schema_version(conn) == version
+
+    applied = run_migrations(conn)
+    assert [applied_version for applied_version, _ in applied] == [v for v, _, _ in MIGRATIONS if v > version]
+    assert get_schema_version(conn) == MIGRATIONS[-1][0]
+    assert check_query_plans(conn) == []
+
+def test_migrations_are_numbered_in_order():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+from models.database import get_db_connection
+from models.instance import get_reserved_ports
+from services import capacity
+from services.capacity import reserve_capacity
+from services.container_backends import get_container_backend
+from services.docker_service import create_docker_instance
+from services.port_allocator import allocate_port
+
+# Two fake daemons with the same port range: 2 slots on "small", 4 on "large"
+NODES = [
+    {'name': 'small', 'backend': 'fake', 'host_ip': '10.0.0.1', 'memory_mb': 1024, 'cpus': 2,
+     'port_range_start': 4001, 'port_range_end': 4005},
+    {'name': 'large', 'backend': 'fake', 'host_ip': '10.0.0.2', 'memory_mb': 2048, 'cpus': 4,
+     'port_range_start': 4001, 'port_range_end': 4005}
+]
+
+@pytest.fixture
+def two_nodes(app):
+    app.config.update(DOCKER_NODES=NODES, POOL_ENABLED=False, CONTAINER_MEMORY_MB=512, CONTAINER_CPUS=1.0,
+                      ADMISSION_RESERVED_MEMORY_MB=0, ADMISSION_MEMORY_OVERCOMMIT=1.0, ADMISSION_CPU_OVERCOMMIT=1.0,
+                      ADMISSION_WAIT_SECONDS=0)
+    return app
+
+def instance_node(instance_id):
+    return get_db_connection().execute("SELECT node FROM instances WHERE id=?", (instance_id,)).fetchone()[0]
+
+@pytest.mark.parametrize('policy,placement', [
+    # Ties go to the node configured first
+    ('least-loaded', ['small', 'large', 'large', 'small', 'large', 'large']),
+    ('bin-packing', ['small', 'small', 'large', 'large', 'large', 'large'])
+])
+def test_placement_until_every_node_is_full(two_nodes, policy, placement):
+    two_nodes.config['PLACEMENT_POLICY'] = policy
+
+    with two_nodes.app_context():
+        results = [create_docker_instance(f"user{i}") for i in range(len(placement))]
+        assert all(result['success'] for result in results)
+        assert [instance_node(result['instance_id']) for result in results] == placement
+
+        # The instance runs on the daemon of the node it was placed on, at that node's host IP
+        for result, node in zip(results, placement):
+            assert result['container_id'] in get_container_backend(node).containers
+            assert result['url'].startswith(f"http://{NODES[0 if node == 'small' else 1]['host_ip']}:")
+
+        full = create_docker_instance('one_too_many')
+        assert not full['success']
+        assert full['capacity_full']
+
+def test_port_reservations_are_per_node(two_nodes):
+    with two_nodes.app_context():
+        small_ports = {allocate_port('small') for _ in range(5)}
+        with pytest.raises(Exception, match="No available ports"):
+            allocate_port('small')
+
+        # The same port numbers are still free on the other node's host
+        large_ports = {allocate_port('large') for _ in range(5)}
+        assert small_ports == large_ports == set(range(4001, 4006))
+        assert get_reserved_ports('small') == get_reserved_ports('large') == small_ports
+
+def test_concurrent_reservations_take_each_slot_once(two_nodes, monkeypatch):
+    count_active_instances_by_node = capacity.count_active_instances_by_node
+
+    def slow_count():
+        # The snapshot is taken without holding the admission lock, so it must not be trusted blindly
+        assert not capacity.admission_lock.locked()
+        time.sleep(0.01)
+        return count_active_instances_by_node()
+
+    monkeypatch.setattr(capacity, 'count_active_instances_by_node', slow_count)
+
+    def reserve(_):
+        with two_nodes.app_context():
+            return reserve_capacity()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        nodes = list(executor.map(reserve, range(10)))
+
+    assert sorted(node for node in nodes if node) == ['large'] * 4 + ['small'] * 2
+    assert nodes.count(None) == 4
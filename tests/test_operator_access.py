@@ -0,0 +1,43 @@
+import pytest
+
+from routes.instance_routes import instance_bp
+from routes.lti_routes import lti_bp
+from routes.metrics_routes import metrics_bp
+
+OPERATOR_ROUTES = ['/api/capacity', '/api/lti-cache-stats', '/metrics']
+
+@pytest.fixture
+def client(app):
+    app.register_blueprint(instance_bp)
+    app.register_blueprint(lti_bp)
+    app.register_blueprint(metrics_bp)
+    return app.test_client()
+
+@pytest.mark.parametrize('path', OPERATOR_ROUTES)
+def test_operator_routes_are_closed_by_default(client, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer '}).status_code == 403
+
+@pytest.mark.parametrize('path', OPERATOR_ROUTES)
+def test_operator_routes_accept_the_token(app, client, path):
+    app.config['OPERATOR_TOKEN'] = 'secret'
+
+    assert client.get(path, headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+def test_operator_token(app, client):
+    app.config['OPERATOR_TOKEN'] = 'secret'
+
+    assert client.get('/api/capacity', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/api/capacity', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert 'nodes' in response.get_json()
+
+@pytest.mark.parametrize('allowed,status', [
+    (['127.0.0.1'], 200),
+    (['127.0.0.0/8'], 200),
+    (['10.0.0.0/8', '::1'], 403)
+])
+def test_operator_allowed_ips(app, client, allowed, status):
+    app.config['OPERATOR_ALLOWED_IPS'] = allowed
+
+    assert client.get('/api/capacity', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == status
@@ -0,0 +1,86 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import pytest
+
+from models.database import get_db_connection
+from models.instance import get_reserved_ports, save_instance
+from services.port_allocator import PortAllocator, allocate_port, release_port, get_port_allocator, sync_reservations
+
+def allocate_many(app, count, allocator=None):
+    with app.app_context():
+        return [allocator.allocate() if allocator else allocate_port() for _ in range(count)]
+
+def test_parallel_allocations_are_unique(app):
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        batches = list(executor.map(lambda _: allocate_many(app, 30), range(16)))
+
+    ports = [port for batch in batches for port in batch]
+    assert len(ports) == len(set(ports)) == 480
+    with app.app_context():
+        assert get_reserved_ports('local') == set(ports)
+        assert get_port_allocator().free_count() == 999 - 480
+
+def test_allocators_of_different_processes_never_share_a_port(app):
+    # Each worker process has its own free list; only the database reservation is shared
+    with app.app_context():
+        allocators = [PortAllocator('local', 3001, 3200) for _ in range(4)]
+        for allocator in allocators:
+            allocator.load()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        batches = list(executor.map(lambda i: allocate_many(app, 25, allocators[i % 4]), range(8)))
+
+    ports = [port for batch in batches for port in batch]
+    assert len(ports) == len(set(ports)) == 200
+
+def allocate_in_child(app, count, results):
+    import services.port_allocator
+    services.port_allocator.port_allocators.clear()
+    results.put(allocate_many(app, count))
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_parallel_allocations_across_processes_are_unique(app):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    children = [context.Process(target=allocate_in_child, args=(app, 40, results)) for _ in range(6)]
+    for child in children:
+        child.start()
+    ports = [port for _ in children for port in results.get(timeout=60)]
+    for child in children:
+        child.join(timeout=60)
+
+    assert len(ports) == len(set(ports)) == 240
+
+def test_exhausted_range_and_release_by_another_process(app):
+    app.config.update(PORT_RANGE_START=3001, PORT_RANGE_END=3010)
+    with app.app_context():
+        ports = [allocate_port() for _ in range(10)]
+        with pytest.raises(Exception, match="No available ports"):
+            allocate_port()
+
+        # A port released by another process is found once this one reloads its empty free list
+        other = PortAllocator('local', 3001, 3010)
+        other.release(ports[0])
+        assert allocate_port() == ports[0]
+
+def test_release_keeps_ports_of_active_instances(app):
+    with app.app_context():
+        port = allocate_port()
+        save_instance('alice', 'c1', port, 'running', node='local')
+        release_port(port)
+        assert port in get_reserved_ports('local')
+
+def test_stale_reservations_are_reclaimed(app):
+    with app.app_context():
+        conn = get_db_connection()
+        old = (datetime.now() - timedelta(hours=1)).isoformat()
+        conn.execute("INSERT INTO port_reservations (node, port, reserved_at) VALUES ('local', 3001, ?)", (old,))
+        conn.execute("INSERT INTO port_reservations (node, port, reserved_at) VALUES ('local', 3002, ?)", (old,))
+        conn.commit()
+        # Legacy rows without a node belong to the first node
+        save_instance('alice', 'c1', 3002, 'running')
+        save_instance('bob', 'c2', 3003, 'suspended')
+
+        sync_reservations()
+        assert get_reserved_ports('local') == {3002, 3003}
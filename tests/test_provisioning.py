@@ -0,0 +1,92 @@
+import time
+import pytest
+
+from models.database import get_db_connection
+from models.job import get_provisioning_job, insert_provisioning_job, fail_stale_jobs, start_provisioning_job
+from services.provisioning import submit_provisioning_job, run_provisioning_job
+
+def wait_for_job(app, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with app.app_context():
+            job = get_provisioning_job(job_id)
+        if job['state'] in ('healthy', 'failed'):
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"Job {job_id} did not finish")
+
+def queue_job_of_another_process(user_id, updated_at):
+    job = {'id': 'other', 'kind': 'create', 'user_id': user_id, 'assignment_id': None, 'state': 'starting',
+           'message': None, 'result': None, 'created_at': updated_at, 'updated_at': updated_at}
+    assert insert_provisioning_job(job)
+    return job
+
+def test_job_runs_to_healthy_and_is_stored(app):
+    with app.app_context():
+        job, created = submit_provisioning_job('create', 'alice', 'assignment')
+    assert created
+
+    job = wait_for_job(app, job['id'])
+    assert job['state'] == 'healthy'
+    assert job['result']['success']
+
+def test_unfinished_job_of_another_process_is_shared(app):
+    with app.app_context():
+        other = queue_job_of_another_process('alice', time.time())
+
+        job, created = submit_provisioning_job('restart', 'alice')
+        assert not created
+        assert job['id'] == other['id']
+        # Another user is not held up
+        job, created = submit_provisioning_job('create', 'bob')
+        assert created
+    wait_for_job(app, job['id'])
+
+def test_stale_job_is_failed_and_replaced(app):
+    with app.app_context():
+        queue_job_of_another_process('alice', time.time() - app.config['PROVISION_JOB_STALE_AFTER'] - 1)
+
+        job, created = submit_provisioning_job('create', 'alice')
+        assert created
+        assert get_provisioning_job('other')['state'] == 'failed'
+    wait_for_job(app, job['id'])
+
+def test_finished_jobs_are_pruned(app):
+    with app.app_context():
+        job, _ = submit_provisioning_job('create', 'alice')
+    wait_for_job(app, job['id'])
+
+    with app.app_context():
+        old = time.time() - app.config['PROVISION_JOB_TTL'] - 1
+        conn = get_db_connection()
+        conn.execute("UPDATE provisioning_jobs SET updated_at=? WHERE id=?", (old, job['id']))
+        conn.commit()
+
+        other, _ = submit_provisioning_job('create', 'bob')
+        assert get_provisioning_job(job['id']) is None
+    wait_for_job(app, other['id'])
+
+def test_job_failed_while_queued_is_skipped_by_the_worker(app):
+    with app.app_context():
+        now = time.time()
+        queued = {'id': 'queued', 'kind': 'create', 'user_id': 'alice', 'assignment_id': None, 'state': 'queued',
+                  'message': None, 'result': None, 'created_at': now, 'updated_at': now}
+        assert insert_provisioning_job(queued)
+        fail_stale_jobs('alice', now + 1, 'Provisioning was interrupted')
+
+        # The executor gets to the job only now
+        run_provisioning_job(app, queued)
+        job = get_provisioning_job('queued')
+        assert job['state'] == 'failed'
+        assert job['message'] == 'Provisioning was interrupted'
+        assert get_db_connection().execute("SELECT COUNT(*) FROM instances WHERE user_id='alice'").fetchone()[0] == 0
+
+def test_worker_refreshes_the_job_it_picks_up(app):
+    with app.app_context():
+        queue_job_of_another_process('alice', time.time() - 60)
+        connection = get_db_connection()
+        connection.execute("UPDATE provisioning_jobs SET state='queued' WHERE id='other'")
+        connection.commit()
+
+        assert start_provisioning_job('other', time.time())
+        assert get_provisioning_job('other')['updated_at'] > time.time() - 5
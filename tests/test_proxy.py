@@ -0,0 +1,40 @@
+import pytest
+from flask import request
+
+from routes.proxy_routes import proxy_bp
+from services.proxy import forwarded_headers
+
+def test_only_the_tool_session_cookie_is_dropped(app):
+    headers = {
+        'Cookie': 'token=juice; Thesis=tool-session; language=en',
+        'Authorization': 'Bearer juice-shop-jwt',
+        'Connection': 'keep-alive',
+        'Accept': 'application/json'
+    }
+    with app.test_request_context('/instance/abc/rest/user', headers=headers):
+        forwarded = forwarded_headers(request)
+
+    assert forwarded['Cookie'] == 'token=juice; language=en'
+    # Juice Shop's frontend authenticates its own API calls with this header
+    assert forwarded['Authorization'] == 'Bearer juice-shop-jwt'
+    assert 'Connection' not in forwarded
+    assert forwarded['Accept'] == 'application/json'
+
+def test_cookie_header_with_only_the_session_cookie_is_dropped(app):
+    with app.test_request_context('/instance/abc/', headers={'Cookie': 'Thesis=tool-session'}):
+        forwarded = forwarded_headers(request)
+
+    assert 'Cookie' not in forwarded
+
+@pytest.mark.parametrize('host,body', [
+    # The token is unknown, so a request on the instance origin gets as far as the route lookup
+    ('instances.example.com', 'Instance not found'),
+    ('lti.example.com', 'Not found')
+])
+def test_instances_are_only_served_on_their_own_origin(app, host, body):
+    app.config.update(PROXY_ENABLED=True, PROXY_BASE_URL='https://instances.example.com')
+    app.register_blueprint(proxy_bp)
+
+    response = app.test_client().get('/instance/unknown/', headers={'Host': host})
+    assert response.status_code == 404
+    assert response.get_data(as_text=True) == body
@@ -0,0 +1,56 @@
+import queue
+import pytest
+
+from services import status_watcher
+from services.status_watcher import check_watched_status, unsubscribe, watched
+
+KEY = ('alice', 'assignment')
+
+@pytest.fixture
+def subscriber():
+    # Watched directly rather than through subscribe(), which would start the watcher thread
+    subscriber = queue.Queue()
+    watched[KEY] = {'subscribers': {subscriber}, 'instance': None, 'challenges': None}
+    yield subscriber
+    watched.clear()
+
+def test_changed_instance_is_recorded_and_pushed(app, subscriber):
+    with app.app_context():
+        check_watched_status(KEY)
+
+    event, instance = subscriber.get_nowait()
+    assert event == 'instance'
+    assert not instance['exists']
+    assert watched[KEY]['instance'] == instance
+
+def test_pair_unwatched_during_the_check_is_not_revived(app, subscriber, monkeypatch):
+    entry = watched[KEY]
+
+    def get_user_instance(user_id):
+        # The last tab closes while the watcher is still checking
+        unsubscribe(*KEY, subscriber)
+        return {'exists': False, 'reason': 'No instance found'}
+
+    monkeypatch.setattr(status_watcher, 'get_user_instance', get_user_instance)
+    with app.app_context():
+        check_watched_status(KEY)
+
+    assert KEY not in watched
+    assert entry['instance'] is None
+    assert subscriber.empty()
+
+def test_instance_is_looked_up_once_per_check(app, subscriber, monkeypatch):
+    from services import challenge_service
+    lookups = []
+
+    def get_user_instance(user_id):
+        lookups.append(user_id)
+        return {'exists': True, 'status': 'running', 'url': 'http://127.0.0.1:4001'}
+
+    monkeypatch.setattr(status_watcher, 'get_user_instance', get_user_instance)
+    monkeypatch.setattr(challenge_service, 'get_user_instance', get_user_instance)
+    monkeypatch.setattr(challenge_service, 'get_instance_challenges', lambda user_id, instance: [])
+    with app.app_context():
+        check_watched_status(KEY)
+
+    assert lookups == ['alice']